@@ -0,0 +1,75 @@
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.signals import request_started
+from django.db import connections
+from events_service.utils.metrics import DB_QUERY_DURATION, REQUEST_DURATION, start_flusher
+
+
+# [seconds] of database time of the request being handled. A context variable, not a per-connection
+# wrapper: async views query from sync_to_async threads, which run in a copy of the request's context.
+query_time = ContextVar('query_time', default=None)
+
+
+def time_queries(execute, sql, params, many, context):
+    total = query_time.get()
+    if total is None:
+        return execute(sql, params, many, context)
+    query_start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        total[0] += time.perf_counter() - query_start
+
+
+def install_query_timer(**kwargs):
+    # request_started runs on the thread of the request's sync code (thread-sensitive under ASGI), whose
+    # connections the queries use. First in the list: execute_wrapper() blocks pop the last wrapper.
+    for connection in connections.all():
+        if time_queries not in connection.execute_wrappers:
+            connection.execute_wrappers.insert(0, time_queries)
+
+
+request_started.connect(install_query_timer)
+
+
+class MetricsMiddleware:
+    """Request latency per route and status, and the database time of each request, into the metrics registry."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        start_flusher()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start_time = time.perf_counter()
+        token = query_time.set([0.0])
+        try:
+            response = self.get_response(request)
+            self.observe(request, response, start_time)
+        finally:
+            query_time.reset(token)
+        return response
+
+    async def __acall__(self, request):
+        start_time = time.perf_counter()
+        token = query_time.set([0.0])
+        try:
+            response = await self.get_response(request)
+            self.observe(request, response, start_time)
+        finally:
+            query_time.reset(token)
+        return response
+
+    @staticmethod
+    def observe(request, response, start_time):
+        # The URL pattern, not the path: label values must stay a small set
+        match = getattr(request, 'resolver_match', None)
+        route = '/' + match.route if match else '<unmatched>'
+        REQUEST_DURATION.observe(time.perf_counter() - start_time, request.method, route, response.status_code)
+        DB_QUERY_DURATION.observe(query_time.get()[0], route)
@@ -1,24 +1,78 @@
+import hashlib
+import math
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.conf import settings
 from django.http import JsonResponse
-from events_service.utils.token_bucket import TokenBucket
+from events_service.utils.token_bucket import LocalBucketStore, SharedBucketStore
 import logging
 
 
 logger = logging.getLogger('rate_limit')
-buckets = {}
+
+
+def bucket_store():
+    if settings.RATE_LIMIT_BACKEND == 'shared':
+        return SharedBucketStore(settings.RATE_LIMIT_SHARED_PATH, settings.RATE_LIMIT_MAX_BUCKETS)
+    return LocalBucketStore(settings.RATE_LIMIT_MAX_BUCKETS)
 
 
 class RateLimitMiddleware:
-    RATE = settings.RATE_LIMIT_RATE
-    CAPACITY = settings.RATE_LIMIT_CAPACITY
+    sync_capable = True
+    async_capable = True
 
     def __init__(self, get_response):
         self.get_response = get_response
+        self.store = bucket_store()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def limit_for(self, request):
+        """(bucket key, rate, capacity) of the request.
+
+        Clients with an API key listed in RATE_LIMIT_KEYS get that limit under their key, everyone
+        else is limited per IP. A RATE_LIMIT_ROUTES prefix gives its route separate buckets.
+        """
+        rate, capacity = settings.RATE_LIMIT_RATE, settings.RATE_LIMIT_CAPACITY
+        route = max((prefix for prefix in settings.RATE_LIMIT_ROUTES if request.path.startswith(prefix)), key=len, default='')
+        if route:
+            rate, capacity = settings.RATE_LIMIT_ROUTES[route]
+        api_key = request.headers.get('X-Api-Key')
+        if api_key and api_key in settings.RATE_LIMIT_KEYS:
+            rate, capacity = settings.RATE_LIMIT_KEYS[api_key]
+            client = 'key:' + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+        else:
+            client = 'ip:' + request.META.get('REMOTE_ADDR', '')
+        return f'{client}|{route}', rate, capacity
 
     def __call__(self, request):
-        ip = request.META.get('REMOTE_ADDR', '')
-        bucket = buckets.setdefault(ip, TokenBucket(self.RATE, self.CAPACITY))
-        if not bucket.consume():
-            logger.warning(f"Rate limit exceeded for IP {ip}")
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.reject(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        # Buckets live in memory (or a local mmap), so taking a token never blocks the event loop
+        return self.reject(request) or await self.get_response(request)
+
+    def reject(self, request):
+        key, rate, capacity = self.limit_for(request)
+        request.rate_limit = (self.store, key, rate, capacity)
+        if not self.store.consume(key, rate, capacity):
+            logger.warning(f"Rate limit exceeded for {key}")
             return JsonResponse({"detail": "Request limit exceeded"}, status=429)
-        return self.get_response(request)
+        return None
+
+
+def charge_events(request, count, paid=1):
+    """Charge `count` ingested events: one token per RATE_LIMIT_EVENTS_PER_TOKEN events, less the `paid` ones (the request's own token).
+
+    The cost is capped at the bucket capacity, so the largest batch needs a full bucket rather than never passing.
+    """
+    limit = getattr(request, 'rate_limit', None)
+    if limit is None:
+        return True
+    store, key, rate, capacity = limit
+    extra = min(math.ceil(count / settings.RATE_LIMIT_EVENTS_PER_TOKEN), capacity) - paid
+    if extra <= 0 or store.consume(key, rate, capacity, extra):
+        return True
+    logger.warning(f"Rate limit exceeded for {key}: batch of {count} events")
+    return False
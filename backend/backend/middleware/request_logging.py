@@ -1,17 +1,58 @@
-import logging
+import re
 import time
+import uuid
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from events_service.utils.structured_logging import request_id
+import logging
 
 
 logger = logging.getLogger('requests')
 
+# Client-supplied X-Request-ID values are kept only when they look like an ID
+REQUEST_ID_PATTERN = re.compile(r'^[\w.:-]{1,64}$')
+
 
 class RequestLoggingMiddleware:
+    """Gives each request an ID (X-Request-ID, echoed in the response) that its log records and Celery tasks carry, and logs it."""
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        start_time = time.time()
-        response = self.get_response(request)
-        duration = (time.time() - start_time) * 1000
-        logger.info(f"{request.method} {request.get_full_path()} completed in {duration:.2f} ms with status {response.status_code}")
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start_time = time.perf_counter()
+        token = self.start(request)
+        try:
+            response = self.get_response(request)
+            self.log(request, response, start_time)
+        finally:
+            request_id.reset(token)
         return response
+
+    async def __acall__(self, request):
+        start_time = time.perf_counter()
+        token = self.start(request)
+        try:
+            response = await self.get_response(request)
+            self.log(request, response, start_time)
+        finally:
+            request_id.reset(token)
+        return response
+
+    @staticmethod
+    def start(request):
+        supplied = request.headers.get('X-Request-ID', '')
+        request.request_id = supplied if REQUEST_ID_PATTERN.match(supplied) else uuid.uuid4().hex
+        return request_id.set(request.request_id)
+
+    def log(self, request, response, start_time):
+        duration = (time.perf_counter() - start_time) * 1000
+        response['X-Request-ID'] = request.request_id
+        logger.info(f"{request.method} {request.get_full_path()} completed in {duration:.2f} ms with status {response.status_code}",
+                    extra={"method": request.method, "path": request.path, "status": response.status_code,
+                           "duration_ms": round(duration, 2)})
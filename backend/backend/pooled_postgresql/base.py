@@ -0,0 +1,170 @@
+"""PostgreSQL backend (psycopg2) whose connections come from a pool per process and database alias.
+
+Django only pools psycopg 3 connections. Here a thread takes a connection from the pool when it first
+queries and gives it back whenever Django closes it: at the end of every request and Celery task,
+whatever CONN_MAX_AGE says. CONN_MAX_AGE bounds how long the pool keeps reusing a connection instead.
+A pool holds at most DATABASE_POOL_SIZE_WEB connections, DATABASE_POOL_SIZE_WORKER in Celery workers;
+0 keeps the stock behaviour, a persistent connection per thread.
+"""
+import os
+import threading
+import time
+from django.conf import settings
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+from events_service.utils.metrics import counter, histogram
+from psycopg2 import extensions
+
+
+POOL_WAIT = histogram('db_pool_wait_seconds', 'Time spent waiting for a pooled database connection', ('database',))
+POOL_TIMEOUTS = counter('db_pool_timeouts_total', 'Pooled connection requests that gave up after DATABASE_POOL_TIMEOUT',
+                        ('database',))
+POOL_OPENED = counter('db_pool_connections_opened_total', 'Connections opened by the pools', ('database',))
+
+_pools = {}
+_process = {'pool_size': 'DATABASE_POOL_SIZE_WEB'}
+# Connections inherited from a parent process: closing them, or letting them be garbage collected,
+# would end the parent's sessions on the shared sockets
+_inherited = []
+
+
+class ConnectionPool:
+    """Up to `size` connections of one alias; a free one is handed out newest first, so idle ones age out."""
+
+    def __init__(self, alias, size, timeout, max_age):
+        self.alias = alias
+        self.size = size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.pid = os.getpid()
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = []
+        self.opened_at = {}
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def get(self, connect):
+        """A free connection, or a new one from `connect()`; waits up to `timeout` seconds while all are taken."""
+        start_time = time.perf_counter()
+        acquired = self.slots.acquire(timeout=self.timeout)
+        POOL_WAIT.observe(time.perf_counter() - start_time, self.alias)
+        if not acquired:
+            POOL_TIMEOUTS.inc(self.alias)
+            raise base.Database.OperationalError(
+                f'No connection of the {self.alias} pool ({self.size}) was free within {self.timeout}s')
+        try:
+            while True:
+                with self.lock:
+                    raw = self.idle.pop() if self.idle else None
+                if raw is None:
+                    break
+                if not raw.closed and not self.expired(raw):
+                    return raw
+                self.discard(raw)
+            raw = connect()
+            self.opened_at[id(raw)] = time.monotonic()
+            POOL_OPENED.inc(self.alias)
+            return raw
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def put(self, raw):
+        """Take back a connection: rolled back if a transaction was left open, closed if broken or too old."""
+        try:
+            reusable = not self.closed and not raw.closed and not self.expired(raw)
+            if reusable:
+                status = raw.get_transaction_status()
+                reusable = status != extensions.TRANSACTION_STATUS_UNKNOWN
+                if reusable and status != extensions.TRANSACTION_STATUS_IDLE:
+                    raw.rollback()
+        except base.Database.Error:
+            reusable = False
+        try:
+            if reusable:
+                with self.lock:
+                    self.idle.append(raw)
+            else:
+                self.discard(raw)
+        finally:
+            self.slots.release()
+
+    def expired(self, raw):
+        return self.max_age is not None and time.monotonic() - self.opened_at.get(id(raw), 0) >= self.max_age
+
+    def discard(self, raw):
+        self.opened_at.pop(id(raw), None)
+        try:
+            raw.close()
+        except base.Database.Error:
+            pass
+
+    def close(self):
+        """Close the free connections; the ones in use are closed when they come back."""
+        self.closed = True
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for raw in idle:
+            self.discard(raw)
+
+
+def close_pools():
+    for key in list(_pools):
+        _pools.pop(key).close()
+
+
+def use_worker_pools():
+    """Size this process's pools with DATABASE_POOL_SIZE_WORKER (Celery workers, from worker_init)."""
+    _process['pool_size'] = 'DATABASE_POOL_SIZE_WORKER'
+    close_pools()
+
+
+def _after_fork():
+    # A forked child (Celery prefork, gunicorn) opens its own connections
+    _inherited.extend(_pools.values())
+    _pools.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    connection_pool = None  # the pool self.connection was taken from
+
+    def get_new_connection(self, conn_params):
+        self.connection_pool = None
+        size = getattr(settings, _process['pool_size'])
+        if self.alias == NO_DB_ALIAS or not size:
+            return super().get_new_connection(conn_params)
+        # Keyed by the connection parameters too: tests switch the alias to the test database
+        key = (self.alias, repr(sorted(conn_params.items())))
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools.setdefault(key, ConnectionPool(self.alias, size, settings.DATABASE_POOL_TIMEOUT,
+                                                         self.settings_dict['CONN_MAX_AGE']))
+        connect = super().get_new_connection
+        raw = pool.get(lambda: connect(conn_params))
+        self.connection_pool = pool
+        return raw
+
+    def connect(self):
+        super().connect()
+        if self.connection_pool is not None:
+            self.close_at = time.monotonic()  # back to the pool when the request or task ends
+
+    def _close(self):
+        pool, self.connection_pool = self.connection_pool, None
+        if pool is None or self.connection is None:
+            return super()._close()
+        raw, self.connection = self.connection, None
+        if pool.pid != os.getpid():
+            _inherited.append(raw)
+            return
+        with self.wrap_database_errors:
+            pool.put(raw)
+
+    def close_pool(self):
+        # Called before the test database is dropped or cloned: no idle connection may stay on it
+        for key in [key for key in _pools if key[0] == self.alias]:
+            _pools.pop(key).close()
+        super().close_pool()
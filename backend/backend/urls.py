@@ -17,7 +17,9 @@ Including another URLconf
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.urls import path, include
+from events_service.views import metrics
 
 
 _info = openapi.Info(title="Events API", default_version='v1')
@@ -26,9 +28,13 @@ schema_view = get_schema_view(_info, public=True, permission_classes=[permission
 
 urlpatterns = [
     path('api/', include('events_service.urls')),
+    path('metrics', metrics, name='metrics'),
 
     # Swagger UI:
     path('swagger/<format>', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
 ]
+
+# runserver served the Swagger UI assets by itself; under uvicorn they come from here (DEBUG only)
+urlpatterns += staticfiles_urlpatterns()
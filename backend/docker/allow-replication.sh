@@ -0,0 +1,3 @@
+#!/bin/bash
+# Lets db-replica stream the WAL of this server (runs once, when the data volume is initialized)
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -0,0 +1,97 @@
+from asgiref.sync import sync_to_async
+from backend.middleware.api_key_auth import APIKeyAuthentication
+from backend.middleware.rate_limiter import charge_events
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from events_service.tasks import enqueue_events
+from events_service.utils.idempotency import claim, complete, fingerprint, release
+from events_service.utils.ingest_pool import count_async, publish_async, validate_async
+from events_service.utils.metrics import record_ingest
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+@csrf_exempt
+@require_POST
+async def ingest_events_async(request):
+    """POST /api/events/async: the ingest endpoint for ASGI servers, with the same contract as POST /api/events.
+
+    Reading the body, broker publishing and database calls are awaited, big batches are validated
+    in a process pool, so thousands of slow clients cost coroutines rather than worker threads. The
+    body is read as one bytes object without DATA_UPLOAD_MAX_MEMORY_SIZE, which the JSON body of the
+    sync view is not subject to either.
+    """
+    logger.info('Ingest events (async)')
+    try:
+        APIKeyAuthentication().authenticate(request)
+    except AuthenticationFailed as exc:
+        return JsonResponse({"detail": str(exc.detail)}, status=status.HTTP_403_FORBIDDEN)
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if not idempotency_key:
+        return await queue_events_async(request)
+    if len(idempotency_key) > 200:
+        return JsonResponse({"error": "Idempotency-Key must be at most 200 characters"}, status=status.HTTP_400_BAD_REQUEST)
+
+    key = 'request:' + idempotency_key
+    request_fingerprint = fingerprint(body(request))
+    record = await sync_to_async(claim)(key, request_fingerprint)
+    if record is not None:
+        if record.status_code is None:
+            return JsonResponse({"error": "A request with this Idempotency-Key is still being processed"},
+                                status=status.HTTP_409_CONFLICT)
+        if record.fingerprint != request_fingerprint:
+            return JsonResponse({"error": "Idempotency-Key was already used for a different batch"},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        logger.info(f'Replayed ingest response for Idempotency-Key {idempotency_key}')
+        return JsonResponse(record.response, status=record.status_code, headers={"Idempotent-Replayed": "true"})
+    try:
+        response = await queue_events_async(request)
+    except Exception:
+        await sync_to_async(release)(key)
+        raise
+    if response.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+        await sync_to_async(release)(key)
+    else:
+        await sync_to_async(complete)(key, response.status_code, response.result)
+    return response
+
+
+def body(request):
+    # ASGIHandler has already spooled the body; read() skips the DATA_UPLOAD_MAX_MEMORY_SIZE check of request.body
+    if not hasattr(request, 'raw_body'):
+        request.raw_body = request.read()
+    return request.raw_body
+
+
+async def queue_events_async(request):
+    # Same order as queue_events: the batch is charged before it is validated
+    try:
+        count = await count_async(body(request))
+    except ValueError:
+        return _response({"error": "Body must be a JSON list of events"}, status.HTTP_400_BAD_REQUEST)
+    if count is None:
+        return _response({"error": "Expected a list of events"}, status.HTTP_400_BAD_REQUEST)
+    if not charge_events(request, count):
+        return _response({"detail": "Request limit exceeded"}, status.HTTP_429_TOO_MANY_REQUESTS)
+    _, valid_events, errors = await validate_async(body(request))
+    partial = request.GET.get('partial', '').lower() in ('1', 'true', 'yes')
+    if errors and (not partial or not valid_events):
+        record_ingest('async', 0, count)
+        return _response({"errors": errors}, status.HTTP_400_BAD_REQUEST)
+    await publish_async(enqueue_events, valid_events)
+    record_ingest('async', len(valid_events), len(errors))
+    result = {"queued": len(valid_events)}
+    if errors:
+        result.update({"rejected": len(errors), "errors": errors})
+    return _response(result, status.HTTP_202_ACCEPTED)
+
+
+def _response(result, status_code):
+    response = JsonResponse(result, status=status_code, safe=False)
+    response.result = result  # kept for the idempotency record
+    return response
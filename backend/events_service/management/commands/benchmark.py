@@ -1,36 +1,204 @@
-import time
-import uuid
-from datetime import timedelta
-from django.core.management.base import BaseCommand
+import io
+import json
+import logging
+import os
+import tempfile
+from datetime import timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
 from django.utils import timezone
-from events_service.models import Event
+from events_service.models import ArchivedPart
+from events_service.utils.benchmarks import (Timer, ensure_month_partitions, parse_scale, read_report, regressions, report,
+                                             summarize, write_report)
+from events_service.utils.cold_storage import archive_day, cold_query
+from events_service.utils.query_plans import check_plans, stats_queries
+from events_service.utils.rollups import refresh_dirty_hours
+from events_service.utils.stats_cache import _shared_cache, local_cache
+from events_service.utils.workload import Workload, serialize, write_csv
+
+
+SCENARIOS = ('import', 'ingest', 'stats', 'cold')
+# Everything derived from events: a run starts from an empty database
+TABLES = ('events', 'event_ids', 'rollup_hourly_users', 'rollup_hourly_event_counts', 'rollup_hourly_segments',
+          'rollup_dirty_hours', 'daily_user_sketches', 'daily_user_bitmaps', 'import_checkpoints', 'idempotency_keys')
+
 
 class Command(BaseCommand):
-    help = 'Benchmark: insert 100k events and calculate DAU'
+    help = ('Benchmark suite: import_events, HTTP ingest and every stats endpoint over multi-month synthetic data, '
+            'with a JSON report and a regression check against a baseline report. Wipes the events tables, so it '
+            'runs only on the database named BENCHMARK_DATABASE_NAME or with --reset')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', default='100k', help='Events in the dataset: 100k, 1m, 10m or a number')
+        parser.add_argument('--days', type=int, default=90, help='The dataset spans this many days up to now')
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS), help='Scenarios to run')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic dataset')
+        parser.add_argument('--users', type=int, default=None, help='Distinct users (scale / 40 by default)')
+        parser.add_argument('--ingest-events', type=int, default=100_000,
+                            help='Events posted to POST /api/events (at most the scale)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Events per ingest request')
+        parser.add_argument('--import-workers', type=int, default=1, help='Worker processes of import_events --copy')
+        parser.add_argument('--repeat', type=int, default=5, help='Requests per stats endpoint and query')
+        parser.add_argument('--report', help='Write the JSON report to this path')
+        parser.add_argument('--baseline', help='JSON report of an earlier run: fail if a scenario regressed')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed p95 growth / throughput drop against the baseline (0.2 = 20%%)')
+        parser.add_argument('--explain', action='store_true',
+                            help='Fail if a stats query has to scan a whole table of 10k+ rows (checked with EXPLAIN)')
+        parser.add_argument('--reset', action='store_true',
+                            help='Truncate the events tables of a database other than BENCHMARK_DATABASE_NAME')
 
     def handle(self, *args, **kwargs):
-        events = []
-        base_time = timezone.now()
-        for i in range(100_000):
-            event = Event(
-                event_id=str(uuid.uuid4()),
-                occurred_at=base_time,
-                user_id=i % 30000,
-                event_type='login',
-                properties={"session_id": "session_id", "country": "UA"}
-            )
-            if i % 4 == 0:
-                base_time = base_time - timedelta(seconds=1)
-            events.append(event)
-
-        Event.objects.all().delete()
-
-        start_time = time.time()
-        Event.objects.bulk_create(events, batch_size=5000)
-        insert_time = time.time() - start_time
-        print(f'Inserted 100k events in {insert_time:.2f} seconds')
-
-        start_time = time.time()
-        dau = (Event.objects.filter(occurred_at__gte=base_time - timedelta(days=1)).values('user_id').distinct().count())
-        query_time = time.time() - start_time
-        print(f'DAU count: {dau} calculated in {query_time:.2f} seconds')
+        self.check_database(kwargs['reset'])
+        scale = parse_scale(kwargs['scale'])
+        ingest_count = min(kwargs['ingest_events'], scale) if 'ingest' in kwargs['scenarios'] else 0
+        end = timezone.now()
+        start = end - timedelta(days=kwargs['days'])
+        self.reset()
+        ensure_month_partitions(start, end)
+
+        results = []
+        logging.disable(logging.INFO)  # one request is three log lines: keep the console readable
+        try:
+            # The dataset is loaded through the importer: its timing is the import scenario
+            events = iter(Workload(scale, start, end, users=kwargs['users'], seed=kwargs['seed']))
+            ingest_events = [next(events) for _ in range(ingest_count)]
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                csv_path = os.path.join(tmp_dir, 'events.csv')
+                with open(csv_path, 'w', newline='', encoding='utf-8') as file:
+                    write_csv(file, events)
+                result = self.run_import(csv_path, scale - ingest_count, kwargs['import_workers'])
+                if 'import' in kwargs['scenarios']:
+                    results.append(result)
+            if ingest_events:
+                results.append(self.run_ingest(ingest_events, kwargs['batch_size']))
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE events')
+            refresh_dirty_hours()  # beat keeps rollups fresh in production
+            if 'stats' in kwargs['scenarios']:
+                results += self.run_stats(start.date(), end.date(), kwargs['repeat'])
+            if kwargs['explain']:
+                self.check_plans(start.date(), end.date())
+            if 'cold' in kwargs['scenarios']:
+                results += self.run_cold(end, kwargs['repeat'])
+        finally:
+            logging.disable(logging.NOTSET)
+
+        for result in results:
+            self.stdout.write(f'{result["name"]:<34} {result["throughput"] or 0:>12,.1f} {result["unit"]:<12} '
+                              f'p50 {result["p50_ms"]:>9.2f} ms  p95 {result["p95_ms"]:>9.2f} ms  p99 {result["p99_ms"]:>9.2f} ms')
+        data = report(results, scale=scale, days=kwargs['days'], seed=kwargs['seed'], batch_size=kwargs['batch_size'])
+        if kwargs['report']:
+            write_report(kwargs['report'], data)
+            self.stdout.write(f'Report written to {kwargs["report"]}')
+        if kwargs['baseline']:
+            found = regressions(data, read_report(kwargs['baseline']), kwargs['threshold'])
+            for name, metric, before, after in found:
+                self.stdout.write(self.style.ERROR(f'{name}: {metric} {before} -> {after}'))
+            if found:
+                raise CommandError(f'{len(found)} regressions beyond {kwargs["threshold"]:.0%} against {kwargs["baseline"]}')
+            self.stdout.write(self.style.SUCCESS(f'No regressions beyond {kwargs["threshold"]:.0%} against {kwargs["baseline"]}'))
+
+    def check_database(self, reset):
+        """Refuse to wipe a database that was not set aside for benchmarks, unless asked to explicitly."""
+        name = connection.settings_dict['NAME']
+        if not reset and name != settings.BENCHMARK_DATABASE_NAME:
+            raise CommandError(f'The benchmark truncates the events tables of {name!r}: set BENCHMARK_DATABASE_NAME '
+                               f'to it or pass --reset')
+
+    def reset(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {", ".join(TABLES)}')
+        # TRUNCATE does not bump the stats day versions: entries cached before it would still match
+        local_cache.clear()
+        if _shared_cache() is not None:
+            _shared_cache().clear()
+
+    def run_import(self, csv_path, count, workers):
+        timer = Timer()
+        with timer:
+            call_command('import_events', csv_path, '--copy', '--force', workers=workers, stdout=io.StringIO())
+        return summarize('import.copy', timer.timings, count)
+
+    def run_ingest(self, events, batch_size):
+        """POST /api/events in batches, the Celery task running inline: request latency includes the insert."""
+        client = Client(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
+        timer = Timer()
+        with override_settings(**benchmark_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)):
+            for offset in range(0, len(events), batch_size):
+                body = json.dumps([serialize(event) for event in events[offset:offset + batch_size]])
+                with timer:
+                    response = client.post(reverse('ingest_events'), body, content_type='application/json')
+                if response.status_code != 202:
+                    raise CommandError(f'Ingest returned {response.status_code}: {response.content[:200]}')
+        return summarize(f'ingest.http.batch{batch_size}', timer.timings, len(events))
+
+    def run_stats(self, first_day, last_day, repeat):
+        """Every stats endpoint over the last month and the whole span, with an empty stats cache on every request."""
+        month_ago = max(first_day, last_day - timedelta(days=30))
+        week = lambda day: str(day - timedelta(days=day.weekday()))
+        queries = {
+            'dau.30d': ('dau_stats', {'from': month_ago, 'to': last_day}),
+            'dau.all': ('dau_stats', {'from': first_day, 'to': last_day}),
+            'dau.all.kyiv': ('dau_stats', {'from': first_day, 'to': last_day, 'tz': 'Europe/Kyiv'}),
+            'dau.all.segment': ('dau_stats', {'from': first_day, 'to': last_day, 'segment': 'country:PL'}),
+            'dau.all.approx': ('dau_stats', {'from': first_day, 'to': last_day, 'mode': 'approx'}),
+            'top-events.30d': ('top_events', {'from': month_ago, 'to': last_day}),
+            'top-events.all.segment': ('top_events', {'from': first_day, 'to': last_day, 'segment': 'country:UA'}),
+            'retention.weekly': ('retention_stats', {'start_date': week(first_day), 'windows': 4}),
+            'retention-matrix.weekly': ('retention_matrix_stats', {'from': week(first_day), 'to': last_day, 'windows': 4}),
+            'unique-users.all': ('unique_users_stats', {'from': first_day, 'to': last_day}),
+            'unique-users.all.approx': ('unique_users_stats', {'from': first_day, 'to': last_day, 'mode': 'approx'}),
+            'active-users.wau.30d': ('active_users_stats', {'from': month_ago, 'to': last_day, 'window': 7}),
+            'funnel.all': ('funnel_stats', {'from': first_day, 'to': last_day, 'steps': 'view_item,add_to_cart,purchase',
+                                            'window': '24h'}),
+        }
+        client = Client(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
+        results = []
+        with override_settings(**benchmark_settings()):
+            for name, (url_name, params) in queries.items():
+                timer = Timer()
+                for _ in range(repeat):
+                    local_cache.clear()
+                    with timer:
+                        response = client.get(reverse(url_name), params)
+                    if response.status_code != 200:
+                        raise CommandError(f'{name} returned {response.status_code}: {response.content[:200]}')
+                results.append(summarize(f'stats.{name}', timer.timings, len(timer.timings), unit='requests'))
+        return results
+
+    def check_plans(self, first_day, last_day):
+        queries = stats_queries(first_day, last_day)
+        full_scans = check_plans(queries, min_rows=10_000)
+        for relation, sql in full_scans:
+            self.stdout.write(f'Full scan of {relation}: {sql}')
+        if full_scans:
+            raise CommandError(f'{len(full_scans)} of {len(queries)} stats queries scan a whole table')
+        self.stdout.write(f'Plan check: {len(queries)} stats queries, all index-bounded')
+
+    def run_cold(self, end, repeat):
+        """Archive the last week to Parquet and count its DAU on the cold tier (DuckDB)."""
+        days = [(end - timedelta(days=i)).astimezone(dt_timezone.utc).date() for i in range(7, 0, -1)]
+        with tempfile.TemporaryDirectory() as cold_dir, override_settings(EVENTS_COLD_STORAGE_DIR=cold_dir):
+            archive_timer, query_timer = Timer(), Timer()
+            archived = 0
+            for day in days:
+                with archive_timer:
+                    archived += archive_day(day)
+            for _ in range(repeat):
+                with query_timer:
+                    cold_query(days, 'SELECT count(DISTINCT user_id) FROM events')
+            ArchivedPart.objects.filter(day__in=days).delete()  # the Parquet files go with cold_dir
+        return [summarize('cold.archive', archive_timer.timings, archived),
+                summarize('cold.dau.7d', query_timer.timings, len(query_timer.timings), unit='queries')]
+
+
+def benchmark_settings(**extra):
+    # The test client's host, no rate limits, no per-query bookkeeping of DEBUG
+    return dict(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], DEBUG=False, RATE_LIMIT_RATE=10 ** 9,
+                RATE_LIMIT_CAPACITY=10 ** 9, RATE_LIMIT_ROUTES={}, RATE_LIMIT_KEYS={}, **extra)
+
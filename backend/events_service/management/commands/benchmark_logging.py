@@ -0,0 +1,82 @@
+import logging
+import os
+import statistics
+import tempfile
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from events_service.utils.structured_logging import BackgroundHandler, RequestIdFilter, SamplingFilter, request_id
+
+
+class StallingStream:
+    """A /dev/null that blocks for `stall` seconds every `every` writes, like a disk flushing its cache."""
+
+    def __init__(self, stream, stall, every=1000):
+        self.stream, self.stall, self.every, self.writes = stream, stall, every, 0
+
+    def write(self, data):
+        self.writes += 1
+        if self.stall and self.writes % self.every == 0:
+            time.sleep(self.stall)
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark: per-request logging cost of synchronous file + console handlers vs the background JSON pipeline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20_000, help='Simulated requests per pipeline')
+        parser.add_argument('--lines', type=int, default=3, help='INFO lines per request (middleware, view, task summary)')
+        parser.add_argument('--sample-rate', type=float, default=0.1, help='LOG_SAMPLE_RATE of the sampled pipeline')
+        parser.add_argument('--stall-ms', type=float, default=5, help='Console stream blocks this long every 1000 writes (0: never)')
+
+    def handle(self, *args, **kwargs):
+        with tempfile.TemporaryDirectory() as tmp_dir, open(os.devnull, 'w') as devnull:
+            stream = StallingStream(devnull, kwargs['stall_ms'] / 1000)
+            console, file = logging.StreamHandler(stream), logging.FileHandler(os.path.join(tmp_dir, 'sync.log'))
+            for handler in (console, file):
+                handler.setFormatter(logging.Formatter('[{asctime}] {levelname} {name}: {message}', style='{'))
+            pipelines = {
+                'sync console + file': [console, file],
+                'background json': [self.background(os.path.join(tmp_dir, 'json.log'), stream, 1.0)],
+                f'background json, sampled {kwargs["sample_rate"]:g}': [
+                    self.background(os.path.join(tmp_dir, 'sampled.log'), stream, kwargs['sample_rate'])],
+            }
+            for name, handlers in pipelines.items():
+                logger = logging.getLogger(f'benchmark_logging.{uuid.uuid4().hex}')
+                logger.propagate = False
+                logger.setLevel(logging.INFO)
+                for handler in handlers:
+                    logger.addHandler(handler)
+                timings = self.run(logger, kwargs['requests'], kwargs['lines'])
+                start_time = time.perf_counter()
+                for handler in handlers:
+                    handler.close()
+                percentiles = statistics.quantiles(timings, n=100)
+                self.stdout.write(f'{name:<30} mean {statistics.fmean(timings):>8.2f} us  p50 {percentiles[49]:>8.2f} us  '
+                                  f'p99 {percentiles[98]:>8.2f} us  max {max(timings):>9.2f} us per request; '
+                                  f'writer drained in {time.perf_counter() - start_time:.2f} s')
+
+    @staticmethod
+    def background(filename, stream, sample_rate):
+        handler = BackgroundHandler(filename=filename, stream=stream, max_queue=1_000_000)
+        handler.addFilter(RequestIdFilter())
+        handler.addFilter(SamplingFilter(sample_rate))
+        return handler
+
+    @staticmethod
+    def run(logger, requests, lines):
+        """Request-thread time of each request's log calls, in microseconds."""
+        timings = []
+        for i in range(requests):
+            token = request_id.set(uuid.uuid4().hex)
+            start_time = time.perf_counter()
+            for line in range(lines):
+                logger.info('GET /api/stats/dau completed in %.2f ms with status %d', 1.5, 200,
+                            extra={"method": "GET", "status": 200})
+            timings.append((time.perf_counter() - start_time) * 1e6)
+            request_id.reset(token)
+        return timings
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from events_service.utils.token_bucket import LocalBucketStore, SharedBucketStore, TokenBucket
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark: TokenBucket.consume and the bucket stores under thread contention'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16], help='Thread counts to run')
+        parser.add_argument('--calls', type=int, default=100_000, help='consume() calls per thread count')
+        parser.add_argument('--clients', type=int, default=1, help='Distinct bucket keys for the stores (1 = all threads contend on one bucket)')
+
+    def handle(self, *args, **kwargs):
+        calls, clients = kwargs['calls'], kwargs['clients']
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shared = SharedBucketStore(os.path.join(tmp_dir, 'buckets'), max(clients * 2, 1024))
+            local = LocalBucketStore(max(clients * 2, 1024))
+            bucket = TokenBucket(1e9, 1e9)
+            targets = {
+                'TokenBucket.consume': lambda i: bucket.consume(),
+                'LocalBucketStore.consume': lambda i: local.consume(f'ip:{i % clients}', 1e9, 1e9),
+                'SharedBucketStore.consume': lambda i: shared.consume(f'ip:{i % clients}', 1e9, 1e9),
+            }
+            for name, target in targets.items():
+                for threads in kwargs['threads']:
+                    elapsed = self.run(target, threads, calls)
+                    self.stdout.write(f'{name:<28} threads={threads:<3} {calls / elapsed:>12,.0f} calls/sec '
+                                      f'{elapsed / calls * 1e6:>8.2f} us/call')
+            shared.close()
+
+    @staticmethod
+    def run(target, threads, calls):
+        per_thread = calls // threads
+
+        def worker(thread_no):
+            for i in range(thread_no * per_thread, (thread_no + 1) * per_thread):
+                target(i)
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            start_time = time.perf_counter()
+            list(executor.map(worker, range(threads)))
+            return time.perf_counter() - start_time
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from events_service.tasks import process_event_batch
+from events_service.utils.dead_letters import purge_dead_letters, read_dead_letters
+from events_service.utils.event_payloads import decode_events
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Inspect, replay or purge ingest chunks parked in the dead-letter queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'replay', 'purge'], nargs='?', default='list',
+                            help='list (default) leaves the queue as is; replay re-queues the chunks for ingest')
+        parser.add_argument('--limit', type=int, default=None, help='Handle at most this many dead letters')
+
+    def handle(self, *args, **kwargs):
+        action, limit = kwargs['action'], kwargs['limit']
+        if action == 'purge':
+            logger.info('CLI. Purging the dead-letter queue')
+            self.stdout.write(self.style.SUCCESS(f'Purged {purge_dead_letters()} dead letters'))
+            return
+
+        listed = 0
+
+        def show(letter):
+            nonlocal listed
+            listed += 1
+            self.stdout.write(f'{letter["task_id"]}  {len(decode_events(letter["payload"]))} events  '
+                              f'failed {letter["failed_at"]} after {letter["retries"]} retries  {letter["error"]}')
+            return False
+
+        def replay(letter):
+            process_event_batch.apply_async((letter['payload'],), compression=settings.INGEST_TASK_COMPRESSION or None)
+            return True
+
+        if action == 'list':
+            read_dead_letters(show, limit)
+            self.stdout.write(self.style.SUCCESS(f'{listed} dead letters'))
+        else:
+            logger.info('CLI. Replaying the dead-letter queue')
+            self.stdout.write(self.style.SUCCESS(f'Replayed {read_dead_letters(replay, limit)} dead letters'))
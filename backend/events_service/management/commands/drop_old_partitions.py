@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from events_service.utils.partitions import drop_partition, ensure_partitions, expired_partitions
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Detach or drop monthly events partitions older than the retention policy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-months', type=int, default=settings.EVENTS_RETENTION_MONTHS,
+                            help='Keep this many whole months before the current one (EVENTS_RETENTION_MONTHS by default)')
+        parser.add_argument('--detach-only', action='store_true', help='Detach partitions but keep them as standalone tables, and the files of their archived parts')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the partitions that would be removed')
+
+    def handle(self, *args, **kwargs):
+        retention_months = kwargs['retention_months']
+        if retention_months is None or retention_months < 0:
+            raise CommandError('Set --retention-months or EVENTS_RETENTION_MONTHS')
+        logger.info(f'CLI. Applying events retention of {retention_months} months')
+        ensure_partitions()
+        expired = expired_partitions(retention_months)
+        for month, name in expired:
+            if kwargs['dry_run']:
+                self.stdout.write(f'Would remove {name}')
+                continue
+            released = drop_partition(month, name, detach_only=kwargs['detach_only'])
+            self.stdout.write(f'{"Detached" if kwargs["detach_only"] else "Dropped"} {name}, released {released} event ids')
+        self.stdout.write(self.style.SUCCESS(f'{len(expired)} partitions older than {retention_months} months'))
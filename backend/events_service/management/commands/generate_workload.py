@@ -0,0 +1,52 @@
+import gzip
+import sys
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.core.management.base import BaseCommand, CommandError
+from events_service.utils.benchmarks import parse_scale
+from events_service.utils.workload import Workload, write_csv, write_ndjson
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Stream a seeded synthetic dataset (Zipf users, daily/weekly cycles, sessions with the sample event mix) '
+            'as CSV for import_events or as NDJSON for POST /api/events')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Output file, '-' for stdout; a .gz suffix compresses it")
+        parser.add_argument('--events', default='1m', help='Number of events: 100k, 1m, 10m or a number')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], default='csv')
+        parser.add_argument('--end', type=datetime.fromisoformat, default=None,
+                            help='End of the time range (ISO datetime, UTC if naive); start of today UTC by default')
+        parser.add_argument('--days', type=int, default=90, help='Length of the time range in days')
+        parser.add_argument('--users', type=int, default=None, help='Distinct users (events / 40 by default)')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of user activity')
+        parser.add_argument('--seed', type=int, default=0, help='Same seed and arguments, same events')
+
+    def handle(self, *args, **kwargs):
+        events = parse_scale(kwargs['events'])
+        end = kwargs['end'] or datetime.now(dt_timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=dt_timezone.utc)
+        if kwargs['days'] < 1 or events < 1:
+            raise CommandError('--days and --events must be positive')
+        start = end - timedelta(days=kwargs['days'])
+        workload = Workload(events, start, end, users=kwargs['users'], zipf=kwargs['zipf'], seed=kwargs['seed'])
+        write = write_csv if kwargs['format'] == 'csv' else write_ndjson
+        logger.info(f'CLI. Generating {events} events from {start} to {end}, seed {kwargs["seed"]}')
+
+        start_time = time.perf_counter()
+        output = kwargs['output']
+        if output == '-':
+            count = write(sys.stdout, workload)
+        else:
+            opener = gzip.open if output.endswith('.gz') else open
+            with opener(output, 'wt', newline='', encoding='utf-8') as file:
+                count = write(file, workload)
+        elapsed = time.perf_counter() - start_time
+        if output != '-':
+            self.stdout.write(self.style.SUCCESS(f'Wrote {count} events ({workload.users} users, {start:%Y-%m-%d} to '
+                                                 f'{end:%Y-%m-%d}) to {output} in {elapsed:.1f}s'))
@@ -1,9 +1,16 @@
 import csv
 import json
-from events_service.models import Event
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from events_service.models import Event, IdempotencyKey, ImportCheckpoint
+from events_service.tasks import warm_stats_cache
+from events_service.utils.csv_import import CHUNK_BYTES, chunk_count, import_chunk, source_key
+from events_service.utils.idempotency import file_fingerprint
 from django.core.management.base import BaseCommand
 from django.utils.dateparse import parse_datetime
-from django.db import transaction
+from django.db import connections, transaction
+from django.db.models import Sum
 import logging
 
 
@@ -11,13 +18,36 @@ logger = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
+    help = 'Import historic events from CSV'
 
     def add_arguments(self, parser):
         parser.add_argument('csv_file_path', type=str, help='Path to CSV with historic data')
+        parser.add_argument('--copy', action='store_true',
+                            help='Stream the file in chunks through COPY into a staging table, resumable via checkpoints')
+        parser.add_argument('--chunk-mb', type=int, default=CHUNK_BYTES // (1024 * 1024), help='Chunk size in MB for --copy')
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes for --copy')
+        parser.add_argument('--restart', action='store_true', help='Drop checkpoints of a previous --copy run of this file')
+        parser.add_argument('--force', action='store_true', help='Import even if a file with the same content was already imported')
 
     def handle(self, *args, **kwargs):
         logger.info('CLI. Importing events.')
         csv_file_path = kwargs['csv_file_path']
+        # A file is recognised by its content hash, so a retried import of the same file is answered without reading a row
+        digest = file_fingerprint(csv_file_path)
+        done = IdempotencyKey.objects.filter(key='file:' + digest, status_code__isnull=False).first()
+        if done and not (kwargs['force'] or kwargs['restart']):
+            logger.info(f'CLI. File {csv_file_path} already imported, sha256 {digest}')
+            self.stdout.write(self.style.SUCCESS(
+                f'File already imported (sha256 {digest}). Imported {done.response["imported"]}, '
+                f'skipped {done.response["skipped"]}, with errors: {done.response["errors"]}'))
+            return
+        if kwargs['copy']:
+            result = self.handle_copy(csv_file_path, kwargs['chunk_mb'] * 1024 * 1024, kwargs['workers'], kwargs['restart'])
+        else:
+            result = self.handle_rows(csv_file_path)
+        IdempotencyKey.objects.update_or_create(key='file:' + digest, defaults={'fingerprint': digest, 'status_code': 200, 'response': result})
+
+    def handle_rows(self, csv_file_path):
         imported_count = 0
         skipped_count = 0
         error_count = 0
@@ -48,3 +78,46 @@ class Command(BaseCommand):
                         continue
         logger.info(f'CLI. Imported {imported_count}, skipped {skipped_count}, with errors: {error_count} events')
         self.stdout.write(self.style.SUCCESS(f'Import finished. Imported {imported_count}, skipped {skipped_count}, with errors: {error_count}'))
+        if imported_count:
+            warm_stats_cache.delay()
+        return {"imported": imported_count, "skipped": skipped_count, "errors": error_count}
+
+    def handle_copy(self, csv_file_path, chunk_bytes, workers, restart):
+        source = source_key(csv_file_path, chunk_bytes)
+        if restart:
+            ImportCheckpoint.objects.filter(source=source).delete()
+        done = set(ImportCheckpoint.objects.filter(source=source).values_list('chunk', flat=True))
+        total_chunks = chunk_count(csv_file_path, chunk_bytes)
+        pending = [chunk_no for chunk_no in range(total_chunks) if chunk_no not in done]
+        if done:
+            self.stdout.write(f'Resuming: {len(done)} of {total_chunks} chunks already imported')
+
+        imported_count = skipped_count = error_count = 0
+        start_time = time.time()
+
+        def report(chunk_no, result):
+            nonlocal imported_count, skipped_count, error_count
+            imported_count += result[0]
+            skipped_count += result[1]
+            error_count += result[2]
+            rows = imported_count + skipped_count + error_count
+            rate = rows / max(time.time() - start_time, 1e-6)
+            self.stdout.write(f'Chunk {chunk_no + 1}/{total_chunks} done: {rows} rows, {rate:.0f} rows/sec')
+
+        if workers > 1:
+            connections.close_all()  # forked workers must open their own connections
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+                futures = {executor.submit(import_chunk, csv_file_path, source, chunk_no, chunk_bytes): chunk_no
+                           for chunk_no in pending}
+                for future in as_completed(futures):
+                    report(futures[future], future.result())
+        else:
+            for chunk_no in pending:
+                report(chunk_no, import_chunk(csv_file_path, source, chunk_no, chunk_bytes))
+
+        logger.info(f'CLI. Imported {imported_count}, skipped {skipped_count}, with errors: {error_count} events')
+        self.stdout.write(self.style.SUCCESS(f'Import finished. Imported {imported_count}, skipped {skipped_count}, with errors: {error_count}'))
+        if imported_count:
+            warm_stats_cache.delay()
+        # A resumed run reports the totals of every chunk, including the ones of the earlier runs
+        return ImportCheckpoint.objects.filter(source=source).aggregate(imported=Sum('imported'), skipped=Sum('skipped'), errors=Sum('errors'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from events_service.utils.sketches import rebuild_sketches
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Rebuild per-day distinct-user sketches from raw events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', required=True, help='First day (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', required=True, help='Last day (YYYY-MM-DD)')
+
+    def handle(self, *args, **kwargs):
+        date_from = parse_date(kwargs['date_from'])
+        date_to = parse_date(kwargs['date_to'])
+        if date_from is None or date_to is None:
+            raise CommandError('--from and --to must be in YYYY-MM-DD format')
+        logger.info(f'CLI. Rebuilding sketches {date_from} - {date_to}')
+        rebuild_sketches(date_from, date_to)
+        self.stdout.write(self.style.SUCCESS(f'Sketches rebuilt for {date_from} - {date_to}'))
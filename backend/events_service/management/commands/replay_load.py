@@ -0,0 +1,145 @@
+import gzip
+import http.client
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from urllib.parse import urlencode, urlsplit
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from events_service.utils.benchmarks import parse_scale, report, summarize, write_report
+from events_service.utils.workload import Workload, serialize
+
+
+STATS_PATHS = ('/api/stats/dau', '/api/stats/top-events', '/api/stats/retention_stats', '/api/stats/retention-matrix',
+               '/api/stats/unique-users', '/api/stats/active-users')
+
+
+class Command(BaseCommand):
+    help = ('Load-test a running server: concurrent clients POST event batches to /api/events and query the stats '
+            'endpoints; reports throughput and latency percentiles')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help='Base URL of the server')
+        parser.add_argument('--api-key', default=settings.ACCESS_API_KEY, help='X-Api-Key (ACCESS_API_KEY by default)')
+        parser.add_argument('--input', help='NDJSON file from generate_workload (.gz ok); a seeded workload is generated otherwise')
+        parser.add_argument('--events', default='100k', help='Events to send when generating: 100k, 1m, 10m or a number')
+        parser.add_argument('--days', type=int, default=30, help='Time range of generated events, up to now')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--concurrency', type=int, default=16, help='Concurrent clients')
+        parser.add_argument('--batch-size', type=int, default=100, help='Events per POST')
+        parser.add_argument('--ndjson', action='store_true', help='Send batches as application/x-ndjson instead of a JSON array')
+        parser.add_argument('--stats-ratio', type=float, default=0.1,
+                            help='Share of requests that query a random stats endpoint instead of posting a batch')
+        parser.add_argument('--duration', type=float, default=None, help='Stop after this many seconds')
+        parser.add_argument('--report', help='Write the JSON report to this path')
+
+    def handle(self, *args, **kwargs):
+        url = urlsplit(kwargs['url'])
+        if url.scheme not in ('http', 'https'):
+            raise CommandError('--url must be http(s)://host[:port]')
+        batches = iter(self.batches(kwargs))
+        batches_lock = threading.Lock()
+        stats_rng = random.Random(kwargs['seed'])
+        deadline = time.monotonic() + kwargs['duration'] if kwargs['duration'] else None
+        timings = {'ingest': [], 'stats': []}
+        statuses = Counter()
+        sent_events = [0]
+        results_lock = threading.Lock()
+
+        def client():
+            connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+            connection = connection_class(url.hostname, url.port, timeout=60)  # keep-alive, like a real SDK
+            headers = {'X-Api-Key': kwargs['api_key']}
+            while deadline is None or time.monotonic() < deadline:
+                with batches_lock:
+                    stats = stats_rng.random() < kwargs['stats_ratio']
+                    if stats:
+                        path = self.stats_query(stats_rng, kwargs['days'])
+                    else:
+                        batch = next(batches, None)
+                        if batch is None:
+                            break
+                start_time = time.perf_counter()
+                try:
+                    if stats:
+                        connection.request('GET', path, headers=headers)
+                    else:
+                        body, content_type = self.encode(batch, kwargs['ndjson'])
+                        connection.request('POST', '/api/events', body=body, headers={**headers, 'Content-Type': content_type})
+                    response = connection.getresponse()
+                    response.read()
+                    status = response.status
+                except (OSError, http.client.HTTPException) as exc:
+                    connection.close()
+                    status = type(exc).__name__
+                elapsed = time.perf_counter() - start_time
+                with results_lock:
+                    timings['stats' if stats else 'ingest'].append(elapsed)
+                    statuses[('stats' if stats else 'ingest', status)] += 1
+                    if not stats and status == 202:
+                        sent_events[0] += len(batch)
+            connection.close()
+
+        start_time = time.perf_counter()
+        threads = [threading.Thread(target=client, name=f'replay-{i}') for i in range(kwargs['concurrency'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_time = time.perf_counter() - start_time
+
+        results = []
+        for kind, samples in timings.items():
+            if samples:
+                result = summarize(f'replay.{kind}', samples, len(samples), unit='requests')
+                result['throughput'] = round(len(samples) / wall_time, 2)  # concurrent requests: per wall-clock second
+                results.append(result)
+                self.stdout.write(f'{kind:<7} {len(samples):>8} requests {result["throughput"]:>10,.1f} req/s  '
+                                  f'p50 {result["p50_ms"]:>8.2f} ms  p95 {result["p95_ms"]:>8.2f} ms  p99 {result["p99_ms"]:>8.2f} ms')
+        self.stdout.write(f'accepted {sent_events[0]} events in {wall_time:.1f}s ({sent_events[0] / wall_time:,.0f} events/s)')
+        self.stdout.write('statuses: ' + ', '.join(f'{kind} {status}: {count}' for (kind, status), count in sorted(statuses.items(), key=str)))
+        if kwargs['report']:
+            write_report(kwargs['report'], report(results, url=kwargs['url'], concurrency=kwargs['concurrency'],
+                                                  batch_size=kwargs['batch_size'], wall_seconds=round(wall_time, 3),
+                                                  accepted_events=sent_events[0],
+                                                  statuses={f'{kind} {status}': count for (kind, status), count in statuses.items()}))
+
+    @staticmethod
+    def batches(kwargs):
+        """Lists of `batch_size` events in the POST /api/events JSON shape."""
+        if kwargs['input']:
+            opener = gzip.open if kwargs['input'].endswith('.gz') else open
+            def events():
+                with opener(kwargs['input'], 'rt', encoding='utf-8') as file:
+                    for line in file:
+                        if line.strip():
+                            yield json.loads(line)
+        else:
+            end = datetime.now(dt_timezone.utc)
+            workload = Workload(parse_scale(kwargs['events']), end - timedelta(days=kwargs['days']), end, seed=kwargs['seed'])
+            events = lambda: map(serialize, workload)
+        iterator = events()
+        while batch := list(itertools.islice(iterator, kwargs['batch_size'])):
+            yield batch
+
+    @staticmethod
+    def encode(batch, ndjson):
+        if ndjson:
+            return ''.join(json.dumps(event, separators=(',', ':')) + '\n' for event in batch).encode(), 'application/x-ndjson'
+        return json.dumps(batch, separators=(',', ':')).encode(), 'application/json'
+
+    @staticmethod
+    def stats_query(rng, days):
+        path = rng.choice(STATS_PATHS)
+        today = datetime.now(dt_timezone.utc).date()
+        date_from = today - timedelta(days=rng.randint(1, days))
+        params = {'from': date_from, 'to': today}
+        if path.endswith('retention_stats'):
+            params = {'start_date': date_from, 'windows': 3}
+        elif rng.random() < 0.3 and path in ('/api/stats/dau', '/api/stats/top-events'):
+            params['segment'] = 'event_type:purchase'
+        return f'{path}?{urlencode(params)}'
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:46
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+MARK_HOURS = '''
+    INSERT INTO rollup_dirty_hours (hour, marked_at)
+    SELECT DISTINCT date_trunc('hour', occurred_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', now() FROM {rows} ORDER BY 1
+    ON CONFLICT (hour) DO UPDATE SET marked_at = EXCLUDED.marked_at;
+'''
+
+CREATE_TRIGGERS = f'''
+CREATE FUNCTION events_mark_dirty_hours() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN {MARK_HOURS.format(rows='new_rows')}
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN {MARK_HOURS.format(rows='old_rows')}
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER events_rollup_insert AFTER INSERT ON events REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION events_mark_dirty_hours();
+CREATE TRIGGER events_rollup_update AFTER UPDATE ON events REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION events_mark_dirty_hours();
+CREATE TRIGGER events_rollup_delete AFTER DELETE ON events REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION events_mark_dirty_hours();
+
+{MARK_HOURS.format(rows='events')}
+'''
+
+DROP_TRIGGERS = '''
+DROP TRIGGER events_rollup_insert ON events;
+DROP TRIGGER events_rollup_update ON events;
+DROP TRIGGER events_rollup_delete ON events;
+DROP FUNCTION events_mark_dirty_hours();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events_service', '0003_import_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyRollupHour',
+            fields=[
+                ('hour', models.DateTimeField(primary_key=True, serialize=False)),
+                ('marked_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'rollup_dirty_hours',
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyActiveUsers',
+            fields=[
+                ('hour', models.DateTimeField(primary_key=True, serialize=False)),
+                ('user_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+            ],
+            options={
+                'db_table': 'rollup_hourly_users',
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyEventCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('event_type', models.CharField(max_length=100)),
+                ('total', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'rollup_hourly_event_counts',
+                'unique_together': {('hour', 'event_type')},
+            },
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS, DROP_TRIGGERS),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events_service', '0004_hourly_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyUserSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('event_type', models.CharField(blank=True, default='', max_length=100)),
+                ('registers', models.BinaryField()),
+            ],
+            options={
+                'db_table': 'daily_user_sketches',
+                'unique_together': {('day', 'event_type')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events_service', '0005_daily_user_sketches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyUserBitmap',
+            fields=[
+                ('day', models.DateField(primary_key=True, serialize=False)),
+                ('bitmap', models.BinaryField()),
+                ('cardinality', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'daily_user_bitmaps',
+            },
+        ),
+        # Existing rollup hours get rebuilt, together with their day bitmaps, on the next refresh
+        migrations.RunSQL("INSERT INTO rollup_dirty_hours (hour, marked_at) SELECT hour, now() FROM rollup_hourly_users "
+                          "ON CONFLICT (hour) DO NOTHING", migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,140 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:53
+
+from django.db import migrations, models
+
+
+# Creates the monthly partition events_pYYYYMM; rows already in events_default for that month are moved into it.
+CREATE_PARTITION_FUNCTION = '''
+CREATE FUNCTION events_ensure_month_partition(month date) RETURNS text AS $$
+DECLARE
+    partition_name text := 'events_p' || to_char(month, 'YYYYMM');
+    lower_bound timestamptz := date_trunc('month', month)::timestamp AT TIME ZONE 'UTC';
+    upper_bound timestamptz := (date_trunc('month', month) + interval '1 month')::timestamp AT TIME ZONE 'UTC';
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+    IF EXISTS (SELECT 1 FROM events_default WHERE occurred_at >= lower_bound AND occurred_at < upper_bound) THEN
+        EXECUTE format('CREATE TABLE %I (LIKE events INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+        EXECUTE format('WITH moved AS (DELETE FROM events_default WHERE occurred_at >= %L AND occurred_at < %L RETURNING *) '
+                       'INSERT INTO %I SELECT * FROM moved', lower_bound, upper_bound, partition_name);
+        EXECUTE format('ALTER TABLE events ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                       partition_name, lower_bound, upper_bound);
+    ELSE
+        EXECUTE format('CREATE TABLE %I PARTITION OF events FOR VALUES FROM (%L) TO (%L)',
+                       partition_name, lower_bound, upper_bound);
+    END IF;
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+'''
+
+# A row is only stored if its event_id was not seen before in any partition; skipped rows are not RETURNed,
+# so INSERT ... ON CONFLICT DO NOTHING RETURNING keeps reporting exactly the created events.
+CREATE_DEDUP_TRIGGERS = '''
+CREATE FUNCTION events_claim_event_id() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO event_ids (event_id, occurred_at) VALUES (NEW.event_id, NEW.occurred_at) ON CONFLICT DO NOTHING;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION events_release_event_ids() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM event_ids WHERE event_id IN (SELECT event_id FROM old_rows);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER events_dedup_insert BEFORE INSERT ON events
+    FOR EACH ROW EXECUTE FUNCTION events_claim_event_id();
+CREATE TRIGGER events_dedup_delete AFTER DELETE ON events REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION events_release_event_ids();
+'''
+
+CREATE_ROLLUP_TRIGGERS = '''
+CREATE TRIGGER events_rollup_insert AFTER INSERT ON events REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION events_mark_dirty_hours();
+CREATE TRIGGER events_rollup_update AFTER UPDATE ON events REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION events_mark_dirty_hours();
+CREATE TRIGGER events_rollup_delete AFTER DELETE ON events REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION events_mark_dirty_hours();
+'''
+
+PARTITION_EVENTS = f'''
+CREATE TABLE events_partitioned (
+    event_id uuid NOT NULL,
+    occurred_at timestamptz NOT NULL,
+    user_id integer NOT NULL,
+    event_type varchar(100) NOT NULL,
+    properties jsonb NOT NULL
+) PARTITION BY RANGE (occurred_at);
+
+ALTER TABLE events RENAME TO events_unpartitioned;
+ALTER TABLE events_unpartitioned RENAME CONSTRAINT events_pkey TO events_unpartitioned_pkey;
+ALTER TABLE events_partitioned RENAME TO events;
+ALTER TABLE events ADD CONSTRAINT events_pkey PRIMARY KEY (event_id, occurred_at);
+CREATE TABLE events_default PARTITION OF events DEFAULT;
+
+{CREATE_PARTITION_FUNCTION}
+
+DO $$
+DECLARE
+    month date;
+BEGIN
+    SELECT coalesce(date_trunc('month', min(occurred_at) AT TIME ZONE 'UTC'), date_trunc('month', now() AT TIME ZONE 'UTC'))
+        INTO month FROM events_unpartitioned;
+    WHILE month <= date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months' LOOP
+        PERFORM events_ensure_month_partition(month);
+        month := month + interval '1 month';
+    END LOOP;
+END;
+$$;
+
+INSERT INTO events (event_id, occurred_at, user_id, event_type, properties)
+SELECT event_id, occurred_at, user_id, event_type, properties FROM events_unpartitioned;
+INSERT INTO event_ids (event_id, occurred_at) SELECT event_id, occurred_at FROM events_unpartitioned;
+
+-- Same index names as before, now defined on the partitioned parent and cascaded to every partition
+DO $$
+DECLARE
+    r record;
+BEGIN
+    FOR r IN SELECT indexname, indexdef FROM pg_indexes
+             WHERE schemaname = current_schema() AND tablename = 'events_unpartitioned' AND indexname <> 'events_unpartitioned_pkey'
+    LOOP
+        EXECUTE format('ALTER INDEX %I RENAME TO %I', r.indexname, left('unpartitioned_' || r.indexname, 63));
+        EXECUTE regexp_replace(r.indexdef, ' ON \\S+ ', ' ON events ');
+    END LOOP;
+END;
+$$;
+
+DROP TABLE events_unpartitioned;
+
+{CREATE_DEDUP_TRIGGERS}
+{CREATE_ROLLUP_TRIGGERS}
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events_service', '0006_daily_user_bitmaps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventId',
+            fields=[
+                ('event_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('occurred_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'db_table': 'event_ids',
+            },
+        ),
+        migrations.RunSQL(PARTITION_EVENTS),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+# Compaction deletes events with events_service.archiving = 'on': the rows move to Parquet, so their
+# rollup hours stay valid and their event_ids stay claimed.
+SKIP_WHILE_ARCHIVING = '''
+CREATE OR REPLACE FUNCTION events_mark_dirty_hours() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' AND current_setting('events_service.archiving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO rollup_dirty_hours (hour, marked_at)
+        SELECT DISTINCT date_trunc('hour', occurred_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', now() FROM new_rows ORDER BY 1
+        ON CONFLICT (hour) DO UPDATE SET marked_at = EXCLUDED.marked_at;
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO rollup_dirty_hours (hour, marked_at)
+        SELECT DISTINCT date_trunc('hour', occurred_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', now() FROM old_rows ORDER BY 1
+        ON CONFLICT (hour) DO UPDATE SET marked_at = EXCLUDED.marked_at;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION events_release_event_ids() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('events_service.archiving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    DELETE FROM event_ids WHERE event_id IN (SELECT event_id FROM old_rows);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events_service', '0007_partition_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('rows', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'archived_parts',
+            },
+        ),
+        migrations.RunSQL(SKIP_WHILE_ARCHIVING),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:02
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events_service', '0008_archived_parts'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='event',
+            name='events_event_t_446764_idx',
+        ),
+        migrations.AlterUniqueTogether(
+            name='hourlyeventcount',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='event_type',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='occurred_at',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=django.contrib.postgres.indexes.BrinIndex(autosummarize=True, fields=['occurred_at'], name='events_occurred_at_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['event_type', 'occurred_at'], include=('user_id',), name='events_type_time_user_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='hourlyeventcount',
+            constraint=models.UniqueConstraint(fields=('hour', 'event_type'), include=('total',), name='rollup_counts_hour_type_uniq'),
+        ),
+    ]
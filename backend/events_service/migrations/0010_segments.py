@@ -0,0 +1,93 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:05
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import django.db.models.fields.json
+from django.db import migrations, models
+
+
+# Partitions created by LIKE must carry the generated columns too, and moved rows only supply the stored ones
+CREATE_PARTITION_FUNCTION = '''
+CREATE OR REPLACE FUNCTION events_ensure_month_partition(month date) RETURNS text AS $$
+DECLARE
+    partition_name text := 'events_p' || to_char(month, 'YYYYMM');
+    lower_bound timestamptz := date_trunc('month', month)::timestamp AT TIME ZONE 'UTC';
+    upper_bound timestamptz := (date_trunc('month', month) + interval '1 month')::timestamp AT TIME ZONE 'UTC';
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+    IF EXISTS (SELECT 1 FROM events_default WHERE occurred_at >= lower_bound AND occurred_at < upper_bound) THEN
+        EXECUTE format('CREATE TABLE %I (LIKE events INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)', partition_name);
+        EXECUTE format('WITH moved AS (DELETE FROM events_default WHERE occurred_at >= %L AND occurred_at < %L RETURNING *) '
+                       'INSERT INTO %I (event_id, occurred_at, user_id, event_type, properties) '
+                       'SELECT event_id, occurred_at, user_id, event_type, properties FROM moved',
+                       lower_bound, upper_bound, partition_name);
+        EXECUTE format('ALTER TABLE events ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                       partition_name, lower_bound, upper_bound);
+    ELSE
+        EXECUTE format('CREATE TABLE %I PARTITION OF events FOR VALUES FROM (%L) TO (%L)',
+                       partition_name, lower_bound, upper_bound);
+    END IF;
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events_service', '0009_stats_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlySegmentRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('country', models.TextField(blank=True, default='')),
+                ('event_type', models.CharField(max_length=100)),
+                ('total', models.IntegerField(default=0)),
+                ('user_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+            ],
+            options={
+                'db_table': 'rollup_hourly_segments',
+            },
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='country',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.fields.json.KeyTextTransform('country', 'properties'), output_field=models.TextField()),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='session_id',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.fields.json.KeyTextTransform('session_id', 'properties'), output_field=models.TextField()),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['country', 'occurred_at'], include=('user_id',), name='events_country_time_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['session_id'], name='events_session_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['properties'], name='events_properties_gin', opclasses=['jsonb_path_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='hourlysegmentrollup',
+            index=models.Index(fields=['country', 'hour'], name='rollup_segments_country_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='hourlysegmentrollup',
+            constraint=models.UniqueConstraint(fields=('hour', 'country', 'event_type'), name='rollup_segments_hour_country_type_uniq'),
+        ),
+        migrations.RunSQL(CREATE_PARTITION_FUNCTION),
+        # Existing rollup hours get rebuilt, now with their segment rollups, on the next refresh
+        migrations.RunSQL("INSERT INTO rollup_dirty_hours (hour, marked_at) SELECT hour, now() FROM rollup_hourly_users "
+                          "ON CONFLICT (hour) DO NOTHING", migrations.RunSQL.noop),
+    ]
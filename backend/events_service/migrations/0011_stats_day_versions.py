@@ -0,0 +1,53 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+MARK_HOURS_AND_DAYS = '''
+    INSERT INTO rollup_dirty_hours (hour, marked_at)
+    SELECT DISTINCT date_trunc('hour', occurred_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', now() FROM {rows} ORDER BY 1
+    ON CONFLICT (hour) DO UPDATE SET marked_at = EXCLUDED.marked_at;
+    INSERT INTO stats_day_versions (day, version)
+    SELECT day, nextval('stats_day_versions_seq') FROM (SELECT DISTINCT (occurred_at AT TIME ZONE 'UTC')::date AS day FROM {rows}) days
+    ORDER BY day
+    ON CONFLICT (day) DO UPDATE SET version = EXCLUDED.version;
+'''
+
+# Versions come from a sequence, so a number is never handed out twice, not even after a rollback
+BUMP_DAY_VERSIONS = f'''
+CREATE SEQUENCE stats_day_versions_seq;
+
+CREATE OR REPLACE FUNCTION events_mark_dirty_hours() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' AND current_setting('events_service.archiving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN {MARK_HOURS_AND_DAYS.format(rows='new_rows')}
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN {MARK_HOURS_AND_DAYS.format(rows='old_rows')}
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events_service', '0010_segments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatsDayVersion',
+            fields=[
+                ('day', models.DateField(primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField()),
+            ],
+            options={
+                'db_table': 'stats_day_versions',
+            },
+        ),
+        migrations.RunSQL(BUMP_DAY_VERSIONS),
+    ]
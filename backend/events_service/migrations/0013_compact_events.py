@@ -0,0 +1,235 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:20
+
+import events_service.models
+from django.db import migrations, models
+
+
+# Rewriting 8 MB of a partition per statement keeps every row lock and WAL burst short
+BATCH_BLOCKS = 1024
+
+EVENT_TYPES = ('add_to_cart', 'app_open', 'login', 'logout', 'message_sent', 'purchase', 'view_item')
+
+EVENT_TYPE_ID_FUNCTION = '''
+CREATE FUNCTION events_type_id(type_name text) RETURNS smallint AS $$
+DECLARE
+    type_id smallint;
+BEGIN
+    SELECT id INTO type_id FROM event_types WHERE name = type_name;
+    IF NOT FOUND THEN
+        INSERT INTO event_types (name) VALUES (type_name) ON CONFLICT (name) DO NOTHING;
+        SELECT id INTO type_id FROM event_types WHERE name = type_name;
+    END IF;
+    RETURN type_id;
+END;
+$$ LANGUAGE plpgsql;
+'''
+
+# Moves the typed properties out of the JSONB: strings, and prices a double holds exactly
+COMPACT_PROPERTIES = '''
+    IF jsonb_typeof(NEW.properties -> 'country') = 'string' THEN
+        NEW.country := NEW.properties ->> 'country';
+        NEW.properties := NEW.properties - 'country';
+    END IF;
+    IF jsonb_typeof(NEW.properties -> 'session_id') = 'string' THEN
+        NEW.session_id := NEW.properties ->> 'session_id';
+        NEW.properties := NEW.properties - 'session_id';
+    END IF;
+    IF jsonb_typeof(NEW.properties -> 'currency') = 'string' THEN
+        NEW.currency := NEW.properties ->> 'currency';
+        NEW.properties := NEW.properties - 'currency';
+    END IF;
+    IF jsonb_typeof(NEW.properties -> 'price') = 'number' THEN
+        price_value := (NEW.properties ->> 'price')::numeric;
+        IF abs(price_value) < 1e300 AND price_value::float8::numeric = price_value THEN
+            NEW.price := price_value::float8;
+            NEW.properties := NEW.properties - 'price';
+        END IF;
+    END IF;
+'''
+
+# While the old event_type column exists, rows written with a name (by processes still running the
+# previous code, or touched by the backfill) get its id and drop the name
+COMPACT_TRIGGER = f'''
+CREATE FUNCTION events_compact() RETURNS trigger AS $$
+DECLARE
+    price_value numeric;
+BEGIN
+    IF NEW.event_type IS NOT NULL THEN
+        NEW.event_type_id := events_type_id(NEW.event_type);
+        NEW.event_type := NULL;
+    END IF;
+    {COMPACT_PROPERTIES}
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER events_compact BEFORE INSERT OR UPDATE ON events
+    FOR EACH ROW EXECUTE FUNCTION events_compact();
+'''
+
+FINAL_COMPACT_FUNCTION = f'''
+CREATE OR REPLACE FUNCTION events_compact() RETURNS trigger AS $$
+DECLARE
+    price_value numeric;
+BEGIN
+    {COMPACT_PROPERTIES}
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+'''
+
+# Moved rows are copied column by column, whatever the current layout of events is
+CREATE_PARTITION_FUNCTION = '''
+CREATE OR REPLACE FUNCTION events_ensure_month_partition(month date) RETURNS text AS $$
+DECLARE
+    partition_name text := 'events_p' || to_char(month, 'YYYYMM');
+    lower_bound timestamptz := date_trunc('month', month)::timestamp AT TIME ZONE 'UTC';
+    upper_bound timestamptz := (date_trunc('month', month) + interval '1 month')::timestamp AT TIME ZONE 'UTC';
+    columns text;
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+    IF EXISTS (SELECT 1 FROM events_default WHERE occurred_at >= lower_bound AND occurred_at < upper_bound) THEN
+        SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO columns FROM pg_attribute
+        WHERE attrelid = 'events'::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+        EXECUTE format('CREATE TABLE %I (LIKE events INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)', partition_name);
+        EXECUTE format('WITH moved AS (DELETE FROM events_default WHERE occurred_at >= %L AND occurred_at < %L RETURNING *) '
+                       'INSERT INTO %I (%s) SELECT %s FROM moved',
+                       lower_bound, upper_bound, partition_name, columns, columns);
+        EXECUTE format('ALTER TABLE events ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                       partition_name, lower_bound, upper_bound);
+    ELSE
+        EXECUTE format('CREATE TABLE %I PARTITION OF events FOR VALUES FROM (%L) TO (%L)',
+                       partition_name, lower_bound, upper_bound);
+    END IF;
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+'''
+
+# Metadata-only changes: new nullable columns, the generated columns keep their stored values
+EXPAND = f'''
+INSERT INTO event_types (name) VALUES {", ".join(f"('{name}')" for name in EVENT_TYPES)};
+
+ALTER TABLE events ADD COLUMN event_type_id smallint,
+                   ADD COLUMN price double precision,
+                   ADD COLUMN currency text,
+                   ALTER COLUMN country DROP EXPRESSION,
+                   ALTER COLUMN session_id DROP EXPRESSION,
+                   ALTER COLUMN event_type DROP NOT NULL,
+                   ADD CONSTRAINT events_event_type_id_not_null CHECK (event_type_id IS NOT NULL) NOT VALID;
+
+{EVENT_TYPE_ID_FUNCTION}
+{COMPACT_TRIGGER}
+{CREATE_PARTITION_FUNCTION}
+'''
+
+# The validated check lets SET NOT NULL skip its scan; the old column takes its index along
+CONTRACT = f'''
+ALTER TABLE events ALTER COLUMN event_type_id SET NOT NULL;
+ALTER TABLE events DROP CONSTRAINT events_event_type_id_not_null;
+{FINAL_COMPACT_FUNCTION}
+ALTER TABLE events DROP COLUMN event_type;
+ALTER INDEX events_type_id_time_user_idx RENAME TO events_type_time_user_idx;
+'''
+
+
+def _partitions(cursor):
+    cursor.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                   "WHERE i.inhparent = 'events'::regclass ORDER BY c.relname")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def compact_rows(apps, schema_editor):
+    """Rewrite the rows still holding an event type name, a block range of one partition per transaction.
+
+    Updating the partitions rather than events fires the events_compact row trigger, but not the
+    statement triggers of the parent: the rewrite marks no rollup hours dirty and bumps no stats
+    day versions. Rows moved by an update land past the scanned range already compact.
+    """
+    quote_name = schema_editor.connection.ops.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        for partition in _partitions(cursor):
+            block = 0
+            while True:
+                cursor.execute("SELECT pg_relation_size(%s) / current_setting('block_size')::int", [partition])
+                if block >= cursor.fetchone()[0]:
+                    break
+                cursor.execute(f'UPDATE {quote_name(partition)} SET event_type = event_type '
+                               f'WHERE ctid >= %s::tid AND ctid < %s::tid AND event_type IS NOT NULL',
+                               [f'({block},0)', f'({block + BATCH_BLOCKS},0)'])
+                block += BATCH_BLOCKS
+            cursor.execute(f'VACUUM (ANALYZE) {quote_name(partition)}')  # the old row versions become free space
+        cursor.execute('ALTER TABLE events VALIDATE CONSTRAINT events_event_type_id_not_null')
+
+
+def create_type_index(apps, schema_editor):
+    """(event_type_id, occurred_at) INCLUDE (user_id) on every partition without blocking writes, then on events."""
+    quote_name = schema_editor.connection.ops.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('CREATE INDEX IF NOT EXISTS events_type_id_time_user_idx ON ONLY events '
+                       '(event_type_id, occurred_at) INCLUDE (user_id)')
+        for partition in _partitions(cursor):
+            index = quote_name(f'{partition}_type_time_user_idx')
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {index}')  # left invalid by an interrupted run
+            cursor.execute(f'CREATE INDEX CONCURRENTLY {index} ON {quote_name(partition)} '
+                           f'(event_type_id, occurred_at) INCLUDE (user_id)')
+            cursor.execute(f'ALTER INDEX events_type_id_time_user_idx ATTACH PARTITION {index}')
+
+
+class Migration(migrations.Migration):
+    # Online rewrite: the batches commit one by one and indexes are built concurrently
+    atomic = False
+
+    dependencies = [
+        ('events_service', '0012_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventType',
+            fields=[
+                ('id', models.SmallAutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+            options={
+                'db_table': 'event_types',
+            },
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(EXPAND),
+                migrations.RunPython(compact_rows, migrations.RunPython.noop),
+                migrations.RunPython(create_type_index, migrations.RunPython.noop),
+                migrations.RunSQL(CONTRACT),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='event',
+                    name='event_type',
+                    field=events_service.models.EventTypeField(db_column='event_type_id'),
+                ),
+                migrations.AlterField(
+                    model_name='event',
+                    name='country',
+                    field=models.TextField(null=True),
+                ),
+                migrations.AlterField(
+                    model_name='event',
+                    name='session_id',
+                    field=models.TextField(null=True),
+                ),
+                migrations.AddField(
+                    model_name='event',
+                    name='price',
+                    field=models.FloatField(null=True),
+                ),
+                migrations.AddField(
+                    model_name='event',
+                    name='currency',
+                    field=models.TextField(null=True),
+                ),
+            ],
+        ),
+    ]
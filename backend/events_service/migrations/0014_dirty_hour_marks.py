@@ -0,0 +1,68 @@
+# Generated by Django 5.2.7 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+# A mark per hour and writing transaction: concurrent writers never update the same row, and an
+# uncommitted mark is invisible to the refresh, which only takes the hours of committed writes
+MARK_HOURS_AND_DAYS = '''
+    INSERT INTO rollup_dirty_hours (hour, transaction_id)
+    SELECT DISTINCT date_trunc('hour', occurred_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', txid_current() FROM {rows}
+    ON CONFLICT (hour, transaction_id) DO NOTHING;
+    INSERT INTO stats_day_versions (day, version)
+    SELECT day, nextval('stats_day_versions_seq') FROM (SELECT DISTINCT (occurred_at AT TIME ZONE 'UTC')::date AS day FROM {rows}) days
+    ORDER BY day
+    ON CONFLICT (day) DO UPDATE SET version = EXCLUDED.version;
+'''
+
+PER_TRANSACTION_MARKS = f'''
+ALTER TABLE rollup_dirty_hours DROP CONSTRAINT rollup_dirty_hours_pkey,
+                               DROP COLUMN marked_at,
+                               ADD COLUMN id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                               ADD COLUMN transaction_id bigint NOT NULL DEFAULT 0;
+ALTER TABLE rollup_dirty_hours ALTER COLUMN transaction_id DROP DEFAULT,
+                               ADD CONSTRAINT rollup_dirty_hours_hour_transaction_uniq UNIQUE (hour, transaction_id);
+
+CREATE OR REPLACE FUNCTION events_mark_dirty_hours() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' AND current_setting('events_service.archiving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN {MARK_HOURS_AND_DAYS.format(rows='new_rows')}
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN {MARK_HOURS_AND_DAYS.format(rows='old_rows')}
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events_service', '0013_compact_events'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunSQL(PER_TRANSACTION_MARKS)],
+            state_operations=[
+                migrations.DeleteModel(
+                    name='DirtyRollupHour',
+                ),
+                migrations.CreateModel(
+                    name='DirtyRollupHour',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('hour', models.DateTimeField()),
+                        ('transaction_id', models.BigIntegerField()),
+                    ],
+                    options={
+                        'db_table': 'rollup_dirty_hours',
+                        'constraints': [models.UniqueConstraint(fields=('hour', 'transaction_id'), name='rollup_dirty_hours_hour_transaction_uniq')],
+                    },
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+
+# Stats day versions are bumped by refresh_dirty_hours for the days it rebuilds, no longer by every
+# write: an upsert of the day's row made concurrent writers of one day queue on that row's lock
+MARK_HOURS = '''
+    INSERT INTO rollup_dirty_hours (hour, transaction_id)
+    SELECT DISTINCT date_trunc('hour', occurred_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', txid_current() FROM {rows}
+    ON CONFLICT (hour, transaction_id) DO NOTHING;
+'''
+
+MARK_HOURS_ONLY = f'''
+CREATE OR REPLACE FUNCTION events_mark_dirty_hours() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' AND current_setting('events_service.archiving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN {MARK_HOURS.format(rows='new_rows')}
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN {MARK_HOURS.format(rows='old_rows')}
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events_service', '0014_dirty_hour_marks'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MARK_HOURS_ONLY),
+    ]
@@ -1,20 +1,230 @@
-from django.db import models
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import BrinIndex, GinIndex
+from django.db import models, router
 from django.db.models import JSONField
+from events_service.utils.event_layout import event_type_id, event_type_name
+
+
+class EventType(models.Model):
+    # Dictionary of event type names: events store the two-byte id instead of the name
+    id = models.SmallAutoField(primary_key=True)
+    name = models.CharField(max_length=100, unique=True)
+
+    class Meta:
+        db_table = 'event_types'
+
+    def __str__(self):
+        return self.name
+
+
+class EventTypeField(models.SmallIntegerField):
+    """Event type name in Python, id of its event_types row in the database.
+
+    Saved names go through events_type_id(), which registers unknown ones; lookups resolve names
+    through the cached event_type_id(), and a name that was never stored matches nothing.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else event_type_name(value)
+
+    def to_python(self, value):
+        return event_type_name(value) if isinstance(value, int) else value
+
+    def get_prep_value(self, value):
+        if not isinstance(value, str):
+            return super().get_prep_value(value)
+        return event_type_id(value, router.db_for_read(EventType))
+
+    def get_db_prep_save(self, value, connection):
+        return self.to_python(value)
+
+    def get_placeholder(self, value, compiler, connection):
+        return 'events_type_id(%s)'
+
 
 class Event(models.Model):
     event_id = models.UUIDField(primary_key=True, editable=False)
-    occurred_at = models.DateTimeField(db_index=True)
+    occurred_at = models.DateTimeField()
     user_id = models.IntegerField(db_index=True)
-    event_type = models.CharField(max_length=100, db_index=True)
+    event_type = EventTypeField(db_column='event_type_id')
+    # Properties without a typed column; the events_compact trigger moves the typed ones out of it on write
     properties = JSONField(default=dict, blank=True)
+    # Hot properties in typed columns (see utils.event_layout.TYPED_PROPERTIES), null when absent or of another type
+    country = models.TextField(null=True)
+    session_id = models.TextField(null=True)
+    price = models.FloatField(null=True)
+    currency = models.TextField(null=True)
 
     class Meta:
         db_table = 'events'
         indexes = [
-            models.Index(fields=['occurred_at', 'user_id']),
-            models.Index(fields=['event_type', 'occurred_at']),
+            # Events arrive roughly in time order, so a BRIN index answers wide time ranges for a few pages
+            BrinIndex(fields=['occurred_at'], name='events_occurred_at_brin', autosummarize=True),
+            # Covering indexes: (time range -> users) for DAU and (type, time range -> users) for per-type stats
+            models.Index(fields=['occurred_at', 'user_id'], name='events_occurre_8a8e90_idx'),
+            models.Index(fields=['event_type', 'occurred_at'], include=['user_id'], name='events_type_time_user_idx'),
+            models.Index(fields=['country', 'occurred_at'], include=['user_id'], name='events_country_time_user_idx'),
+            models.Index(fields=['session_id'], name='events_session_id_idx'),
+            # Containment (@>) filters on any other property key
+            GinIndex(fields=['properties'], opclasses=['jsonb_path_ops'], name='events_properties_gin'),
         ]
 
     def __str__(self):
         return f"Event {self.event_type} by {self.user_id} at {self.occurred_at}"
 
+
+class ImportCheckpoint(models.Model):
+    source = models.CharField(max_length=255)
+    chunk = models.IntegerField()
+    imported = models.IntegerField(default=0)
+    skipped = models.IntegerField(default=0)
+    errors = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'import_checkpoints'
+        unique_together = ('source', 'chunk')
+
+    def __str__(self):
+        return f"Checkpoint {self.source} chunk {self.chunk}"
+
+
+class HourlyActiveUsers(models.Model):
+    hour = models.DateTimeField(primary_key=True)
+    user_ids = ArrayField(models.IntegerField(), default=list)
+
+    class Meta:
+        db_table = 'rollup_hourly_users'
+
+    def __str__(self):
+        return f"{len(self.user_ids)} users at {self.hour}"
+
+
+class HourlyEventCount(models.Model):
+    hour = models.DateTimeField()
+    event_type = models.CharField(max_length=100)
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'rollup_hourly_event_counts'
+        # Including total lets top-events sum an hour range with an index-only scan
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'event_type'], include=['total'], name='rollup_counts_hour_type_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.total} {self.event_type} at {self.hour}"
+
+
+class HourlySegmentRollup(models.Model):
+    # Events pre-segmented by country and event_type: segment filters on these keys never touch raw events
+    hour = models.DateTimeField()
+    country = models.TextField(blank=True, default='')  # '' for events without a country
+    event_type = models.CharField(max_length=100)
+    total = models.IntegerField(default=0)
+    user_ids = ArrayField(models.IntegerField(), default=list)
+
+    class Meta:
+        db_table = 'rollup_hourly_segments'
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'country', 'event_type'], name='rollup_segments_hour_country_type_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['country', 'hour'], name='rollup_segments_country_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.total} {self.event_type} from {self.country or '?'} at {self.hour}"
+
+
+class DirtyRollupHour(models.Model):
+    # Marked by the events triggers, one row per hour and writing transaction; refresh_dirty_hours consumes them
+    hour = models.DateTimeField()
+    transaction_id = models.BigIntegerField()
+
+    class Meta:
+        db_table = 'rollup_dirty_hours'
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'transaction_id'], name='rollup_dirty_hours_hour_transaction_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Dirty rollup hour {self.hour}"
+
+
+class DailyUserSketch(models.Model):
+    day = models.DateField()
+    event_type = models.CharField(max_length=100, blank=True, default='')  # '' is the sketch over all event types
+    registers = models.BinaryField()
+
+    class Meta:
+        db_table = 'daily_user_sketches'
+        unique_together = ('day', 'event_type')
+
+    def __str__(self):
+        return f"User sketch {self.day} {self.event_type or '*'}"
+
+
+class DailyUserBitmap(models.Model):
+    day = models.DateField(primary_key=True)
+    bitmap = models.BinaryField()
+    cardinality = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'daily_user_bitmaps'
+
+    def __str__(self):
+        return f"User bitmap {self.day} ({self.cardinality} users)"
+
+
+class EventId(models.Model):
+    # Global event_id index: the partitioned events table can only enforce (event_id, occurred_at)
+    event_id = models.UUIDField(primary_key=True)
+    occurred_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'event_ids'
+
+    def __str__(self):
+        return str(self.event_id)
+
+
+class ArchivedPart(models.Model):
+    # Parquet file holding events moved out of Postgres; path is relative to EVENTS_COLD_STORAGE_DIR
+    day = models.DateField(db_index=True)
+    path = models.CharField(max_length=255, unique=True)
+    rows = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'archived_parts'
+
+    def __str__(self):
+        return f"Archived part {self.path} ({self.rows} events)"
+
+
+class StatsDayVersion(models.Model):
+    # Bumped by refresh_dirty_hours for every UTC day whose rollups it rebuilds; cached stats of the day are keyed by it
+    day = models.DateField(primary_key=True)
+    version = models.BigIntegerField()
+
+    class Meta:
+        db_table = 'stats_day_versions'
+
+    def __str__(self):
+        return f"Stats of {self.day} at version {self.version}"
+
+
+class IdempotencyKey(models.Model):
+    # Result of an ingest request sent with an Idempotency-Key header ('request:<key>'), or of an import_events run ('file:<sha256>')
+    key = models.CharField(max_length=255, primary_key=True)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.IntegerField(null=True)  # null while the first request is still in flight
+    response = models.JSONField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = 'idempotency_keys'
+
+    def __str__(self):
+        return f"Idempotency key {self.key} ({self.status_code})"
@@ -1,7 +1,12 @@
 from rest_framework import serializers
+from rest_framework.fields import SkipField
 from .models import Event
 
 
+ALLOWED_EVENT_TYPES = frozenset({"add_to_cart", "app_open", "login", "logout", "message_sent", "purchase", "view_item"})
+REQUIRED_PROPERTIES = ("country", "session_id")
+
+
 class EventSerializer(serializers.ModelSerializer):
     event_id = serializers.UUIDField()
     occurred_at = serializers.DateTimeField()
@@ -14,16 +19,65 @@ class EventSerializer(serializers.ModelSerializer):
         fields = ['event_id', 'occurred_at', 'user_id', 'event_type', 'properties']
 
     def validate_event_type(self, value):
-        allowed_types = {"add_to_cart", "app_open", "login", "logout", "message_sent", "purchase", "view_item"}
-        if value not in allowed_types:
-            raise serializers.ValidationError(f"'event_type' must be one of {allowed_types}")
+        if value not in ALLOWED_EVENT_TYPES:
+            raise serializers.ValidationError(f"'event_type' must be one of {set(ALLOWED_EVENT_TYPES)}")
         return value
 
     def validate_properties(self, value):
         if not isinstance(value, dict):
             raise serializers.ValidationError("'properties' must be a dictionary")
-        if "country" not in value:
-            raise serializers.ValidationError("'properties' must include 'country' field")
-        if "session_id" not in value:
-            raise serializers.ValidationError("'properties' must include 'session_id' field")
-        return value
\ No newline at end of file
+        for key in REQUIRED_PROPERTIES:
+            if key not in value:
+                raise serializers.ValidationError(f"'properties' must include '{key}' field")
+        return value
+
+
+class EventBatchValidator:
+    """Validates a whole list of events with EventSerializer rules, compiled once per process.
+
+    Field instances and validate_<field> hooks are taken from a single serializer, so no
+    serializer is constructed per item and error messages match EventSerializer.
+    """
+
+    def __init__(self):
+        self.serializer = EventSerializer()
+        self.steps = [(name, field, getattr(self.serializer, f'validate_{name}', None))
+                      for name, field in self.serializer.fields.items() if not field.read_only]
+        self.not_a_dict = self.serializer.error_messages['invalid']
+
+    def validate_item(self, data):
+        if not isinstance(data, dict):
+            return None, {"non_field_errors": [self.not_a_dict.format(datatype=type(data).__name__)]}
+        validated = {}
+        errors = {}
+        for name, field, validate_hook in self.steps:
+            try:
+                value = field.run_validation(data.get(name, serializers.empty))
+                validated[name] = validate_hook(value) if validate_hook else value
+            except serializers.ValidationError as exc:
+                errors[name] = exc.detail
+            except SkipField:
+                pass
+        return (None, errors) if errors else (validated, None)
+
+    def validate(self, items):
+        """Returns (valid_events, errors) where errors are [{"index": i, "errors": {...}}]."""
+        valid = []
+        errors = []
+        for index, data in enumerate(items):
+            validated, item_errors = self.validate_item(data)
+            if item_errors:
+                errors.append({"index": index, "errors": item_errors})
+            else:
+                valid.append(validated)
+        return valid, errors
+
+
+_batch_validator = None
+
+
+def get_batch_validator():
+    global _batch_validator
+    if _batch_validator is None:
+        _batch_validator = EventBatchValidator()
+    return _batch_validator
@@ -1,21 +1,192 @@
+import time
+from backend.pooled_postgresql.base import use_worker_pools
 from celery import shared_task
-from .models import Event
-from django.db import transaction
+from celery.concurrency import get_implementation
+from celery.concurrency.prefork import TaskPool as PreforkPool
+from celery.concurrency.solo import TaskPool as SoloPool
+from celery.signals import before_task_publish, task_postrun, task_prerun, worker_init
+from datetime import date, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import caches
+from django.db import InterfaceError, OperationalError
+from django.utils import timezone
+from events_service.utils.bulk_insert import insert_events
+from events_service.utils.cold_storage import compact_closed_days
+from events_service.utils.dead_letters import dead_letter
+from events_service.utils.event_payloads import decode_events, encode_events
+from events_service.utils.idempotency import expire_keys
+from events_service.utils.lru import MISSING, LRUCache
+from events_service.utils.metrics import EVENTS_CREATED, EVENTS_SKIPPED, TASK_DURATION, start_flusher
+from events_service.utils.partitions import drop_partition, ensure_partitions, expired_partitions
+from events_service.utils.rollups import refresh_dirty_hours
+from events_service.utils.stats_cache import warm
+from events_service.utils.structured_logging import request_id
+from events_service.utils.write_behind import WriteBehindBuffer
 import logging
 
 
 logger = logging.getLogger(__name__)
 
+# event_ids this worker process has already stored (or found stored): their retries skip Postgres
+recent_event_ids = LRUCache(settings.RECENT_EVENT_IDS_MAX)
 
-@shared_task(bind=True, max_retries=3)
-def process_event_batch(self, validated_events):
-    created_count = 0
-    skipped_count = 0
-    with transaction.atomic():
-        for data in validated_events:
-            event, created = Event.objects.get_or_create(event_id=data['event_id'], defaults=data)
-            if created:
-                created_count += 1
-            else:
-                skipped_count += 1
+# Failures worth another attempt: the database is down, restarting or dropped the connection
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+WARM_PENDING_KEY = 'stats:warm-pending'
+
+
+def enqueue_events(validated_events):
+    """Queue validated events as process_event_batch tasks of at most INGEST_TASK_CHUNK_SIZE events each."""
+    chunk_size = settings.INGEST_TASK_CHUNK_SIZE
+    for start in range(0, len(validated_events), chunk_size):
+        process_event_batch.apply_async((encode_events(validated_events[start:start + chunk_size]),),
+                                        compression=settings.INGEST_TASK_COMPRESSION or None)
+
+
+# Acknowledged only after store_events returns, i.e. after the write-behind flush holding the chunk
+# committed; a worker that dies mid-flush leaves its chunks unacknowledged and the broker redelivers them
+@shared_task(bind=True, max_retries=settings.INGEST_TASK_MAX_RETRIES, acks_late=True, reject_on_worker_lost=True)
+def process_event_batch(self, payload):
+    """Store a chunk of events queued by enqueue_events.
+
+    Transient database errors retry after INGEST_RETRY_BACKOFF * 2**retries seconds; the chunk goes
+    to the dead-letter queue once retries run out, or at once for any other error.
+    """
+    try:
+        store_events(decode_events(payload))
+    except Exception as exc:
+        retries = self.request.retries
+        if isinstance(exc, TRANSIENT_ERRORS) and retries < self.max_retries:
+            countdown = settings.INGEST_RETRY_BACKOFF * 2 ** retries
+            logger.warning(f"Ingest chunk failed ({exc!r}), retry {retries + 1} in {countdown}s")
+            raise self.retry(exc=exc, countdown=countdown)
+        dead_letter(payload, exc, task_id=self.request.id, retries=retries)
+
+
+def flush_events(events):
+    """One bulk insert of the chunks coalesced by write_behind; returns the event_ids created."""
+    created = insert_events(events)
+    logger.info(f"flushed: {len(events)}, created: {len(created)}")
+    if created:
+        schedule_warm_up({event['occurred_at'].astimezone(dt_timezone.utc).date() for event in created})
+    return {str(event['event_id']) for event in created}
+
+
+def _warm_cache():
+    return caches[settings.STATS_CACHE_ALIAS or 'default']
+
+
+def schedule_warm_up(days):
+    """Queue a warm_stats_cache, STATS_WARM_DEBOUNCE_SECONDS from now, for the days that have none pending yet.
+
+    A day is marked pending until its task starts, so the flushes of a busy day queue one task per
+    debounce interval instead of one each. The mark expires on its own in case the task is lost.
+    """
+    debounce = settings.STATS_WARM_DEBOUNCE_SECONDS
+    cache = _warm_cache()
+    pending = [day.isoformat() for day in sorted(days)
+               if cache.add(f'{WARM_PENDING_KEY}:{day.isoformat()}', True, max(debounce * 10, 60))]
+    if pending:
+        warm_stats_cache.apply_async((pending,), countdown=debounce)
+
+
+# Chunks of concurrent process_event_batch tasks (worker thread pool) share one transaction
+write_behind = WriteBehindBuffer(flush_events, settings.INGEST_COALESCE_MAX_EVENTS,
+                                 settings.INGEST_COALESCE_MAX_DELAY_MS / 1000, TRANSIENT_ERRORS)
+
+
+def store_events(validated_events):
+    fresh_events = [event for event in validated_events if recent_event_ids.get(str(event['event_id'])) is MISSING]
+    created_ids = write_behind.submit(fresh_events) if fresh_events else set()
+    for event in fresh_events:
+        recent_event_ids.set(str(event['event_id']), True)
+    created_count = len({str(event['event_id']) for event in fresh_events} & created_ids)
+    skipped_count = len(validated_events) - created_count
+    EVENTS_CREATED.inc(amount=created_count)
+    EVENTS_SKIPPED.inc(amount=skipped_count)
     logger.info(f"processed: {len(validated_events)}, created: {created_count}, skipped: {skipped_count}")
+
+
+_task_started = {}
+
+
+@worker_init.connect
+def start_metrics_flusher(**kwargs):
+    start_flusher()
+
+
+@worker_init.connect
+def size_database_pools(**kwargs):
+    use_worker_pools()
+
+
+@worker_init.connect
+def coalesce_in_concurrent_pools(sender=None, **kwargs):
+    # A prefork or solo process runs one task at a time: there is nothing to wait for, so flush at once
+    if issubclass(get_implementation(sender.pool_cls), (PreforkPool, SoloPool)) or sender.concurrency <= 1:
+        write_behind.max_delay = 0
+
+
+@before_task_publish.connect
+def add_request_id(headers=None, **kwargs):
+    # Tasks queued while handling a request log under its ID
+    current = request_id.get()
+    if current and headers is not None:
+        headers.setdefault('request_id', current)
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, task=None, **kwargs):
+    _task_started[task_id] = (time.perf_counter(), request_id.set(task.request.get('request_id') or request_id.get()))
+
+
+@task_postrun.connect
+def observe_task_duration(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_DURATION.observe(time.perf_counter() - started[0], task.name, state or 'UNKNOWN')
+        request_id.reset(started[1])
+
+
+@shared_task
+def refresh_rollups():
+    refresh_dirty_hours()
+
+
+@shared_task
+def maintain_partitions():
+    ensure_partitions()
+    if settings.EVENTS_RETENTION_MONTHS:
+        for month, name in expired_partitions(settings.EVENTS_RETENTION_MONTHS):
+            drop_partition(month, name)
+
+
+@shared_task
+def compact_events():
+    archived = compact_closed_days()
+    logger.info(f"compacted: {archived} events moved to cold storage")
+
+
+@shared_task
+def warm_stats_cache(days=None):
+    """Rebuild the dirty rollups, then recompute the cached stats of the touched UTC days (ISO dates)
+    within the last STATS_WARM_DAYS days, all of them by default.
+
+    The entries land in the shared cache when STATS_CACHE_ALIAS is set; without it, warming still
+    brings the rollups up to date sooner than the next beat refresh.
+    """
+    today = timezone.now().date()
+    first_day = today - timedelta(days=settings.STATS_WARM_DAYS)
+    if days is None:
+        days = [first_day + timedelta(days=i) for i in range(settings.STATS_WARM_DAYS + 1)]
+    else:
+        _warm_cache().delete_many([f'{WARM_PENDING_KEY}:{day}' for day in days])  # later writes queue a new task
+        days = [day for day in map(date.fromisoformat, days) if first_day <= day <= today]
+    refresh_dirty_hours()
+    warm(days)
+
+
+@shared_task
+def expire_idempotency_keys():
+    logger.info(f"expired: {expire_keys()} idempotency keys")
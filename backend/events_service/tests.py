@@ -1,10 +1,55 @@
+import csv
+import gzip
+import io
+import json
+import logging.config
+import os
+import tempfile
 import uuid
-from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+import psycopg2
+import pyarrow.parquet as pq
+from asgiref.sync import sync_to_async
+from backend.pooled_postgresql.base import POOL_TIMEOUTS, POOL_WAIT, ConnectionPool
 from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection
 from django.urls import reverse
 from django.utils import timezone
-from events_service.models import Event
+from events_service.management.commands.benchmark import Command as Benchmark
+from events_service.models import ArchivedPart, DailyUserBitmap, DailyUserSketch, DirtyRollupHour, Event, EventId, EventType, HourlyActiveUsers, IdempotencyKey, ImportCheckpoint
+from events_service.serializers import EventSerializer, get_batch_validator
+from events_service.tasks import (add_request_id, coalesce_in_concurrent_pools, enqueue_events, process_event_batch,
+                                  schedule_warm_up, warm_stats_cache, write_behind)
+from events_service.utils.benchmarks import regressions, summarize
+from events_service.utils.bulk_insert import insert_events
+from events_service.utils.cold_storage import cold_batches, compact_closed_days, connect_duckdb
+from events_service.utils.csv_import import chunk_count, import_chunk, source_key
+from events_service.utils.dead_letters import purge_dead_letters, read_dead_letters
+from events_service.utils.event_layout import event_type_id, properties_sql
+from events_service.utils.event_payloads import decode_events, encode_events
+from events_service.utils.funnels import funnel
+from events_service.utils.hyperloglog import HyperLogLog
+from events_service.utils.lru import LRUCache
+from events_service.utils.metrics import EVENTS_ACCEPTED, Counter, Histogram, exposition
+from events_service.utils.partitions import drop_partition, expired_partitions, month_partitions
+from events_service.utils.query_plans import check_plans, full_scans, stats_queries
+from events_service.utils.replicas import STATS_READS, ReplicaRouter, choose_database, stats_reads
+from events_service.utils.roaring import RoaringBitmap
+from events_service.utils.rollups import daily_active_users, refresh_dirty_hours, rolling_active_users
+from events_service.utils.sketches import rebuild_sketches, unique_users
+from events_service.utils.stats_cache import local_cache
+from events_service.utils.structured_logging import BackgroundHandler, RequestIdFilter, SamplingFilter, request_id
+from events_service.utils.time_range import day_range
+from events_service.utils.token_bucket import LocalBucketStore, SharedBucketStore
+from events_service.utils.workload import Workload, serialize
+from events_service.utils.write_behind import WriteBehindBuffer
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.test import APITestCase
 
@@ -28,6 +73,7 @@ class EventIngestTests(APITestCase):
         self.assertEqual(Event.objects.count(), 1)
         self.assertEqual(Event.objects.get().user_id, 1)
 
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
     def test_idempotency_of_import(self):
         data = [{
             "event_id": str(uuid.uuid4()),
@@ -44,6 +90,51 @@ class EventIngestTests(APITestCase):
         count_after_second = Event.objects.count()
         self.assertEqual(count_after_first, count_after_second)
 
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+    def test_idempotency_key_replays_the_first_response(self):
+        data = [{"event_id": str(uuid.uuid4()), "occurred_at": timezone.now().isoformat(), "user_id": 1,
+                 "event_type": "login", "properties": {"country": "PL", "session_id": "5ef18783"}}]
+        key = str(uuid.uuid4())
+        first = self.client.post(self.url_import, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+        self.assertEqual((first.status_code, first.json()), (status.HTTP_202_ACCEPTED, {"queued": 1}))
+        with CaptureQueriesContext(connection) as context:
+            retry = self.client.post(self.url_import, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+        self.assertEqual((retry.status_code, retry.json(), retry.headers['Idempotent-Replayed']),
+                         (status.HTTP_202_ACCEPTED, {"queued": 1}, 'true'))
+        self.assertFalse(any('events' in query['sql'] for query in context.captured_queries))
+        other = self.client.post(self.url_import, data + data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+        self.assertEqual(other.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        IdempotencyKey.objects.filter(key='request:' + key).update(created_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(self.client.post(self.url_import, data, format='json', HTTP_IDEMPOTENCY_KEY=key).status_code,
+                         status.HTTP_202_ACCEPTED)
+        self.assertEqual(Event.objects.count(), 1)
+
+    def test_idempotency_key_on_a_body_over_the_upload_memory_limit(self):
+        data = [{"event_id": str(uuid.uuid4()), "occurred_at": timezone.now().isoformat(), "user_id": 1,
+                 "event_type": "login", "properties": {"country": "PL", "session_id": "5ef18783", "note": "x" * 10000}}
+                for _ in range(300)]
+        body = json.dumps(data).encode()
+        self.assertGreater(len(body), settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+        key = str(uuid.uuid4())
+        with mock.patch('events_service.views.enqueue_events') as enqueue:
+            first = self.client.post(self.url_import, body, content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+            retry = self.client.post(self.url_import, body, content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+            other = self.client.post(self.url_import, body[:-1] + b', 1]', content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+        self.assertEqual((first.status_code, first.json()), (status.HTTP_202_ACCEPTED, {"queued": 300}))
+        self.assertEqual((retry.json(), retry.headers['Idempotent-Replayed']), ({"queued": 300}, 'true'))
+        self.assertEqual(other.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(enqueue.call_count, 1)
+
+    def test_worker_skips_recent_event_ids(self):
+        event = {"event_id": str(uuid.uuid4()), "occurred_at": timezone.now().isoformat(), "user_id": 1,
+                 "event_type": "login", "properties": {"country": "PL", "session_id": "5ef18783"}}
+        process_event_batch([event])
+        with CaptureQueriesContext(connection) as context:
+            process_event_batch([event])
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertEqual(Event.objects.count(), 1)
+
     def test_create_event_negative(self):
         data = [{
             "event_id": str(uuid.uuid4()),
@@ -57,6 +148,823 @@ class EventIngestTests(APITestCase):
         self.assertEqual(Event.objects.count(), 0)
         self.assertEqual(Event.objects.count(), 0)
 
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+    def test_partial_acceptance(self):
+        valid = {"event_id": str(uuid.uuid4()), "occurred_at": timezone.now().isoformat(), "user_id": 1,
+                 "event_type": "login", "properties": {"country": "PL", "session_id": "5ef18783"}}
+        data = [valid, dict(valid, event_id=str(uuid.uuid4()), event_type="unknown"), "not an event"]
+        response = self.client.post(self.url_import + '?partial=true', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()['queued'], 1)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1, 2])
+        self.assertEqual(Event.objects.count(), 1)
+
+    def test_batch_validator_matches_serializer(self):
+        data = {"event_id": "bad", "occurred_at": "yesterday", "user_id": 0, "event_type": "view",
+                "properties": {"country": "PL"}}
+        serializer = EventSerializer(data=data)
+        serializer.is_valid()
+        _, errors = get_batch_validator().validate([data])
+        self.assertEqual(errors[0]['errors'], serializer.errors)
+
+
+class IngestTaskTests(APITestCase):
+    def setUp(self):
+        purge_dead_letters()
+        self.events = [{"event_id": uuid.uuid4(), "occurred_at": timezone.now() - timedelta(minutes=i), "user_id": i,
+                        "event_type": ["login", "view_item"][i % 2], "properties": {"country": "PL", "session_id": "5ef18783"}}
+                       for i in range(5)]
+
+    def test_payload_round_trip(self):
+        payload = encode_events(self.events)
+        self.assertEqual(payload['types'], ["login", "view_item"])
+        self.assertEqual(decode_events(json.loads(json.dumps(payload))), self.events)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True, INGEST_TASK_CHUNK_SIZE=2)
+    def test_events_are_queued_in_chunks(self):
+        with mock.patch.object(process_event_batch, 'apply_async') as apply_async:
+            enqueue_events(self.events)
+        self.assertEqual([len(call.args[0][0]['rows']) for call in apply_async.call_args_list], [2, 2, 1])
+        enqueue_events(self.events)
+        self.assertEqual(Event.objects.count(), 5)
+
+    # Not propagating: eager retries re-run the task inline and raise Retry back up the stack
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=False, INGEST_RETRY_BACKOFF=0)
+    def test_failed_chunk_retries_then_dead_letters_and_replays(self):
+        payload = encode_events(self.events)
+        with mock.patch('events_service.tasks.insert_events', side_effect=OperationalError('server closed the connection')) as insert:
+            process_event_batch.apply((payload,))
+        self.assertEqual(insert.call_count, process_event_batch.max_retries + 1)
+        self.assertEqual(Event.objects.count(), 0)
+        letters = []
+        read_dead_letters(letters.append)
+        self.assertEqual([(letter['payload'], letter['retries']) for letter in letters], [(payload, process_event_batch.max_retries)])
+
+        out = io.StringIO()
+        call_command('dead_letters', 'replay', stdout=out)
+        self.assertIn('Replayed 1 dead letters', out.getvalue())
+        self.assertEqual(Event.objects.count(), 5)
+        self.assertEqual(read_dead_letters(lambda letter: True), 0)
+
+    def test_write_behind_coalesces_concurrent_chunks(self):
+        flushes = []
+        buffer = WriteBehindBuffer(lambda items: flushes.append(list(items)) or len(items), max_items=6, max_delay=5)
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(executor.map(buffer.submit, [[1, 2], [3, 4], [5, 6]]))
+        self.assertEqual((results, sorted(map(sorted, flushes))), ([6, 6, 6], [[1, 2, 3, 4, 5, 6]]))
+
+        def fail(items):
+            raise OperationalError('server closed the connection')
+        buffer = WriteBehindBuffer(fail, max_items=6, max_delay=0)
+        with self.assertRaises(OperationalError):
+            buffer.submit([1])
+
+    def test_write_behind_isolates_the_failing_chunk(self):
+        flushes = []
+
+        def flush(items):
+            flushes.append(sorted(items))
+            if 4 in items:
+                raise ValueError('bad row')
+            return len(items)
+        buffer = WriteBehindBuffer(flush, max_items=6, max_delay=5, transient_errors=(OperationalError,))
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [executor.submit(buffer.submit, items) for items in [[1, 2], [3, 4], [5, 6]]]
+        self.assertEqual([future.exception() is None and future.result() for future in futures[::2]], [2, 2])
+        self.assertIsInstance(futures[1].exception(), ValueError)
+        self.assertEqual(sorted(flushes), [[1, 2], [1, 2, 3, 4, 5, 6], [3, 4], [5, 6]])
+
+    def test_prefork_and_solo_workers_do_not_wait_to_coalesce(self):
+        for pool, concurrency, delay in [('prefork', 8, 0), ('solo', 1, 0), ('threads', 1, 0), ('threads', 64, 0.01)]:
+            with mock.patch.object(write_behind, 'max_delay', 0.01):
+                coalesce_in_concurrent_pools(sender=mock.Mock(pool_cls=pool, concurrency=concurrency))
+                self.assertEqual(write_behind.max_delay, delay, pool)
+
+
+class NDJSONIngestTests(APITestCase):
+    def setUp(self):
+        self.client.credentials(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
+        self.url = reverse('ingest_events')
+
+    def make_lines(self, count):
+        return [json.dumps({"event_id": str(uuid.uuid4()), "occurred_at": timezone.now().isoformat(), "user_id": 1,
+                            "event_type": "login", "properties": {"country": "PL", "session_id": "5ef18783"}}) for _ in range(count)]
+
+    def post(self, body, **extra):
+        return self.client.generic('POST', self.url, body, content_type='application/x-ndjson', **extra)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True, INGEST_STREAM_CHUNK_SIZE=2)
+    def test_lines_are_validated_and_queued_in_chunks(self):
+        lines = self.make_lines(5)
+        body = '\n'.join(lines[:2] + ['{"event_id": "bad"}', '', 'not json'] + lines[2:]) + '\n'
+        response = self.post(body.encode())
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual((response.json()['queued'], response.json()['rejected']), (5, 2))
+        self.assertEqual([error['index'] for error in response.json()['errors']], [2, 3])
+        self.assertEqual(Event.objects.count(), 5)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True, INGEST_MAX_LINE_BYTES=300)
+    def test_gzip_body_and_long_lines(self):
+        lines = self.make_lines(3)
+        lines.insert(1, json.dumps({"padding": "x" * 1000}))
+        response = self.post(gzip.compress(('\n'.join(lines)).encode()), HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual((response.status_code, response.json()['queued']), (status.HTTP_202_ACCEPTED, 3))
+        self.assertEqual(response.json()['errors'], [{"index": 1, "errors": {"non_field_errors": ["Line longer than 300 bytes"]}}])
+        self.assertEqual(self.post(b'not gzip', HTTP_CONTENT_ENCODING='gzip').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.post(b'', HTTP_CONTENT_ENCODING='br').status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        self.assertEqual(self.client.generic('POST', self.url, gzip.compress(b'[]'), content_type='application/json',
+                                             HTTP_CONTENT_ENCODING='gzip').status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_corrupted_gzip_body(self):
+        body = bytearray(gzip.compress('\n'.join(self.make_lines(50)).encode()))
+        body[len(body) // 2:len(body) // 2 + 16] = b'\xff' * 16  # valid header, broken deflate stream
+        response = self.post(bytes(body), HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual((response.status_code, response.json()), (status.HTTP_400_BAD_REQUEST, {"error": "Body is not valid gzip"}))
+
+    def test_idempotency_key_on_streamed_body(self):
+        body = '\n'.join(self.make_lines(2)).encode()
+        first = self.post(body, HTTP_IDEMPOTENCY_KEY='ndjson-1')
+        retry = self.post(body, HTTP_IDEMPOTENCY_KEY='ndjson-1')
+        self.assertEqual((retry.status_code, retry.json(), retry.headers['Idempotent-Replayed']), (first.status_code, first.json(), 'true'))
+        self.assertEqual(self.post(body + b'\n' + body, HTTP_IDEMPOTENCY_KEY='ndjson-1').status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+
+class AsyncIngestTests(APITestCase):
+    url = '/api/events/async'
+
+    def make_events(self, count):
+        return [{"event_id": str(uuid.uuid4()), "occurred_at": timezone.now().isoformat(), "user_id": 1, "event_type": "login",
+                 "properties": {"country": "PL", "session_id": "5ef18783"}} for _ in range(count)]
+
+    async def post(self, data, **headers):
+        return await self.async_client.post(self.url, data, content_type='application/json',
+                                            headers={"X-Api-Key": settings.ACCESS_API_KEY, **headers})
+
+    async def test_validates_and_queues(self):
+        response = await self.post(self.make_events(3))
+        self.assertEqual((response.status_code, response.json()), (status.HTTP_202_ACCEPTED, {"queued": 3}))
+        response = await self.post(self.make_events(1) + [{"event_id": "bad"}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1])
+        self.assertEqual((await self.post({"event_id": "not a list"})).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual((await self.post('[{')).status_code, status.HTTP_400_BAD_REQUEST)
+        response = await self.async_client.post(self.url, [], content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_idempotency_key_replays(self):
+        data = self.make_events(2)
+        first = await self.post(data, **{"Idempotency-Key": "batch-1"})
+        retry = await self.post(data, **{"Idempotency-Key": "batch-1"})
+        self.assertEqual((retry.status_code, retry.json(), retry.headers['Idempotent-Replayed']), (first.status_code, first.json(), 'true'))
+
+    async def test_body_over_the_upload_memory_limit_matches_the_sync_view(self):
+        events = [dict(event, properties={**event["properties"], "note": "x" * 10000}) for event in self.make_events(300)]
+        self.assertGreater(len(json.dumps(events)), settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+        with mock.patch('events_service.async_views.enqueue_events'), mock.patch('events_service.views.enqueue_events'):
+            response = await self.post(events, **{"Idempotency-Key": "big-batch"})
+            sync_response = await sync_to_async(self.client.post)(reverse('ingest_events'), events, format='json',
+                                                                  HTTP_X_API_KEY=settings.ACCESS_API_KEY)
+        self.assertEqual((response.status_code, response.json()), (status.HTTP_202_ACCEPTED, {"queued": 300}))
+        self.assertEqual((sync_response.status_code, sync_response.json()), (status.HTTP_202_ACCEPTED, {"queued": 300}))
+
+    async def test_in_flight_key_with_another_batch_conflicts_like_the_sync_view(self):
+        await IdempotencyKey.objects.acreate(key='request:in-flight', fingerprint='another batch')
+        response = await self.post(self.make_events(1), **{"Idempotency-Key": "in-flight"})
+        sync_response = await sync_to_async(self.client.post)(reverse('ingest_events'), self.make_events(1), format='json',
+                                                              HTTP_X_API_KEY=settings.ACCESS_API_KEY,
+                                                              HTTP_IDEMPOTENCY_KEY='in-flight')
+        self.assertEqual((response.status_code, sync_response.status_code), (status.HTTP_409_CONFLICT, status.HTTP_409_CONFLICT))
+
+    @override_settings(INGEST_INLINE_VALIDATION_BYTES=0, INGEST_VALIDATION_WORKERS=1)
+    async def test_large_batches_are_validated_in_the_process_pool(self):
+        response = await self.post(self.make_events(50) + ["not an event"])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [50])
+        response = await self.async_client.post(self.url + '?partial=true', self.make_events(50) + ["not an event"],
+                                                content_type='application/json', headers={"X-Api-Key": settings.ACCESS_API_KEY})
+        self.assertEqual((response.status_code, response.json()['queued']), (status.HTTP_202_ACCEPTED, 50))
+
+
+class BulkInsertTests(APITestCase):
+    def make_event(self, event_id=None):
+        return {"event_id": event_id or uuid.uuid4(), "occurred_at": timezone.now(), "user_id": 1, "event_type": "login",
+                "properties": {"country": "PL", "session_id": "5ef18783"}}
+
+    def test_duplicates_in_batch_and_table_are_skipped(self):
+        existing = self.make_event()
+        insert_events([existing])
+        duplicate_id = uuid.uuid4()
+        batch = [existing, self.make_event(duplicate_id), self.make_event(str(duplicate_id)), self.make_event()]
+        created = insert_events(batch, chunk_size=2)
+        self.assertEqual(len(created), 2)
+        self.assertEqual(Event.objects.count(), 3)
+
+
+class CopyImportTests(APITestCase):
+    def setUp(self):
+        self.event_ids = [str(uuid.uuid4()) for _ in range(50)]
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['event_id', 'occurred_at', 'user_id', 'event_type', 'properties_json'])
+            for i, event_id in enumerate(self.event_ids + self.event_ids[:5]):
+                writer.writerow([event_id, timezone.now().isoformat(), i, 'login', json.dumps({"country": "UA", "session_id": "s"})])
+            writer.writerow(['not-a-uuid', timezone.now().isoformat(), 1, 'login', '{}'])
+        self.addCleanup(os.remove, self.path)
+
+    def test_chunks_cover_every_row_once(self):
+        chunk_bytes = 512
+        source = source_key(self.path, chunk_bytes)
+        totals = [import_chunk(self.path, source, n, chunk_bytes) for n in range(chunk_count(self.path, chunk_bytes))]
+        self.assertEqual([sum(t[i] for t in totals) for i in range(3)], [50, 5, 1])
+        self.assertEqual(Event.objects.count(), 50)
+
+    def test_copy_command_resumes_from_checkpoint(self):
+        call_command('import_events', self.path, '--copy', stdout=io.StringIO())
+        self.assertEqual(Event.objects.count(), 50)
+        self.assertEqual(ImportCheckpoint.objects.count(), 1)
+        Event.objects.all().delete()
+        call_command('import_events', self.path, '--copy', stdout=io.StringIO())
+        self.assertEqual(Event.objects.count(), 0)
+
+    def test_same_file_is_imported_once(self):
+        call_command('import_events', self.path, stdout=io.StringIO())
+        Event.objects.all().delete()
+        out = io.StringIO()
+        call_command('import_events', self.path, stdout=out)
+        self.assertIn('already imported', out.getvalue())
+        self.assertIn('Imported 50, skipped 5, with errors: 1', out.getvalue())
+        self.assertEqual(Event.objects.count(), 0)
+
+
+class PartitionTests(APITestCase):
+    def make_event(self, occurred_at, event_id=None):
+        return {"event_id": event_id or uuid.uuid4(), "occurred_at": occurred_at, "user_id": 1, "event_type": "login",
+                "properties": {"country": "PL", "session_id": "5ef18783"}}
+
+    def test_event_id_is_unique_across_partitions(self):
+        event_id = uuid.uuid4()
+        self.assertEqual(len(insert_events([self.make_event(datetime(2025, 8, 1, tzinfo=dt_timezone.utc), event_id)])), 1)
+        self.assertEqual(len(insert_events([self.make_event(datetime(2025, 9, 1, tzinfo=dt_timezone.utc), event_id)])), 0)
+        self.assertEqual(Event.objects.count(), 1)
+
+    def test_late_partition_takes_rows_from_default_and_retention_drops_it(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT events_ensure_month_partition(%s)', ['2020-01-01'])  # nothing yet
+            insert_events([self.make_event(datetime(2019, 12, 31, 23, tzinfo=dt_timezone.utc)),
+                           self.make_event(datetime(2020, 2, 15, tzinfo=dt_timezone.utc))])
+            cursor.execute('SELECT events_ensure_month_partition(%s)', ['2020-02-01'])
+            cursor.execute('SELECT count(*) FROM events_p202002')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+        expired = expired_partitions(retention_months=11, today=datetime(2021, 2, 10).date())
+        self.assertEqual([name for _, name in expired], ['events_p202001', 'events_p202002'])
+        for month, name in expired:
+            drop_partition(month, name)
+        self.assertNotIn('events_p202002', [name for _, name in month_partitions()])
+        self.assertEqual(Event.objects.count(), 1)
+        self.assertEqual(EventId.objects.count(), 1)
+
+    def test_dropping_a_partition_drops_its_archived_parts(self):
+        storage = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(EVENTS_COLD_STORAGE_DIR=storage))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT events_ensure_month_partition(%s)', ['2020-03-01'])
+        insert_events([self.make_event(datetime(2020, 3, day, tzinfo=dt_timezone.utc)) for day in (1, 2)]
+                      + [self.make_event(datetime(2020, 4, 1, tzinfo=dt_timezone.utc))])
+        compact_closed_days(hot_days=0, today=datetime(2020, 4, 2).date())
+        self.assertEqual(ArchivedPart.objects.count(), 3)
+
+        drop_partition(datetime(2020, 3, 1).date(), 'events_p202003')
+        self.assertEqual(list(ArchivedPart.objects.values_list('day', flat=True)), [datetime(2020, 4, 1).date()])
+        self.assertEqual(os.listdir(storage), ['day=2020-04-01'])
+        self.assertEqual(EventId.objects.count(), 1)
+
+
+class CompactStorageTests(APITestCase):
+    def test_typed_columns_and_event_type_ids_round_trip(self):
+        properties = [{"country": "PL", "session_id": "s1", "price": 19.99, "currency": "USD", "item_id": "SKU1"},
+                      {"country": 42, "session_id": "s2", "price": "10", "currency": "EUR"},
+                      {"country": "UA", "session_id": "s3", "price": 0.1 + 0.2}]  # a double would round this price
+        insert_events([{"event_id": uuid.uuid4(), "occurred_at": timezone.now(), "user_id": user_id, "event_type": event_type,
+                        "properties": props} for user_id, (event_type, props) in enumerate(zip(["purchase", "view_item", "refund"], properties))])
+
+        rows = Event.objects.order_by('user_id').values_list('event_type', 'country', 'price', 'currency', 'properties')
+        self.assertEqual(list(rows), [("purchase", "PL", 19.99, "USD", {"item_id": "SKU1"}),
+                                      ("view_item", None, None, "EUR", {"country": 42, "price": "10"}),
+                                      ("refund", "UA", None, None, {"price": 0.30000000000000004})])
+        self.assertEqual(Event.objects.filter(event_type="refund").count(), 1)
+        self.assertEqual(Event.objects.filter(event_type="unknown").count(), 0)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT {properties_sql("e")} FROM events e ORDER BY user_id')
+            self.assertEqual([json.loads(row[0]) for row in cursor.fetchall()], properties)
+
+    @mock.patch.dict('events_service.utils.event_layout._ids')
+    def test_event_type_filters_resolve_names_on_the_routed_connection_once(self):
+        insert_events([{"event_id": uuid.uuid4(), "occurred_at": timezone.now(), "user_id": 1, "event_type": "login",
+                        "properties": {}}])
+        with mock.patch('events_service.models.router.db_for_read', return_value='default') as route:
+            self.assertEqual(Event.objects.filter(event_type="login").count(), 1)
+        route.assert_any_call(EventType)
+        with CaptureQueriesContext(connection) as queries:
+            Event.objects.filter(event_type="login").count()
+        self.assertEqual(len(queries), 2)  # read inside the test transaction: not cached
+
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            event_type_id("login", 'default')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(Event.objects.filter(event_type="login").count(), 1)
+        self.assertEqual(len(queries), 1)
+
+
+class ColdStorageTests(APITestCase):
+    def setUp(self):
+        self.client.credentials(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
+        self.enterContext(override_settings(EVENTS_COLD_STORAGE_DIR=self.enterContext(tempfile.TemporaryDirectory())))
+        self.events = [self.make_event(datetime(2025, 8, 1, hour, tzinfo=dt_timezone.utc), user_id, event_type)
+                       for hour, user_id, event_type in [(9, 1, "login"), (9, 2, "purchase"), (20, 1, "purchase")]]
+        insert_events(self.events + [self.make_event(datetime(2025, 8, 10, 12, tzinfo=dt_timezone.utc), 3, "purchase")])
+        refresh_dirty_hours()
+
+    def make_event(self, occurred_at, user_id, event_type):
+        return {"event_id": uuid.uuid4(), "occurred_at": occurred_at, "user_id": user_id, "event_type": event_type,
+                "properties": {"country": "PL", "session_id": "5ef18783"}}
+
+    def test_compaction_moves_closed_days_and_keeps_stats(self):
+        self.assertEqual(compact_closed_days(hot_days=7, today=datetime(2025, 8, 12).date()), 3)
+        self.assertEqual(Event.objects.count(), 1)
+        self.assertEqual(ArchivedPart.objects.get().rows, 3)
+        self.assertFalse(DirtyRollupHour.objects.exists())
+        self.assertEqual(len(insert_events(self.events)), 0)  # archived event_ids stay claimed
+
+        dau = self.client.get(reverse('dau_stats'), {"from": "2025-08-01", "to": "2025-08-10"}).json()
+        self.assertEqual(dau, [{"day": "2025-08-01", "dau": 2}, {"day": "2025-08-10", "dau": 1}])
+        rebuild_sketches(datetime(2025, 8, 1).date(), datetime(2025, 8, 1).date())
+        self.assertEqual(unique_users(datetime(2025, 8, 1).date(), datetime(2025, 8, 1).date(), "purchase"), 2)
+
+    def test_late_event_on_archived_day_merges_both_tiers(self):
+        compact_closed_days(hot_days=7, today=datetime(2025, 8, 12).date())
+        insert_events([self.make_event(datetime(2025, 8, 1, 9, 30, tzinfo=dt_timezone.utc), 4, "purchase")])
+        refresh_dirty_hours()
+        self.assertEqual(HourlyActiveUsers.objects.get(hour=datetime(2025, 8, 1, 9, tzinfo=dt_timezone.utc)).user_ids, [1, 2, 4])
+        top = self.client.get(reverse('top_events'), {"from": "2025-08-01", "to": "2025-08-01"}).json()
+        self.assertEqual(top, [{"event_type": "purchase", "count": 3}, {"event_type": "login", "count": 1}])
+
+        stats = rolling_active_users(datetime(2025, 8, 1).date(), datetime(2025, 8, 10).date(), 7, "purchase")
+        self.assertEqual([row["active_users"] for row in stats], [3, 3, 3, 3, 3, 3, 3, 0, 0, 1])
+
+        compact_closed_days(hot_days=7, today=datetime(2025, 8, 12).date())
+        self.assertEqual(ArchivedPart.objects.count(), 2)
+        self.assertEqual(rolling_active_users(datetime(2025, 8, 1).date(), datetime(2025, 8, 10).date(), 7, "purchase"), stats)
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        self.client.credentials(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
+        self.enterContext(override_settings(EVENTS_COLD_STORAGE_DIR=self.enterContext(tempfile.TemporaryDirectory()),
+                                            EXPORT_FETCH_ROWS=2))
+        self.events = [{"event_id": uuid.uuid4(), "occurred_at": datetime(2025, 8, day, hour, tzinfo=dt_timezone.utc),
+                        "user_id": user_id, "event_type": event_type,
+                        "properties": {"country": "PL", "price": 9.99, "tags": ["a", "b"]}}
+                       for day, hour, user_id, event_type in [(1, 9, 1, "login"), (1, 20, 2, "purchase"),
+                                                              (10, 8, 1, "purchase"), (10, 12, 3, "view_item")]]
+        insert_events(self.events)
+
+    def export(self, **params):
+        response = self.client.get(reverse('export_events'), {"from": "2025-08-01", "to": "2025-08-10", **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_export_imports_back(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('filename="events_2025-08-01_2025-08-10.csv"', response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(rows[0], ['event_id', 'occurred_at', 'user_id', 'event_type', 'properties_json'])
+        self.assertEqual([row[0] for row in rows[1:]], [str(event["event_id"]) for event in self.events])
+
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        exported = [(str(e.event_id), e.occurred_at, e.user_id, e.event_type, e.properties) for e in Event.objects.order_by('occurred_at')]
+        Event.objects.all().delete()
+        EventId.objects.all().delete()
+        call_command('import_events', path, '--copy', stdout=io.StringIO())
+        self.assertEqual([(str(e.event_id), e.occurred_at, e.user_id, e.event_type, e.properties)
+                          for e in Event.objects.order_by('occurred_at')], exported)
+
+    def test_formats_read_both_tiers(self):
+        compact_closed_days(hot_days=7, today=datetime(2025, 8, 12).date())
+        _, content = self.export(format='ndjson', event_type='purchase')
+        lines = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([(line["user_id"], line["event_type"], line["occurred_at"]) for line in lines],
+                         [(2, "purchase", "2025-08-01T20:00:00+00:00"), (1, "purchase", "2025-08-10T08:00:00+00:00")])
+        self.assertEqual(lines[0]["properties"], {"country": "PL", "price": 9.99, "tags": ["a", "b"]})
+
+        response, content = self.export(format='parquet', segment='properties.country:PL')
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.parquet')
+        table = pq.read_table(io.BytesIO(content))
+        self.assertEqual(table.column('user_id').to_pylist(), [1, 2, 1, 3])
+
+        response, content = self.export(gzip='true', tz='Europe/Kyiv')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(len(gzip.decompress(content).decode().splitlines()), 5)
+
+    @override_settings(EVENTS_COLD_MEMORY_LIMIT='64MB')
+    def test_archived_days_stream_one_day_at_a_time(self):
+        compact_closed_days(hot_days=0, today=datetime(2025, 8, 12).date())
+        with mock.patch('events_service.utils.export.cold_batches', wraps=cold_batches) as batches:
+            _, content = self.export()
+        self.assertEqual([call.args[0] for call in batches.call_args_list], [[date(2025, 8, 1)], [date(2025, 8, 10)]])
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual([row[0] for row in rows[1:]], [str(event["event_id"]) for event in self.events])
+        with connect_duckdb() as duck:
+            self.assertEqual(duck.execute("SELECT current_setting('memory_limit')").fetchone()[0], '61.0 MiB')
+
+    def test_invalid_params(self):
+        for params in [{"format": "xml"}, {"format": "parquet", "gzip": "true"}, {"to": ""},
+                       {"event_type": "login", "segment": "event_type:purchase"}]:
+            response = self.client.get(reverse('export_events'), {"from": "2025-08-01", "to": "2025-08-10", **params})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+            self.assertEqual(response['Content-Type'], 'application/json')
+
+
+class SegmentTests(APITestCase):
+    def setUp(self):
+        self.client.credentials(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
+        rows = [(1, 1, "purchase", "UA", {"item_id": "SKU1", "price": 10}), (1, 2, "login", "UA", {}),
+                (1, 3, "purchase", "PL", {"item_id": "SKU2", "price": 10.5}), (2, 1, "login", "UA", {}),
+                (8, 1, "purchase", "UA", {"item_id": "SKU2", "price": "10"})]
+        insert_events([{"event_id": uuid.uuid4(), "occurred_at": datetime(2025, 8, day, 12, tzinfo=dt_timezone.utc),
+                        "user_id": user_id, "event_type": event_type,
+                        "properties": {"country": country, "session_id": f"s{user_id}", **extra}}
+                       for day, user_id, event_type, country, extra in rows])
+        refresh_dirty_hours()
+
+    def dau(self, query):
+        response = self.client.get(reverse('dau_stats') + "?from=2025-08-01&to=2025-08-08&" + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        return {row["day"]: row["dau"] for row in response.json()}
+
+    def test_dau_segments(self):
+        self.assertEqual(Event.objects.filter(country="PL").count(), 1)
+        self.assertEqual(self.dau("segment=country:UA"), {"2025-08-01": 2, "2025-08-02": 1, "2025-08-08": 1})
+        self.assertEqual(self.dau("segment=country:UA&segment=event_type:purchase"), {"2025-08-01": 1, "2025-08-08": 1})
+        self.assertEqual(self.dau("properties.country=PL"), {"2025-08-01": 1})
+        self.assertEqual(self.dau("properties.item_id=SKU2"), {"2025-08-01": 1, "2025-08-08": 1})
+        self.assertEqual(self.dau("segment=price:10"), {"2025-08-01": 1, "2025-08-08": 1})  # number and string
+        self.assertEqual(self.dau("segment=session_id:s1&segment=event_type:login"), {"2025-08-02": 1})
+
+        url = reverse('dau_stats')
+        self.assertEqual(self.client.get(url + "?segment=country:UA&segment=country:PL").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url + "?segment=country").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url + "?mode=approx&segment=country:UA").status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_top_events_and_retention_segments(self):
+        url = reverse('top_events') + "?from=2025-08-01&to=2025-08-08&"
+        self.assertEqual(self.client.get(url + "segment=country:UA").json(),
+                         [{"event_type": "login", "count": 2}, {"event_type": "purchase", "count": 2}])
+        self.assertEqual(self.client.get(url + "properties.item_id=SKU2").json(), [{"event_type": "purchase", "count": 2}])
+
+        response = self.client.get(reverse('retention_stats'), {"start_date": "2025-08-01", "windows": 2, "segment": "country:UA"})
+        self.assertEqual((response.json()["cohort_size"], list(response.json()["retention"].values())), (2, [2, 1]))
+        response = self.client.get(reverse('retention_stats'), {"start_date": "2025-08-01", "windows": 2, "segment": "item_id:SKU2"})
+        self.assertEqual((response.json()["cohort_size"], list(response.json()["retention"].values())), (1, [1, 0]))
+
+    def test_segments_read_the_cold_tier(self):
+        before = (self.dau("properties.item_id=SKU2"), self.dau("segment=country:UA"))
+        with override_settings(EVENTS_COLD_STORAGE_DIR=self.enterContext(tempfile.TemporaryDirectory())):
+            refresh_dirty_hours()
+            compact_closed_days(hot_days=0, today=datetime(2025, 8, 5).date())
+            self.assertEqual(Event.objects.count(), 1)
+            local_cache.clear()  # archiving keeps the stats, so their day versions stay
+            self.assertEqual((self.dau("properties.item_id=SKU2"), self.dau("segment=country:UA")), before)
+
+
+class QueryPlanTests(APITestCase):
+    def test_stats_queries_use_indexes(self):
+        insert_events([{"event_id": uuid.uuid4(), "occurred_at": datetime(2025, 8, day, hour, tzinfo=dt_timezone.utc),
+                        "user_id": day * hour, "event_type": "login", "properties": {}}
+                       for day in (1, 2) for hour in (3, 15)])
+        queries = stats_queries(datetime(2025, 8, 1).date(), datetime(2025, 8, 2).date())
+        self.assertTrue(any('FROM events' in sql or 'JOIN events' in sql for sql in queries))
+        self.assertEqual(check_plans(queries), [])
+
+    def test_date_cast_is_reported(self):
+        self.assertIn('events_default', full_scans("SELECT count(*) FROM events WHERE occurred_at::date = '2025-08-01'"))
+        self.assertEqual(full_scans("SELECT count(*) FROM events WHERE occurred_at >= '2025-08-01' AND occurred_at < '2025-08-02'"), [])
+
+
+class StatsCacheTests(APITestCase):
+    def setUp(self):
+        self.client.credentials(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
+        caches['default'].clear()  # debounced warm-ups pending from other tests
+        self.add_event(timezone.now(), 1, "login")
+
+    def add_event(self, occurred_at, user_id, event_type):
+        insert_events([{"event_id": uuid.uuid4(), "occurred_at": occurred_at, "user_id": user_id,
+                        "event_type": event_type, "properties": {}}])
+        refresh_dirty_hours()
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b', 'missing'))
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a', 'missing'), cache.get('b', 'missing'), cache.get('c'), len(cache)), ('missing', None, 3, 2))
+
+    def test_write_invalidates_only_its_day(self):
+        url = reverse('dau_stats') + "?from=2025-08-01&to=2025-08-03"
+        self.add_event(datetime(2025, 8, 1, 12, tzinfo=dt_timezone.utc), 1, "login")
+        self.add_event(datetime(2025, 8, 3, 12, tzinfo=dt_timezone.utc), 1, "login")
+        self.assertEqual(self.client.get(url).json(), [{"day": "2025-08-01", "dau": 1}, {"day": "2025-08-03", "dau": 1}])
+        self.add_event(datetime(2025, 8, 3, 13, tzinfo=dt_timezone.utc), 2, "purchase")
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url).json(), [{"day": "2025-08-01", "dau": 1}, {"day": "2025-08-03", "dau": 2}])
+        stats_sql = [query['sql'] for query in context.captured_queries if 'stats_day_versions' not in query['sql']]
+        self.assertTrue(stats_sql)
+        self.assertFalse(any("'2025-08-01" in sql for sql in stats_sql))
+
+    def test_default_top_events_range_is_served_from_cache(self):
+        first = self.client.get(reverse('top_events')).json()
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(reverse('top_events')).json(), first)
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertIn('stats_day_versions', context.captured_queries[0]['sql'])
+
+        self.add_event(timezone.now(), 2, "login")
+        self.assertEqual(self.client.get(reverse('top_events')).json(), [{"event_type": "login", "count": 2}])
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+    def test_ingest_warms_touched_days(self):
+        event = {"event_id": str(uuid.uuid4()), "occurred_at": timezone.now().isoformat(), "user_id": 3,
+                 "event_type": "purchase", "properties": {"country": "PL", "session_id": "5ef18783"}}
+        self.assertEqual(self.client.post(reverse('ingest_events'), [event], format='json').status_code, status.HTTP_202_ACCEPTED)
+        today = timezone.now().date().isoformat()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('top_events'), {"from": today, "to": today})
+        self.assertEqual(response.json(), [{"event_type": "login", "count": 1}, {"event_type": "purchase", "count": 1}])
+        self.assertEqual(len(context.captured_queries), 1)
+
+    def test_warm_ups_of_a_day_are_debounced(self):
+        with mock.patch.object(warm_stats_cache, 'apply_async') as apply_async:
+            schedule_warm_up({date(2025, 8, 1), date(2025, 8, 2)})
+            schedule_warm_up({date(2025, 8, 2), date(2025, 8, 3)})
+        self.assertEqual([call.args[0] for call in apply_async.call_args_list], [(['2025-08-01', '2025-08-02'],), (['2025-08-03'],)])
+        warm_stats_cache(['2025-08-02'])
+        with mock.patch.object(warm_stats_cache, 'apply_async') as apply_async:
+            schedule_warm_up({date(2025, 8, 1), date(2025, 8, 2)})
+        self.assertEqual(apply_async.call_args.args[0], (['2025-08-02'],))
+
+    def test_lru_bounds_approximate_bytes(self):
+        cache = LRUCache(100, max_bytes=2000)
+        cache.set('a', 'x' * 900)
+        cache.set('b', 'x' * 900)
+        cache.set('c', 'x' * 900)
+        self.assertEqual((cache.get('a', 'missing'), len(cache)), ('missing', 2))
+        self.assertLessEqual(cache.size, 2000)
+        cache.set('d', 'x' * 5000)
+        self.assertEqual((cache.get('d', 'missing'), len(cache)), ('missing', 2))
+
+
+class MetricsTests(APITestCase):
+    def sample(self, text, line_prefix):
+        return sum(float(line.rsplit(' ', 1)[1]) for line in text.splitlines() if line.startswith(line_prefix))
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+    def test_scrape_counts_requests_and_events(self):
+        before = self.client.get('/metrics').content.decode()
+        self.client.credentials(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
+        valid = {"event_id": str(uuid.uuid4()), "occurred_at": timezone.now().isoformat(), "user_id": 1,
+                 "event_type": "login", "properties": {"country": "PL", "session_id": "5ef18783"}}
+        self.client.post(reverse('ingest_events') + '?partial=true', [valid, "not an event"], format='json')
+        self.client.get(reverse('dau_stats'))
+        response = self.client.get('/metrics')
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        after = response.content.decode()
+
+        def delta(line_prefix):
+            return self.sample(after, line_prefix) - self.sample(before, line_prefix)
+        self.assertEqual(delta('ingest_events_accepted_total{source="json"}'), 1)
+        self.assertEqual(delta('ingest_events_rejected_total{source="json"}'), 1)
+        self.assertEqual(delta('ingest_events_created_total'), 1)
+        self.assertEqual(delta('http_request_duration_seconds_count{method="POST",route="/api/events",status="202"}'), 1)
+        self.assertEqual(delta('db_query_duration_seconds_count{route="/api/stats/dau"}'), 1)
+        self.assertEqual(delta('celery_task_duration_seconds_count{task="events_service.tasks.process_event_batch",state="SUCCESS"}'), 1)
+
+    async def test_async_requests_record_database_time(self):
+        before = await sync_to_async(exposition)()
+        response = await self.async_client.get(reverse('dau_stats'), headers={"X-Api-Key": settings.ACCESS_API_KEY})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        after = await sync_to_async(exposition)()
+        for line_prefix in ('db_query_duration_seconds_count{route="/api/stats/dau"}', 'db_query_duration_seconds_sum{route="/api/stats/dau"}'):
+            self.assertGreater(self.sample(after, line_prefix) - self.sample(before, line_prefix), 0)
+
+    def test_shards_of_ended_threads_are_folded(self):
+        requests = Counter('test_requests_total', 'Test requests')
+        for _ in range(5):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(lambda _: requests.inc(), range(40)))
+        self.assertEqual(requests.collect(), {(): 200})
+        self.assertEqual(len(requests.shards), 0)
+
+    def test_histogram_exposition_and_process_snapshots(self):
+        latency = Histogram('test_latency_seconds', 'Test latency', ('route',), buckets=(0.1, 1))
+        for value in (0.05, 0.5, 5):
+            latency.observe(value, '/a')
+        with tempfile.TemporaryDirectory() as metrics_dir, override_settings(METRICS_DIR=metrics_dir):
+            with open(os.path.join(metrics_dir, '1.json'), 'w') as file:
+                json.dump({'test_latency_seconds': [[['/a'], [1, 0, 0, 0.01, 1]]],
+                           'ingest_events_accepted_total': [[['json'], 10]]}, file)
+            text = exposition()
+            own = EVENTS_ACCEPTED.collect().get(('json',), 0)
+        self.assertIn('test_latency_seconds_bucket{route="/a",le="0.1"} 2', text)
+        self.assertIn('test_latency_seconds_bucket{route="/a",le="1"} 3', text)
+        self.assertIn('test_latency_seconds_bucket{route="/a",le="+Inf"} 4', text)
+        self.assertIn('test_latency_seconds_count{route="/a"} 4', text)
+        self.assertEqual(self.sample(text, 'ingest_events_accepted_total{source="json"}'), own + 10)
+
+
+class ReplicaRoutingTests(APITestCase):
+    """The primary stands in for a replica: it is not in recovery, so its lag is 0."""
+
+    def setUp(self):
+        self.client.credentials(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
+        for user_id in (1, 2):
+            self.add_event(user_id, datetime(2025, 8, 1, 10, 30, tzinfo=dt_timezone.utc))
+        refresh_dirty_hours()
+        self.old_range = day_range(date(2025, 8, 1), date(2025, 8, 1))
+
+    def add_event(self, user_id, occurred_at):
+        Event.objects.create(event_id=uuid.uuid4(), occurred_at=occurred_at, user_id=user_id, event_type="login", properties={})
+
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_recent_or_lagging_ranges_read_the_primary(self):
+        today = timezone.now().date()
+        self.assertEqual(choose_database(*self.old_range), ('default', 'replica'))
+        self.assertEqual(choose_database(*day_range(today, today)), ('default', 'recent'))
+        self.assertEqual(choose_database(self.old_range[0], None), ('default', 'recent'))
+        with mock.patch('events_service.utils.replicas.replica_lag', return_value=60.0):
+            self.assertEqual(choose_database(*self.old_range)[1], 'lag')
+        with mock.patch('events_service.utils.replicas.replica_lag', return_value=None):
+            self.assertEqual(choose_database(*self.old_range)[1], 'lag')
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(choose_database(*self.old_range)[1], 'no_replica')
+
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_stats_reads_serve_the_last_rebuilt_rollups(self):
+        url = reverse('dau_stats') + "?from=2025-08-01&to=2025-08-01"
+        replica_reads = STATS_READS.collect().get(('default', 'replica'), 0)
+        self.assertEqual(self.client.get(url).json(), [{"day": "2025-08-01", "dau": 2}])
+        self.assertEqual(STATS_READS.collect()[('default', 'replica')], replica_reads + 1)
+
+        with stats_reads(*self.old_range):
+            self.add_event(3, datetime(2025, 8, 1, 11, tzinfo=dt_timezone.utc))
+            self.assertEqual(ReplicaRouter().db_for_read(Event), 'default')
+            self.assertEqual(daily_active_users(*self.old_range, dt_timezone.utc), [{"day": date(2025, 8, 1), "dau": 2}])
+        self.assertEqual(self.client.get(url).json(), [{"day": "2025-08-01", "dau": 2}])
+        self.assertEqual(DirtyRollupHour.objects.count(), 1)
+        self.assertEqual(refresh_dirty_hours(), 1)
+        self.assertEqual(self.client.get(url).json(), [{"day": "2025-08-01", "dau": 3}])
+
+    def test_pool_reuses_rolls_back_and_times_out(self):
+        params = connection.get_connection_params()
+        pool = ConnectionPool('test-pool', 1, 0.05, None)
+        self.addCleanup(pool.close)
+        first = pool.get(lambda: psycopg2.connect(**params))
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.get(lambda: psycopg2.connect(**params))
+        self.assertEqual(POOL_TIMEOUTS.collect()[('test-pool',)], 1)
+        first.cursor().execute('SELECT 1')  # leaves a transaction open
+        pool.put(first)
+        second = pool.get(lambda: psycopg2.connect(**params))
+        self.assertIs(second, first)
+        self.assertEqual(second.get_transaction_status(), psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+        self.assertEqual(POOL_WAIT.collect()[('test-pool',)][-1], 3)
+        pool.put(second)
+        pool.close()
+        self.assertTrue(first.closed)
+        self.assertIsNotNone(connection.connection_pool)
+
+
+class StructuredLoggingTests(APITestCase):
+    def test_request_id_is_echoed_and_carried_into_tasks(self):
+        self.client.credentials(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
+        response = self.client.get(reverse('dau_stats'), HTTP_X_REQUEST_ID='abc-123')
+        self.assertEqual(response['X-Request-ID'], 'abc-123')
+        self.assertEqual(len(self.client.get(reverse('dau_stats'), HTTP_X_REQUEST_ID='bad id!')['X-Request-ID']), 32)
+        token = request_id.set('abc-123')
+        headers = {}
+        add_request_id(headers=headers)
+        request_id.reset(token)
+        self.assertEqual(headers, {'request_id': 'abc-123'})
+
+    def test_logging_settings_configure(self):
+        logging.config.dictConfig(settings.LOGGING)  # as django.setup() does; replaces the running handler
+        self.assertIsInstance(logging.getLogger('events_service').handlers[0], BackgroundHandler)
+
+    def test_background_handler_writes_sampled_json(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            handler = BackgroundHandler(filename=os.path.join(tmp_dir, 'test.log'))
+            handler.addFilter(RequestIdFilter())
+            handler.addFilter(SamplingFilter(0))
+            logger = logging.getLogger('tests.structured_logging')
+            logger.propagate = False
+            logger.addHandler(handler)
+            token = request_id.set('abc-123')
+            try:
+                logger.info('dropped by sampling')
+                logger.warning('kept %s', 'always', extra={"status": 500})
+            finally:
+                request_id.reset(token)
+                logger.removeHandler(handler)
+                handler.close()
+            with open(os.path.join(tmp_dir, 'test.log')) as file:
+                entries = [json.loads(line) for line in file]
+        self.assertEqual([(entry['level'], entry['message'], entry['request_id'], entry['status']) for entry in entries],
+                         [('WARNING', 'kept always', 'abc-123', 500)])
+
+        sampler = SamplingFilter(0.5)
+        records = [logging.LogRecord('x', logging.INFO, '', 0, 'line', (), None) for _ in range(4)]
+        for record in records:
+            record.request_id = 'same-request'
+        self.assertEqual(len({sampler.filter(record) for record in records}), 1)
+
+
+class BenchmarkReportTests(APITestCase):
+    def test_refuses_to_wipe_a_database_not_set_aside_for_it(self):
+        Event.objects.create(event_id=uuid.uuid4(), occurred_at=timezone.now(), user_id=1, event_type="login", properties={})
+        with override_settings(BENCHMARK_DATABASE_NAME=None), self.assertRaisesMessage(CommandError, '--reset'):
+            call_command('benchmark', scale='10', stdout=io.StringIO())
+        self.assertEqual(Event.objects.count(), 1)
+        Benchmark().check_database(reset=True)
+        with override_settings(BENCHMARK_DATABASE_NAME=connection.settings_dict['NAME']):
+            Benchmark().check_database(reset=False)
+
+    def test_summary_and_regressions(self):
+        result = summarize('stats.dau', [0.010, 0.020, 0.030, 0.040, 0.100], 5, unit='requests')
+        self.assertEqual((result['p50_ms'], result['p95_ms'], result['throughput']), (30.0, 88.0, 25.0))
+        baseline = {"results": [result, summarize('import.copy', [2.0], 1000)]}
+        current = {"results": [summarize('stats.dau', [0.010, 0.020, 0.030, 0.040, 0.200], 5, unit='requests'),
+                               summarize('import.copy', [2.1], 1000), summarize('new.scenario', [1.0], 1)]}
+        self.assertEqual([(name, metric) for name, metric, *_ in regressions(current, baseline, 0.2)],
+                         [('stats.dau', 'p95_ms'), ('stats.dau', 'throughput')])
+
+    def test_workload_is_seeded_ordered_and_valid(self):
+        end = datetime(2025, 9, 1, tzinfo=dt_timezone.utc)
+        events = list(Workload(2000, end - timedelta(days=14), end, seed=7))
+        self.assertEqual(len(events), 2000)
+        self.assertEqual([event['event_id'] for event in events],
+                         [event['event_id'] for event in Workload(2000, end - timedelta(days=14), end, seed=7)])
+        self.assertEqual([event['occurred_at'] for event in events], sorted(event['occurred_at'] for event in events))
+        valid_events, errors = get_batch_validator().validate([serialize(event) for event in events])
+        self.assertEqual((len(valid_events), errors), (2000, []))
+        types = {event_type: sum(event['event_type'] == event_type for event in events) / 2000
+                 for event_type in ('app_open', 'view_item', 'purchase')}
+        self.assertAlmostEqual(types['app_open'], 0.30, delta=0.03)
+        self.assertAlmostEqual(types['view_item'], 0.25, delta=0.03)
+        self.assertAlmostEqual(types['purchase'], 0.05, delta=0.02)
+        self.assertEqual(max(set(event['user_id'] for event in events), key=[event['user_id'] for event in events].count), 1)
+
+
+class RateLimitTests(APITestCase):
+    def setUp(self):
+        self.client.credentials(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
+
+    def test_local_store_is_bounded(self):
+        store = LocalBucketStore(2)
+        for client in ('a', 'b', 'c'):
+            self.assertTrue(store.consume(client, 1, 1))
+        self.assertEqual(list(store.buckets), ['b', 'c'])
+        self.assertFalse(store.consume('c', 1, 1))
+        store.buckets['b'].timestamp -= 1  # refilled, so idle
+        store.consume('d', 1, 1)
+        self.assertEqual(list(store.buckets), ['c', 'd'])
+
+    def test_shared_store_is_one_limit_for_all_processes(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'buckets')
+        worker_1, worker_2 = SharedBucketStore(path, 64), SharedBucketStore(path, 64)
+        self.addCleanup(worker_1.close)
+        self.addCleanup(worker_2.close)
+        self.assertTrue(worker_1.consume('ip:1', 0.001, 3, 2))
+        self.assertTrue(worker_2.consume('ip:1', 0.001, 3))
+        self.assertFalse(worker_1.consume('ip:1', 0.001, 3))
+        self.assertTrue(worker_2.consume('ip:2', 0.001, 3))
+
+    @override_settings(RATE_LIMIT_ROUTES={'/api/events': (0.001, 10)}, RATE_LIMIT_EVENTS_PER_TOKEN=100)
+    def test_ingest_costs_grow_with_batch_size(self):
+        url = reverse('ingest_events')
+        self.assertEqual(self.client.post(url, [{}] * 850, format='json', REMOTE_ADDR='10.0.0.1').status_code,
+                         status.HTTP_400_BAD_REQUEST)  # 9 of 10 tokens
+        self.assertEqual(self.client.post(url, [{}], format='json', REMOTE_ADDR='10.0.0.1').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(url, [{}], format='json', REMOTE_ADDR='10.0.0.1').status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.client.get(reverse('dau_stats'), REMOTE_ADDR='10.0.0.1').status_code, status.HTTP_200_OK)
+
 
 class DAUStatsTests(APITestCase):
     def setUp(self):
@@ -68,6 +976,7 @@ class DAUStatsTests(APITestCase):
                              properties={"country": "PL", "session_id": "5ef18783", "item_id": "SKU6995", "price": 100.25, "currency": "USD"})
         Event.objects.create(event_id=str(uuid.uuid4()), occurred_at=now, user_id=1, event_type="login",
                              properties={"country": "PL", "session_id": "533e684a", "method": "apple"})
+        refresh_dirty_hours()
 
     def test_dau(self):
         url = reverse('dau_stats')
@@ -84,6 +993,7 @@ class TopEventsTests(APITestCase):
             Event.objects.create(event_id=str(uuid.uuid4()), occurred_at=now, user_id=i, event_type="login", properties={})
         for i in range(3):
             Event.objects.create(event_id=str(uuid.uuid4()), occurred_at=now, user_id=i + 5, event_type="purchase", properties={})
+        refresh_dirty_hours()
 
     def test_top_events(self):
         url = reverse('top_events')
@@ -93,6 +1003,92 @@ class TopEventsTests(APITestCase):
         self.assertEqual(response.json()[0]['event_type'], 'login')
 
 
+class RollupTests(APITestCase):
+    def setUp(self):
+        self.client.credentials(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
+        # 22:30 UTC on Aug 1 is already Aug 2 in Kyiv (UTC+3)
+        for user_id, hour in [(1, 10), (2, 10), (1, 22), (3, 22)]:
+            Event.objects.create(event_id=uuid.uuid4(), occurred_at=datetime(2025, 8, 1, hour, 30, tzinfo=dt_timezone.utc),
+                                 user_id=user_id, event_type="login", properties={})
+        refresh_dirty_hours()
+
+    def test_dau_from_rollups_with_tz(self):
+        url = reverse('dau_stats')
+        utc = self.client.get(url, {"from": "2025-08-01", "to": "2025-08-02"}).json()
+        kyiv = self.client.get(url, {"from": "2025-08-01", "to": "2025-08-02", "tz": "Europe/Kyiv"}).json()
+        self.assertEqual(utc, [{"day": "2025-08-01", "dau": 3}])
+        self.assertEqual(kyiv, [{"day": "2025-08-01", "dau": 2}, {"day": "2025-08-02", "dau": 2}])
+        self.assertEqual(self.client.get(url, {"tz": "Mars/Base"}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+    def test_stats_are_as_fresh_as_the_last_refresh(self):
+        url = reverse('dau_stats')
+        event = {"event_id": str(uuid.uuid4()), "occurred_at": "2025-08-01T12:00:00Z", "user_id": 4, "event_type": "login",
+                 "properties": {"country": "PL", "session_id": "5ef18783"}}
+        with mock.patch('events_service.tasks.schedule_warm_up'):  # its refresh runs a debounce later
+            response = self.client.post(reverse('ingest_events'), [event], format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(Event.objects.filter(user_id=4).count(), 1)
+        self.assertEqual(self.client.get(url, {"from": "2025-08-01", "to": "2025-08-01"}).json(),
+                         [{"day": "2025-08-01", "dau": 3}])
+        refresh_dirty_hours()
+        self.assertEqual(self.client.get(url, {"from": "2025-08-01", "to": "2025-08-01"}).json(),
+                         [{"day": "2025-08-01", "dau": 4}])
+
+    def test_late_event_rebuilds_only_its_hour(self):
+        Event.objects.create(event_id=uuid.uuid4(), occurred_at=datetime(2025, 8, 1, 10, 45, tzinfo=dt_timezone.utc),
+                             user_id=4, event_type="purchase", properties={})
+        self.assertEqual(DirtyRollupHour.objects.count(), 1)
+        self.assertEqual(refresh_dirty_hours(), 1)
+        self.assertEqual(HourlyActiveUsers.objects.get(hour=datetime(2025, 8, 1, 10, tzinfo=dt_timezone.utc)).user_ids, [1, 2, 4])
+        response = self.client.get(reverse('top_events'), {"from": "2025-08-01", "to": "2025-08-01"})
+        self.assertEqual(response.json(), [{"event_type": "login", "count": 4}, {"event_type": "purchase", "count": 1}])
+
+
+class UniqueUsersTests(APITestCase):
+    def setUp(self):
+        self.client.credentials(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
+        events = [{"event_id": uuid.uuid4(), "occurred_at": datetime(2025, 8, day, 12, tzinfo=dt_timezone.utc),
+                   "user_id": user_id, "event_type": "purchase" if user_id % 2 else "login", "properties": {}}
+                  for day in range(1, 11) for user_id in range(day * 10, day * 10 + 100)]
+        insert_events(events)
+        refresh_dirty_hours()
+
+    def test_hyperloglog_merge_and_estimate(self):
+        a, b = HyperLogLog(), HyperLogLog()
+        a.update(range(0, 20000))
+        b.update(range(10000, 30000))
+        self.assertLess(abs(a.merge(b).count() - 30000), 30000 * 0.03)
+
+    def test_exact_and_approx_unique_users(self):
+        url = reverse('unique_users_stats')
+        params = {"from": "2025-08-01", "to": "2025-08-10"}
+        exact = self.client.get(url, params).json()
+        approx = self.client.get(url, dict(params, mode="approx")).json()
+        self.assertEqual(exact['unique_users'], 190)
+        self.assertLess(abs(approx['unique_users'] - 190), 190 * 3 * approx['relative_error'])
+        purchases = self.client.get(url, dict(params, event_type="purchase")).json()
+        self.assertEqual(purchases['unique_users'], 95)
+
+    def test_sketches_are_updated_by_the_refresh_not_by_ingest(self):
+        insert_events([{"event_id": uuid.uuid4(), "occurred_at": datetime(2025, 8, 11, hour, tzinfo=dt_timezone.utc),
+                        "user_id": user_id, "event_type": "login", "properties": {}} for hour, user_id in [(9, 1), (10, 2)]])
+        self.assertFalse(DailyUserSketch.objects.filter(day=date(2025, 8, 11)).exists())
+        refresh_dirty_hours()
+        self.assertEqual(unique_users(date(2025, 8, 11), date(2025, 8, 11)), 2)
+        self.assertEqual(unique_users(date(2025, 8, 11), date(2025, 8, 11), "login"), 2)
+
+    def test_rolling_window_matches_exact(self):
+        url = reverse('active_users_stats')
+        params = {"from": "2025-08-03", "to": "2025-08-10", "window": 3}
+        exact = self.client.get(url, params).json()['stats']
+        approx = self.client.get(url, dict(params, mode="approx")).json()['stats']
+        self.assertEqual([row['active_users'] for row in exact], [120] * 8)
+        for exact_row, approx_row in zip(exact, approx):
+            self.assertEqual(exact_row['day'], approx_row['day'])
+            self.assertLess(abs(exact_row['active_users'] - approx_row['active_users']), 5)
+
+
 class RetentionStatsTests(APITestCase):
     def setUp(self):
         self.client.credentials(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
@@ -103,6 +1099,7 @@ class RetentionStatsTests(APITestCase):
                              properties={"country": "GE", "session_id": "554aa24d", "method": "password"})
         Event.objects.create(event_id=str(uuid.uuid4()), occurred_at=base, user_id=22, event_type="login",
                              properties={"country": "NL", "session_id": "fa17a4bc", "method": "password"})
+        refresh_dirty_hours()
 
     def test_retention_weekly(self):
         url = reverse('retention_stats')
@@ -112,6 +1109,89 @@ class RetentionStatsTests(APITestCase):
         self.assertTrue('retention' in response.json())
 
 
+class RetentionMatrixTests(APITestCase):
+    def setUp(self):
+        self.client.credentials(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
+        activity = {1: [1, 2, 8], 2: [1, 9], 3: [2, 3, 15], 70000: [1, 15]}
+        insert_events([{"event_id": uuid.uuid4(), "occurred_at": datetime(2025, 8, day, 9, tzinfo=dt_timezone.utc),
+                        "user_id": user_id, "event_type": "login", "properties": {}}
+                       for user_id, days in activity.items() for day in days])
+        refresh_dirty_hours()
+
+    def test_roaring_bitmap_roundtrip(self):
+        sparse = RoaringBitmap.from_values([1, 5, 70000])
+        dense = RoaringBitmap.from_values(range(0, 20000, 2))
+        for bitmap in (sparse, dense):
+            self.assertEqual(RoaringBitmap.deserialize(bitmap.serialize()), bitmap)
+        self.assertEqual(list(sparse & dense), [])
+        self.assertEqual(len(sparse | dense), 10003)
+
+    def test_day_bitmaps_follow_changed_hours(self):
+        day = date(2025, 8, 1)
+        Event.objects.create(event_id=uuid.uuid4(), occurred_at=datetime(2025, 8, 1, 15, tzinfo=dt_timezone.utc),
+                             user_id=4, event_type="login", properties={})
+        refresh_dirty_hours()
+        self.assertEqual(list(RoaringBitmap.deserialize(DailyUserBitmap.objects.get(day=day).bitmap)), [1, 2, 4, 70000])
+        Event.objects.filter(user_id=2, occurred_at__date=day).delete()
+        refresh_dirty_hours()
+        bitmap = DailyUserBitmap.objects.get(day=day)
+        self.assertEqual((list(RoaringBitmap.deserialize(bitmap.bitmap)), bitmap.cardinality), ([1, 4, 70000], 3))
+
+    def test_weekly_matrix(self):
+        response = self.client.get(reverse('retention_matrix_stats'), {"from": "2025-08-01", "to": "2025-08-08", "windows": 3})
+        self.assertEqual(response.json()['cohorts'], [
+            {"start_date": "2025-08-01", "cohort_size": 3, "retention": [3, 2, 1]},
+            {"start_date": "2025-08-08", "cohort_size": 1, "retention": [1, 0, 0]},
+        ])
+
+    def test_daily_windows(self):
+        response = self.client.get(reverse('retention_stats'), {"start_date": "2025-08-01", "windows": 2, "period": "day"})
+        self.assertEqual(response.json()['retention'], {"2025-08-01 to 2025-08-01": 3, "2025-08-02 to 2025-08-02": 1})
+
+
+class FunnelTests(APITestCase):
+    def setUp(self):
+        self.client.credentials(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
+        self.enterContext(override_settings(EVENTS_COLD_STORAGE_DIR=self.enterContext(tempfile.TemporaryDirectory())))
+        journeys = {
+            1: [(1, 10, 0, "view_item"), (1, 10, 30, "add_to_cart"), (1, 11, 0, "purchase")],
+            2: [(1, 9, 0, "view_item"), (2, 11, 0, "view_item"), (2, 12, 0, "add_to_cart")],  # the second entry converts
+            3: [(1, 8, 0, "add_to_cart"), (1, 9, 0, "view_item")],
+            4: [(1, 9, 0, "purchase")],
+            5: [(3, 9, 0, "view_item"), (3, 9, 5, "add_to_cart")],  # entered after the range
+            7: [(1, 23, 30, "view_item"), (2, 0, 15, "add_to_cart")],
+        }
+        insert_events([{"event_id": uuid.uuid4(), "occurred_at": datetime(2025, 8, day, hour, minute, tzinfo=dt_timezone.utc),
+                        "user_id": user_id, "event_type": event_type, "properties": {}}
+                       for user_id, events in journeys.items() for day, hour, minute, event_type in events])
+        self.params = {"steps": "view_item,add_to_cart,purchase", "from": "2025-08-01", "to": "2025-08-02"}
+
+    def test_funnel(self):
+        response = self.client.get(reverse('funnel_stats'), {**self.params, "window": "24h"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["steps"], [
+            {"event_type": "view_item", "users": 4, "median_seconds_from_previous": None, "conversion": 1.0},
+            {"event_type": "add_to_cart", "users": 3, "median_seconds_from_previous": 2700.0, "conversion": 0.75},
+            {"event_type": "purchase", "users": 1, "median_seconds_from_previous": 1800.0, "conversion": 0.25},
+        ])
+        steps = self.client.get(reverse('funnel_stats'), {**self.params, "window": "50m"}).json()["steps"]
+        self.assertEqual([step["users"] for step in steps], [4, 2, 0])
+
+    def test_funnel_spans_both_tiers(self):
+        expected = funnel(["view_item", "add_to_cart"], *day_range(date(2025, 8, 1), date(2025, 8, 2)), timedelta(hours=24))
+        compact_closed_days(hot_days=7, today=date(2025, 8, 9))
+        self.assertEqual(ArchivedPart.objects.get().day, date(2025, 8, 1))
+        self.assertEqual(funnel(["view_item", "add_to_cart"], *day_range(date(2025, 8, 1), date(2025, 8, 2)), timedelta(hours=24)),
+                         expected)
+        self.assertEqual([step["users"] for step in expected], [4, 3])
+
+    def test_invalid_params(self):
+        for params in [{"steps": "view_item"}, {"steps": "view_item,view_item"}, {"window": "24x"}, {"window": "0h"},
+                       {"window": "91d"}, {"from": ""}]:
+            response = self.client.get(reverse('funnel_stats'), {**self.params, **params})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+
 class IngestToStatsIntegrationTest(APITestCase):
     def setUp(self):
         self.client.credentials(HTTP_X_API_KEY=settings.ACCESS_API_KEY)
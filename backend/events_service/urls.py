@@ -1,9 +1,17 @@
 from django.urls import path
-from .views import ingest_events, dau_stats, top_events, retention_stats
+from .async_views import ingest_events_async
+from .views import ingest_events, dau_stats, top_events, retention_stats, unique_users_stats, active_users_stats, \
+    retention_matrix_stats, funnel_stats, export_events
 
 urlpatterns = [
     path('events', ingest_events, name='ingest_events'),
+    path('events/async', ingest_events_async, name='ingest_events_async'),
+    path('events/export', export_events, name='export_events'),
     path('stats/dau', dau_stats, name='dau_stats'),
     path('stats/top-events', top_events, name='top_events'),
     path('stats/retention_stats', retention_stats, name='retention_stats'),
+    path('stats/unique-users', unique_users_stats, name='unique_users_stats'),
+    path('stats/active-users', active_users_stats, name='active_users_stats'),
+    path('stats/retention-matrix', retention_matrix_stats, name='retention_matrix_stats'),
+    path('stats/funnel', funnel_stats, name='funnel_stats'),
 ]
\ No newline at end of file
@@ -0,0 +1,86 @@
+import json
+import math
+import platform
+import time
+from datetime import timedelta
+from django.db import connection
+from django.utils import timezone
+
+
+SCALES = {'100k': 100_000, '1m': 1_000_000, '10m': 10_000_000}
+
+
+def parse_scale(value):
+    """100k / 1m / 10m, or a plain event count."""
+    return SCALES.get(value.lower()) or int(value)
+
+
+def ensure_month_partitions(start, end):
+    """Monthly partitions for [start, end], so benchmark rows do not pile up in events_default."""
+    month = start.date().replace(day=1)
+    with connection.cursor() as cursor:
+        while month <= end.date():
+            cursor.execute('SELECT events_ensure_month_partition(%s)', [month])
+            month = (month + timedelta(days=32)).replace(day=1)
+
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return None
+    rank = (len(sorted_samples) - 1) * fraction
+    low, high = math.floor(rank), math.ceil(rank)
+    return sorted_samples[low] + (sorted_samples[high] - sorted_samples[low]) * (rank - low)
+
+
+def summarize(name, timings, items, unit='events'):
+    """Report entry of one scenario: latency percentiles (ms) of its operations and items per second overall."""
+    samples = sorted(timings)
+    total = sum(samples)
+    return {"name": name, "operations": len(samples), unit: items, "seconds": round(total, 4),
+            "throughput": round(items / total, 2) if total else None, "unit": f'{unit}/s',
+            **{f'p{int(fraction * 100)}_ms': None if (value := percentile(samples, fraction)) is None else round(value * 1000, 3)
+               for fraction in (0.5, 0.95, 0.99)}}
+
+
+class Timer:
+    """Collects the durations of the `with timer:` blocks."""
+
+    def __init__(self):
+        self.timings = []
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.append(time.perf_counter() - self.start_time)
+
+
+def report(results, **meta):
+    return {"created_at": timezone.now().isoformat(), "python": platform.python_version(),
+            "postgres": connection.pg_version, **meta, "results": results}
+
+
+def regressions(current, baseline, threshold):
+    """[(scenario, metric, baseline value, current value)] of the scenarios whose p95 grew, or throughput fell, by more than `threshold` (0.2 = 20%)."""
+    base = {result['name']: result for result in baseline['results']}
+    found = []
+    for result in current['results']:
+        before = base.get(result['name'])
+        if before is None:
+            continue
+        if before['p95_ms'] and result['p95_ms'] is not None and result['p95_ms'] > before['p95_ms'] * (1 + threshold):
+            found.append((result['name'], 'p95_ms', before['p95_ms'], result['p95_ms']))
+        if before['throughput'] and result['throughput'] is not None and result['throughput'] < before['throughput'] * (1 - threshold):
+            found.append((result['name'], 'throughput', before['throughput'], result['throughput']))
+    return found
+
+
+def write_report(path, data):
+    with open(path, 'w') as file:
+        json.dump(data, file, indent=2)
+
+
+def read_report(path):
+    with open(path) as file:
+        return json.load(file)
@@ -0,0 +1,78 @@
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from events_service.models import Event
+from events_service.utils.event_layout import event_type_ids
+
+
+CHUNK_SIZE = 5000
+FIELDS = ('event_id', 'occurred_at', 'user_id', 'event_type', 'properties')
+RETURNING = ('event_id', 'occurred_at', 'user_id', 'event_type')
+STAGING_TABLE = 'events_import_staging'
+STAGING_COLUMNS = 'event_id, occurred_at, user_id, event_type, properties'  # event_type is the name here
+
+
+def deduplicate(events):
+    unique = {}
+    for data in events:
+        unique.setdefault(str(data['event_id']), data)
+    return list(unique.values())
+
+
+def _columns(names):
+    return ', '.join(connection.ops.quote_name(Event._meta.get_field(name).column) for name in names)
+
+
+def insert_events(events, chunk_size=CHUNK_SIZE):
+    """Insert events with ON CONFLICT DO NOTHING, one transaction per chunk.
+
+    Events whose event_id is already stored in any partition are skipped by the events_dedup_insert
+    trigger. Returns the rows that were actually inserted, so created/skipped counts are exact.
+    Event type names are resolved to their dictionary ids once per chunk.
+    """
+    fields = [Event._meta.get_field(name) for name in FIELDS]
+    type_index = FIELDS.index('event_type')
+    db = connections[DEFAULT_DB_ALIAS]  # the connection proxy costs a context-local lookup per attribute access
+    row_placeholder = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    table = connection.ops.quote_name(Event._meta.db_table)
+
+    unique_events = deduplicate(events)
+    created = []
+    for start in range(0, len(unique_events), chunk_size):
+        chunk = unique_events[start:start + chunk_size]
+        params = [field.get_db_prep_save(data.get(field.name, field.get_default()), db)
+                  for data in chunk for field in fields]
+        sql = (f'INSERT INTO {table} ({_columns(FIELDS)}) VALUES {", ".join([row_placeholder] * len(chunk))} '
+               f'ON CONFLICT DO NOTHING RETURNING {_columns(RETURNING)}')
+        with transaction.atomic(), connection.cursor() as cursor:
+            type_ids = event_type_ids(set(params[type_index::len(fields)]))
+            params[type_index::len(fields)] = [type_ids[name] for name in params[type_index::len(fields)]]
+            cursor.execute(sql, params)
+            type_names = {type_id: name for name, type_id in type_ids.items()}
+            chunk_created = [dict(zip(RETURNING, (*row[:-1], type_names[row[-1]]))) for row in cursor.fetchall()]
+        created.extend(chunk_created)
+    return created
+
+
+def copy_events(csv_buffer):
+    """COPY CSV rows (columns in FIELDS order) into a staging table and merge them into events.
+
+    Duplicates inside the buffer are dropped, existing event_ids are skipped. Returns the inserted rows.
+    """
+    table = connection.ops.quote_name(Event._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} '
+                       f'(event_id uuid, occurred_at timestamptz, user_id integer, event_type varchar(100), properties jsonb)')
+        cursor.execute(f'TRUNCATE {STAGING_TABLE}')
+        cursor.copy_expert(f'COPY {STAGING_TABLE} ({STAGING_COLUMNS}) FROM STDIN WITH (FORMAT csv)', csv_buffer)
+        cursor.execute(f'SELECT events_type_id(event_type) '
+                       f'FROM (SELECT DISTINCT event_type FROM {STAGING_TABLE} WHERE event_type IS NOT NULL) types')
+        cursor.execute(f"""
+            WITH created AS (
+                INSERT INTO {table} ({_columns(FIELDS)})
+                SELECT DISTINCT ON (s.event_id) s.event_id, s.occurred_at, s.user_id, t.id, s.properties
+                FROM {STAGING_TABLE} s JOIN event_types t ON t.name = s.event_type
+                ON CONFLICT DO NOTHING RETURNING {_columns(RETURNING)}
+            )
+            SELECT c.event_id, c.occurred_at, c.user_id, t.name FROM created c JOIN event_types t ON t.id = c.event_type_id
+        """)
+        created = [dict(zip(RETURNING, row)) for row in cursor.fetchall()]
+    return created
@@ -0,0 +1,141 @@
+import os
+import tempfile
+import uuid
+from datetime import timedelta, timezone as dt_timezone
+import duckdb
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from events_service.models import ArchivedPart
+from events_service.utils.event_layout import properties_sql
+from events_service.utils.time_range import day_range, day_start
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_LOCK = 0x65766E74  # advisory lock between compaction and rollup rebuilds of archived hours
+CSV_COLUMNS = ('event_id', 'occurred_at', 'user_id', 'event_type', 'properties')
+CSV_TYPES = {'event_id': pa.string(), 'occurred_at': pa.int64(), 'user_id': pa.int32(),
+             'event_type': pa.string(), 'properties': pa.string()}
+PARQUET_SCHEMA = pa.schema([
+    ('event_id', pa.string()),
+    ('occurred_at', pa.timestamp('us', tz='UTC')),
+    ('user_id', pa.int32()),
+    ('event_type', pa.string()),
+    ('properties', pa.string()),
+])
+ROW_GROUP_SIZE = 128 * 1024
+
+
+def lock_archive(shared=False):
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT pg_advisory_xact_lock{"_shared" if shared else ""}(%s)', [ARCHIVE_LOCK])
+
+
+def archive_day(day):
+    """Move the events of one UTC day from Postgres into a new Parquet part under EVENTS_COLD_STORAGE_DIR.
+
+    The rows are deleted and streamed out by one COPY, and the part is registered in the same
+    transaction, so a failed run leaves the rows in Postgres and at most an unregistered file.
+    Rollups, sketches, bitmaps and claimed event_ids are kept: archiving is not a deletion.
+    Parts hold the logical layout: the event type name and the full properties object.
+    """
+    start, end = day_range(day, day)
+    relative_path = os.path.join(f'day={day.isoformat()}', f'part-{uuid.uuid4().hex}.parquet')
+    path = os.path.join(settings.EVENTS_COLD_STORAGE_DIR, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with transaction.atomic(), tempfile.TemporaryFile() as spool:
+        lock_archive()
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL events_service.archiving = 'on'")  # checked by the rollup and event_ids triggers
+            cursor.copy_expert(cursor.mogrify(f"""
+                COPY (DELETE FROM events e USING event_types t
+                      WHERE t.id = e.event_type_id AND e.occurred_at >= %s AND e.occurred_at < %s
+                      RETURNING e.event_id, (extract(epoch FROM e.occurred_at) * 1000000)::bigint, e.user_id, t.name,
+                                {properties_sql('e')})
+                TO STDOUT WITH (FORMAT csv)
+            """, [start, end]).decode(), spool)
+            cursor.execute("SET LOCAL events_service.archiving = 'off'")
+        if not spool.tell():
+            return 0
+        spool.seek(0)
+        rows = _write_parquet(spool, path)
+        ArchivedPart.objects.create(day=day, path=relative_path, rows=rows)
+    logger.info(f'Archived {rows} events of {day} to {relative_path}')
+    return rows
+
+
+def _write_parquet(csv_file, path):
+    reader = pa_csv.open_csv(csv_file, read_options=pa_csv.ReadOptions(column_names=CSV_COLUMNS),
+                             convert_options=pa_csv.ConvertOptions(column_types=CSV_TYPES))
+    rows = 0
+    with pq.ParquetWriter(path, PARQUET_SCHEMA, compression='zstd') as writer:
+        for batch in reader:
+            columns = batch.columns
+            columns[1] = pc.cast(columns[1], PARQUET_SCHEMA.field('occurred_at').type)
+            writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=PARQUET_SCHEMA), row_group_size=ROW_GROUP_SIZE)
+            rows += batch.num_rows
+    return rows
+
+
+def compact_closed_days(hot_days=None, today=None):
+    """Archive every UTC day older than `hot_days` days that still has events in Postgres."""
+    hot_days = settings.EVENTS_HOT_DAYS if hot_days is None else hot_days
+    cutoff = day_start((today or timezone.now().date()) - timedelta(days=hot_days))
+    archived = 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT min(occurred_at) FROM events WHERE occurred_at < %s', [cutoff])
+            oldest = cursor.fetchone()[0]
+        if oldest is None:
+            return archived
+        archived += archive_day(oldest.astimezone(dt_timezone.utc).date())
+
+
+def archived_days(start_day=None, end_day=None):
+    query = ArchivedPart.objects.all()
+    if start_day is not None: query = query.filter(day__gte=start_day)
+    if end_day is not None: query = query.filter(day__lte=end_day)
+    return set(query.values_list('day', flat=True).distinct())
+
+
+def part_paths(days):
+    return [os.path.join(settings.EVENTS_COLD_STORAGE_DIR, path)
+            for path in ArchivedPart.objects.filter(day__in=list(days)).order_by('id').values_list('path', flat=True)]
+
+
+def connect_duckdb():
+    """An in-memory DuckDB bounded by EVENTS_COLD_MEMORY_LIMIT, spilling to EVENTS_COLD_TEMP_DIR, in UTC."""
+    duck = duckdb.connect(config={
+        'memory_limit': settings.EVENTS_COLD_MEMORY_LIMIT,
+        'temp_directory': settings.EVENTS_COLD_TEMP_DIR or os.path.join(tempfile.gettempdir(), 'duckdb'),
+    })
+    duck.execute("SET TimeZone = 'UTC'")
+    return duck
+
+
+def cold_query(days, sql, params=None):
+    """Run `sql` with DuckDB over an `events` view of the archived parts of `days`; [] when none are archived."""
+    paths = part_paths(days)
+    if not paths:
+        return []
+    with connect_duckdb() as duck:
+        duck.read_parquet(paths).create_view('events')
+        return duck.execute(sql, params or []).fetchall()
+
+
+def cold_batches(days, sql, params, size):
+    """Like cold_query, but yields the rows in lists of at most `size` instead of loading them all."""
+    paths = part_paths(days)
+    if not paths:
+        return
+    with connect_duckdb() as duck:
+        duck.read_parquet(paths).create_view('events')
+        duck.execute(sql, params)
+        while rows := duck.fetchmany(size):
+            yield rows
@@ -0,0 +1,86 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import uuid
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from events_service.models import ImportCheckpoint
+from events_service.utils.bulk_insert import copy_events
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_BYTES = 16 * 1024 * 1024
+
+
+def source_key(path, chunk_bytes):
+    stat = os.stat(path)
+    digest = hashlib.sha1(f'{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}'.encode()).hexdigest()
+    return f'{digest}:{chunk_bytes}'
+
+
+def chunk_count(path, chunk_bytes):
+    return max(1, -(-os.path.getsize(path) // chunk_bytes))
+
+
+def read_header(path):
+    with open(path, newline='', encoding='utf-8') as csvfile:
+        return next(csv.reader(csvfile))
+
+
+def iter_chunk_lines(path, chunk_no, chunk_bytes):
+    # A line belongs to the chunk its first byte falls into, so chunks can be read independently.
+    # Quoted fields must not contain raw newlines.
+    start = chunk_no * chunk_bytes
+    end = start + chunk_bytes
+    with open(path, 'rb') as f:
+        if start:
+            f.seek(start - 1)
+        f.readline()  # header or the tail of the previous chunk's last line
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line.decode('utf-8')
+
+
+def parse_row(row):
+    occurred_at = parse_datetime(row['occurred_at'])
+    if occurred_at is None:
+        raise ValueError(f"invalid occurred_at {row['occurred_at']!r}")
+    properties = json.loads(row['properties_json']) if row['properties_json'] else {}
+    return (str(uuid.UUID(row['event_id'])), occurred_at.isoformat(), int(row['user_id']), row['event_type'],
+            json.dumps(properties))
+
+
+def import_chunk(path, source, chunk_no, chunk_bytes=CHUNK_BYTES):
+    """Import one chunk through COPY and record its checkpoint in the same transaction.
+
+    Returns (imported, skipped, errors).
+    """
+    header = read_header(path)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    valid_count = 0
+    error_count = 0
+    for values in csv.reader(iter_chunk_lines(path, chunk_no, chunk_bytes)):
+        row = dict(zip(header, values))
+        try:
+            writer.writerow(parse_row(row))
+            valid_count += 1
+        except (KeyError, ValueError, TypeError) as e:
+            logger.error(f'CLI. Error importing event {row.get("event_id")}: {e}')
+            error_count += 1
+    buffer.seek(0)
+
+    with transaction.atomic():
+        if ImportCheckpoint.objects.filter(source=source, chunk=chunk_no).exists():
+            return 0, 0, 0
+        imported_count = len(copy_events(buffer))
+        skipped_count = valid_count - imported_count
+        ImportCheckpoint.objects.create(source=source, chunk=chunk_no, imported=imported_count,
+                                        skipped=skipped_count, errors=error_count)
+    return imported_count, skipped_count, error_count
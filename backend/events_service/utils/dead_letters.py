@@ -0,0 +1,61 @@
+from celery import current_app
+from django.conf import settings
+from django.utils import timezone
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def _queue(connection):
+    return connection.SimpleQueue(settings.INGEST_DEAD_LETTER_QUEUE)
+
+
+def dead_letter(payload, error, task_id=None, retries=0):
+    """Park a failed ingest chunk in the dead-letter queue on the broker.
+
+    The broker rather than Postgres: the failure being parked is most often the database itself.
+    """
+    letter = {"payload": payload, "error": repr(error), "task_id": task_id, "retries": retries,
+              "failed_at": timezone.now().isoformat()}
+    with current_app.connection_for_write() as connection:
+        queue = _queue(connection)
+        queue.put(letter, serializer='json', compression=settings.INGEST_TASK_COMPRESSION or None)
+        queue.close()
+    logger.error(f"Dead-lettered ingest chunk of task {task_id} after {retries} retries: {error!r}")
+
+
+def read_dead_letters(handle, limit=None):
+    """Call handle(letter) for up to `limit` dead letters; those it returns True for are removed, the others stay queued.
+
+    Only the letters queued at the start are read, so a replayed chunk that fails again is not read twice.
+    """
+    handled = 0
+    with current_app.connection_for_read() as connection:
+        queue = _queue(connection)
+        limit = queue.qsize() if limit is None else min(limit, queue.qsize())
+        pending = []
+        try:
+            while len(pending) + handled < limit:
+                try:
+                    message = queue.get(block=False)
+                except queue.Empty:
+                    break
+                if handle(message.payload):
+                    message.ack()
+                    handled += 1
+                else:
+                    pending.append(message)
+        finally:
+            for message in pending:
+                message.requeue()
+            queue.close()
+    return handled
+
+
+def purge_dead_letters():
+    with current_app.connection_for_write() as connection:
+        queue = _queue(connection)
+        purged = queue.clear()
+        queue.close()
+    return purged
@@ -0,0 +1,57 @@
+import threading
+from django.db import connection, connections
+
+
+# Properties stored in typed columns of events, with the JSON type they hold; a value of any other
+# type (or a price that a double would round) stays in the properties JSONB. The events_compact
+# trigger moves them out of the incoming properties, so writers keep sending the full object.
+TYPED_PROPERTIES = {'country': str, 'session_id': str, 'currency': str, 'price': float}
+# Id of an event type name for raw SQL filters: a name never stored matches no row
+EVENT_TYPE_ID = '(SELECT id FROM event_types WHERE name = %s)'
+
+_names = {}
+_ids = {}
+_names_lock = threading.Lock()
+
+
+def properties_sql(alias='events'):
+    """SQL of an events row's full properties object: the JSONB rest merged with the typed columns."""
+    columns = ', '.join(f"'{key}', {alias}.{key}" for key in TYPED_PROPERTIES)
+    return f'{alias}.properties || jsonb_strip_nulls(jsonb_build_object({columns}))'
+
+
+def event_type_name(type_id):
+    """Name of an event_types id. Ids are never reused, so the process-wide cache never goes stale."""
+    name = _names.get(type_id)
+    if name is None:
+        with _names_lock, connection.cursor() as cursor:
+            cursor.execute('SELECT id, name FROM event_types')
+            _names.update(cursor.fetchall())
+        name = _names[type_id]
+    return name
+
+
+def event_type_id(name, using):
+    """Id of an event type name for ORM filters, 0 (matching no row) for a name never stored.
+
+    Looked up on the `using` connection on a cache miss. Only ids read outside a transaction are
+    cached: inside one, the name may have been registered by that transaction and be rolled back.
+    """
+    type_id = _ids.get(name)
+    if type_id is None:
+        with connections[using].cursor() as cursor:
+            cursor.execute('SELECT id FROM event_types WHERE name = %s', [name])
+            row = cursor.fetchone()
+        if row is None:
+            return 0
+        type_id = row[0]
+        if not connections[using].in_atomic_block:
+            _ids[name] = type_id
+    return type_id
+
+
+def event_type_ids(names):
+    """{name: id} for `names`, registering unknown ones. Not cached: a registration is undone with its transaction."""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT name, events_type_id(name) FROM unnest(%s::text[]) AS types(name)', [sorted(names)])
+        return dict(cursor.fetchall())
@@ -0,0 +1,36 @@
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+
+PAYLOAD_VERSION = 1
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def encode_events(events):
+    """Compact, JSON-safe task payload of validated events.
+
+    {"v": 1, "types": [event types], "rows": [[event_id hex, occurred_at in microseconds since the
+    epoch, user_id, index into types, properties]]}: no per-event keys, no tagged UUID/datetime
+    objects, and each event type is spelled once per chunk.
+    """
+    types = {}
+    rows = []
+    for event in events:
+        event_id = event['event_id']
+        rows.append([event_id.hex if isinstance(event_id, uuid.UUID) else uuid.UUID(str(event_id)).hex,
+                     (event['occurred_at'] - EPOCH) // MICROSECOND, event['user_id'],
+                     types.setdefault(event['event_type'], len(types)), event['properties']])
+    return {"v": PAYLOAD_VERSION, "types": list(types), "rows": rows}
+
+
+def decode_events(payload):
+    """Events of an encode_events payload; a plain list is a message queued before the compact format and is returned as is."""
+    if isinstance(payload, list):
+        return payload
+    if payload.get('v') != PAYLOAD_VERSION:
+        raise ValueError(f"unsupported event payload version {payload.get('v')}")
+    types = payload['types']
+    return [{"event_id": uuid.UUID(hex=event_id), "occurred_at": EPOCH + occurred_at * MICROSECOND, "user_id": user_id,
+             "event_type": types[type_index], "properties": properties}
+            for event_id, occurred_at, user_id, type_index, properties in payload['rows']]
@@ -0,0 +1,163 @@
+import csv
+import io
+import json
+import zlib
+import pyarrow as pa
+import pyarrow.parquet as pq
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections, transaction
+from django.http import Http404
+from events_service.utils.cold_storage import PARQUET_SCHEMA, cold_batches
+from events_service.utils.event_layout import event_type_name, properties_sql
+from events_service.utils.segments import _cold_days
+from events_service.utils.time_range import range_sql
+from events_service.utils.workload import CSV_HEADER
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+
+
+class ExportNegotiation(DefaultContentNegotiation):
+    """An unknown ?format= reaches the view, which answers 400, instead of DRF's 404."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except Http404:
+            return renderers[0], renderers[0].media_type
+
+
+class ExportRenderer(JSONRenderer):
+    """Picks the export format from ?format= or the Accept header; rows are streamed by the view, errors render as JSON."""
+
+
+class CSVExportRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class NDJSONExportRenderer(ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class ParquetExportRenderer(ExportRenderer):
+    media_type = 'application/vnd.apache.parquet'
+    format = 'parquet'
+
+
+def event_batches(alias, start, end, segment, fetch_rows):
+    """Lists of at most `fetch_rows` (event_id, occurred_at, user_id, event_type, properties JSON) in [start, end).
+
+    Archived days come first, read from their Parquet parts one day at a time, so DuckDB only sorts
+    a day of events at once, then the Postgres rows through a server-side cursor on `alias`; each
+    tier is ordered by occurred_at. The cursor lives in a transaction, so that it streams instead of
+    being materialized as a WITH HOLD cursor. Event ids come as text: parsing them into UUIDs only
+    to format them again costs a third of the export.
+    """
+    where, params = range_sql('occurred_at', start, end, placeholder='?')
+    segment_where, segment_params = segment.cold_sql()
+    for day in sorted(_cold_days(start, end)):
+        yield from cold_batches([day], f"""
+            SELECT event_id, occurred_at, user_id, event_type, properties FROM events
+            WHERE {where} AND {segment_where} ORDER BY occurred_at
+        """, params + segment_params, fetch_rows)
+
+    where, params = range_sql('occurred_at', start, end)
+    segment_where, segment_params = segment.events_sql()
+    with transaction.atomic(using=alias), connections[alias].chunked_cursor() as cursor:
+        cursor.execute(f"""
+            SELECT event_id::text, occurred_at, user_id, event_type_id, {properties_sql()} FROM events
+            WHERE {where} AND {segment_where} ORDER BY occurred_at
+        """, params + segment_params)
+        while rows := cursor.fetchmany(fetch_rows):
+            yield [(event_id, occurred_at, user_id, event_type_name(type_id), properties)
+                   for event_id, occurred_at, user_id, type_id, properties in rows]
+
+
+def csv_chunks(batches):
+    """The import_events CSV layout, one chunk per batch."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for rows in batches:
+        writer.writerows((event_id, occurred_at.isoformat(), user_id, event_type, properties)
+                         for event_id, occurred_at, user_id, event_type, properties in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def ndjson_chunks(batches):
+    """The POST /api/events shape, one event per line; properties are already JSON text."""
+    for rows in batches:
+        yield ''.join(f'{{"event_id":"{event_id}","occurred_at":"{occurred_at.isoformat()}","user_id":{user_id},'
+                      f'"event_type":{json.dumps(event_type)},"properties":{properties}}}\n'
+                      for event_id, occurred_at, user_id, event_type, properties in rows).encode()
+
+
+class _Spool(io.RawIOBase):
+    """Write-only file whose contents are taken out as they are written."""
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+
+def parquet_chunks(batches):
+    """A Parquet file with the archive parts' schema, one row group per batch; the footer comes last."""
+    spool = _Spool()
+    with pq.ParquetWriter(spool, PARQUET_SCHEMA) as writer:
+        for rows in batches:
+            writer.write_table(pa.Table.from_arrays([pa.array(column, type=field.type) for column, field
+                                                     in zip(zip(*rows), PARQUET_SCHEMA)], schema=PARQUET_SCHEMA))
+            yield spool.drain()
+    yield spool.drain()
+
+
+WRITERS = {'csv': csv_chunks, 'ndjson': ndjson_chunks, 'parquet': parquet_chunks}
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for chunk in chunks:
+        if compressed := compressor.compress(chunk):
+            yield compressed
+    yield compressor.flush()
+
+
+def streamed(request, chunks):
+    """Content for a StreamingHttpResponse of the `chunks` generator.
+
+    Under ASGI Django would collect a sync iterator into a list before sending it, so it gets an
+    async one that pulls each chunk on the request's thread, where the cursor's transaction is.
+    """
+    if not isinstance(request, ASGIRequest):
+        return chunks
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+
+    async def pull():
+        try:
+            while (chunk := await next_chunk(chunks, None)) is not None:
+                yield chunk
+        finally:
+            await sync_to_async(chunks.close, thread_sensitive=True)()
+    return pull()
@@ -0,0 +1,100 @@
+import tempfile
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from events_service.utils.cold_storage import connect_duckdb, part_paths
+from events_service.utils.replicas import read_connection
+from events_service.utils.segments import _cold_days
+from events_service.utils.time_range import range_sql
+
+
+HOT_COLUMNS = ('user_id', 'occurred_at', 'step')
+HOT_TYPES = {'user_id': pa.int32(), 'occurred_at': pa.int64(), 'step': pa.int16()}
+
+
+def _epoch_us(moment):
+    return round(moment.timestamp() * 1_000_000)
+
+
+def hot_steps_sql(steps, start, end):
+    """(SELECT of user_id, occurred_at in µs and step number of the Postgres events of the funnel's types, params).
+
+    The step numbers come from joining the step names, so each type is one range of the
+    (event_type_id, occurred_at) INCLUDE (user_id) index, read by an index-only scan.
+    """
+    where, params = range_sql('e.occurred_at', start, end)
+    return f"""
+        SELECT e.user_id, (date_part('epoch', e.occurred_at) * 1000000)::bigint, s.step
+        FROM unnest(%s::text[]) WITH ORDINALITY AS s(name, step)
+        JOIN event_types t ON t.name = s.name JOIN events e ON e.event_type_id = t.id
+        WHERE {where}
+    """, [steps] + params
+
+
+def _load_steps(duck, steps, start, end):
+    """Fill a DuckDB `funnel_events` table with (user_id, occurred_at in µs, step number) of both tiers.
+
+    Only the events of the funnel's types are read: the Postgres rows with one COPY, the archived
+    ones from their Parquet parts.
+    """
+    sql, params = hot_steps_sql(steps, start, end)
+    with read_connection().cursor() as cursor, tempfile.TemporaryFile() as spool:
+        cursor.copy_expert(cursor.mogrify(f'COPY ({sql}) TO STDOUT WITH (FORMAT csv)', params).decode(), spool)
+        if spool.tell():
+            spool.seek(0)
+            hot = pa_csv.read_csv(spool, read_options=pa_csv.ReadOptions(column_names=HOT_COLUMNS),
+                                  convert_options=pa_csv.ConvertOptions(column_types=HOT_TYPES))
+        else:
+            hot = pa.schema(HOT_TYPES.items()).empty_table()
+    duck.register('hot', hot)
+    duck.execute('CREATE TABLE funnel_events AS SELECT * FROM hot')
+    duck.unregister('hot')
+
+    paths = part_paths(_cold_days(start, end))
+    if paths:
+        where, params = range_sql('occurred_at', start, end, placeholder='?')
+        duck.execute(f"""
+            INSERT INTO funnel_events
+            SELECT user_id, epoch_us(occurred_at), list_position(?, event_type) FROM read_parquet(?)
+            WHERE list_contains(?, event_type) AND {where}
+        """, [steps, paths, steps] + params)
+
+
+def funnel(steps, start, end, window):
+    """Users through each step of a conversion funnel entered in [start, end), with the median time since the previous step.
+
+    A user enters with an event of the first step in the range and reaches step k with an event of
+    that type strictly after reaching step k - 1, at most `window` after the entering event; they
+    count once per step, whichever entry gets furthest. Each step is one ASOF join of its events,
+    sorted by (user_id, occurred_at), to the previous step's: an event extends the latest chain
+    that reached the previous step before it, which is the chain with the most time left. The
+    step time of a user is the one of their first event reaching the step.
+    Returns [{"event_type", "users", "median_seconds_from_previous"}], one entry per step.
+    """
+    window_us = round(window.total_seconds() * 1_000_000)
+    levels = ["""reached_1 AS MATERIALIZED (
+        SELECT user_id, occurred_at, occurred_at AS entered_at, NULL::BIGINT AS gap FROM funnel_events
+        WHERE step = 1 AND occurred_at < $end
+    )"""]
+    for step in range(2, len(steps) + 1):
+        levels.append(f"""reached_{step} AS MATERIALIZED (
+            SELECT e.user_id, e.occurred_at, p.entered_at, e.occurred_at - p.occurred_at AS gap
+            FROM (SELECT user_id, occurred_at FROM funnel_events WHERE step = {step}) e
+            ASOF JOIN reached_{step - 1} p ON e.user_id = p.user_id AND e.occurred_at > p.occurred_at
+            WHERE e.occurred_at - p.entered_at <= $window
+        )""")
+    reached = ' UNION ALL '.join(f'SELECT {step} AS step, user_id, occurred_at, gap FROM reached_{step}'
+                                 for step in range(1, len(steps) + 1))
+    with connect_duckdb() as duck:
+        _load_steps(duck, steps, start, end + window)
+        rows = duck.execute(f"""
+            WITH {', '.join(levels)},
+            users AS (SELECT step, user_id, arg_min(gap, occurred_at) AS gap FROM ({reached}) GROUP BY step, user_id)
+            SELECT step, count(*), median(gap) FROM users GROUP BY step
+        """, {'end': _epoch_us(end), 'window': window_us}).fetchall()
+    reached_users = {step: (users, gap) for step, users, gap in rows}
+    stats = []
+    for step, event_type in enumerate(steps, 1):
+        users, gap = reached_users.get(step, (0, None))
+        stats.append({"event_type": event_type, "users": users,
+                      "median_seconds_from_previous": None if gap is None else round(gap / 1_000_000, 3)})
+    return stats
@@ -0,0 +1,91 @@
+import math
+
+
+PRECISION = 14
+REGISTERS = 1 << PRECISION
+RELATIVE_ERROR = 1.04 / math.sqrt(REGISTERS)
+
+_MASK64 = (1 << 64) - 1
+_REST_BITS = 64 - PRECISION
+_HIGH_BITS = int.from_bytes(b'\x80' * REGISTERS, 'big')
+_ALPHA_INF = 1 / (2 * math.log(2))
+
+
+def _mix64(value):
+    # splitmix64 finalizer: user ids are small sequential integers and need a well spread hash
+    value = (value + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+
+def _sigma(x):
+    if x == 1:
+        return math.inf
+    y, z = 1.0, x
+    while True:
+        x *= x
+        previous, z = z, z + x * y
+        y += y
+        if z == previous:
+            return z
+
+
+def _tau(x):
+    if x in (0, 1):
+        return 0.0
+    y, z = 1.0, 1 - x
+    while True:
+        x = math.sqrt(x)
+        y *= 0.5
+        previous, z = z, z - (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+
+class HyperLogLog:
+    """HyperLogLog sketch of integer ids with one byte per register.
+
+    Sketches merge by taking the register-wise maximum, so per-day sketches can be combined
+    into any range without going back to raw rows.
+    """
+
+    def __init__(self, registers=None):
+        self.registers = bytearray(registers) if registers is not None else bytearray(REGISTERS)
+
+    def add(self, value):
+        hashed = _mix64(value)
+        index = hashed >> _REST_BITS
+        rank = _REST_BITS - (hashed & ((1 << _REST_BITS) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def update(self, values):
+        changed = False
+        for value in values:
+            changed = self.add(value) or changed
+        return changed
+
+    def merge(self, other):
+        # Register values are < 128, so a byte-wise max can be done on whole big integers:
+        # the high bit of ((a | 0x80) - b) in each byte is set exactly where a >= b.
+        a = int.from_bytes(self.registers, 'big')
+        b = int.from_bytes(other.registers, 'big')
+        mask = ((((a | _HIGH_BITS) - b) & _HIGH_BITS) >> 7) * 0xFF
+        self.registers = bytearray((b ^ ((a ^ b) & mask)).to_bytes(REGISTERS, 'big'))
+        return self
+
+    def count(self):
+        # Ertl's improved estimator ("New cardinality estimation algorithms for HyperLogLog sketches"):
+        # unbiased over the whole range without the small/large range switches and bias tables.
+        histogram = [self.registers.count(rank) for rank in range(_REST_BITS + 2)]
+        denominator = REGISTERS * _tau(1 - histogram[-1] / REGISTERS)
+        for count in reversed(histogram[1:-1]):
+            denominator = (denominator + count) * 0.5
+        denominator += REGISTERS * _sigma(histogram[0] / REGISTERS)
+        return round(_ALPHA_INF * REGISTERS * REGISTERS / denominator)
+
+    def __bytes__(self):
+        return bytes(self.registers)
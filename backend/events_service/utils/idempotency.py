@@ -0,0 +1,51 @@
+import hashlib
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from events_service.models import IdempotencyKey
+
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_fingerprint(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _expiry_cutoff():
+    return timezone.now() - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+
+
+def claim(key, request_fingerprint):
+    """Claim `key` for a first request; None when claimed, else the stored IdempotencyKey (status_code None while in flight).
+
+    Request keys older than IDEMPOTENCY_KEY_TTL_HOURS count as unused.
+    """
+    with transaction.atomic():
+        IdempotencyKey.objects.filter(key=key, created_at__lt=_expiry_cutoff()).delete()
+        record, created = IdempotencyKey.objects.get_or_create(key=key, defaults={'fingerprint': request_fingerprint})
+    return None if created else record
+
+
+def complete(key, status_code, response, request_fingerprint=None):
+    """Store the response; streamed bodies are only fingerprinted once read, so they pass theirs here."""
+    fields = {'status_code': status_code, 'response': response}
+    if request_fingerprint is not None:
+        fields['fingerprint'] = request_fingerprint
+    IdempotencyKey.objects.filter(key=key).update(**fields)
+
+
+def release(key):
+    IdempotencyKey.objects.filter(key=key, status_code__isnull=True).delete()
+
+
+def expire_keys():
+    """Drop request keys past IDEMPOTENCY_KEY_TTL_HOURS; file keys of import_events are kept."""
+    deleted, _ = IdempotencyKey.objects.filter(key__startswith='request:', created_at__lt=_expiry_cutoff()).delete()
+    return deleted
@@ -0,0 +1,80 @@
+import asyncio
+import json
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import django
+from django.conf import settings
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _init_validation_worker():
+    django.setup()
+
+
+def validate_body(body):
+    """(events in the batch, valid events, indexed errors) of a JSON array body; (None, [], []) when it is not an array.
+
+    Raises ValueError for malformed JSON.
+    """
+    # Imported here: spawned pool workers import this module before django.setup() has loaded the models
+    from events_service.serializers import get_batch_validator
+    items = json.loads(body)
+    if not isinstance(items, list):
+        return None, [], []
+    valid_events, errors = get_batch_validator().validate(items)
+    return len(items), valid_events, errors
+
+
+def count_body(body):
+    """Events in a JSON array body, None when it is not an array; raises ValueError for malformed JSON."""
+    items = json.loads(body)
+    return len(items) if isinstance(items, list) else None
+
+
+def _pool(name, factory):
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = factory()
+        return _pools[name]
+
+
+def validation_pool():
+    # spawn, not fork: the parent runs an event loop and threads that a forked child would inherit mid-flight
+    return _pool('validation', lambda: ProcessPoolExecutor(max_workers=settings.INGEST_VALIDATION_WORKERS,
+                                                           mp_context=multiprocessing.get_context('spawn'),
+                                                           initializer=_init_validation_worker))
+
+
+def publish_pool():
+    return _pool('publish', lambda: ThreadPoolExecutor(max_workers=settings.INGEST_PUBLISH_THREADS,
+                                                       thread_name_prefix='ingest-publish'))
+
+
+async def validate_async(body):
+    """validate_body off the event loop: bodies of INGEST_INLINE_VALIDATION_BYTES or more go to the process pool."""
+    if len(body) < settings.INGEST_INLINE_VALIDATION_BYTES:
+        return validate_body(body)
+    return await asyncio.get_running_loop().run_in_executor(validation_pool(), validate_body, body)
+
+
+async def count_async(body):
+    """count_body off the event loop like validate_async, so a batch is rate-limited before it is validated.
+
+    The body is parsed again for validation: a refused batch costs one parse instead of a validation.
+    """
+    if len(body) < settings.INGEST_INLINE_VALIDATION_BYTES:
+        return count_body(body)
+    return await asyncio.get_running_loop().run_in_executor(validation_pool(), count_body, body)
+
+
+async def publish_async(publish, *args):
+    """publish(*args), a function queueing Celery tasks, on the publish pool.
+
+    Celery has no asyncio producer: a slow broker ack occupies one of INGEST_PUBLISH_THREADS
+    threads, and the requests behind it wait as coroutines instead of holding a thread each.
+    """
+    return await asyncio.get_running_loop().run_in_executor(publish_pool(), publish, *args)
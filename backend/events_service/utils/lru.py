@@ -0,0 +1,60 @@
+import pickle
+import threading
+from collections import OrderedDict
+
+
+MISSING = object()
+
+
+def approximate_size(key, value):
+    """Bytes an entry is counted for: its key and its pickled value."""
+    return len(key) + len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+class LRUCache:
+    """Thread-safe in-process mapping that evicts the least recently used entries above `max_entries`.
+
+    With `max_bytes`, entries are also evicted while their approximate_size() adds up to more than
+    it, and a value larger than `max_bytes` on its own is not stored.
+    """
+
+    def __init__(self, max_entries, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        size = approximate_size(key, value) if self.max_bytes is not None else 0
+        with self._lock:
+            self._discard(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.size += size
+            while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.size > self.max_bytes):
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        if key in self._entries:
+            del self._entries[key]
+            self.size -= self._sizes.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,235 @@
+import atexit
+import bisect
+import json
+import math
+import os
+import threading
+from django.conf import settings
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1, 5, 10, 20, 50, 100, 250, 500, 1000, 5000, 10000, 50000, 100000)
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+class _Metric:
+    """Values sharded per thread: an update touches only the calling thread's dict, so the hot path takes no lock.
+
+    Collection copies every shard (dict copies are atomic under the GIL) and merges them. The shard
+    of a thread that has ended is folded into `base`, when a new shard is made or on collection, so
+    short-lived threads (sync_to_async, Celery thread pools) do not pile up shards.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.local = threading.local()
+        self.shards = {}  # {thread: its values}
+        self.base = {}  # values of the threads that have ended
+        self.shards_lock = threading.Lock()
+        with _metrics_lock:
+            _metrics[name] = self
+
+    def shard(self):
+        shard = getattr(self.local, 'values', None)
+        if shard is None:
+            shard = self.local.values = {}
+            with self.shards_lock:
+                self._fold_finished()
+                self.shards[threading.current_thread()] = shard
+        return shard
+
+    def _fold_finished(self):
+        # Under shards_lock; an ended thread no longer writes to its shard
+        for thread in [thread for thread in self.shards if not thread.is_alive()]:
+            for labels, value in self.shards.pop(thread).items():
+                self.base[labels] = self.merge(self.base.get(labels), value)
+
+    def collect(self):
+        with self.shards_lock:
+            self._fold_finished()
+            shards = [self.base.copy(), *self.shards.values()]
+        totals = {}
+        for shard in shards:
+            for labels, value in shard.copy().items():
+                totals[labels] = self.merge(totals.get(labels), value)
+        return totals
+
+    def reset(self):
+        with self.shards_lock:
+            self.shards = {}
+            self.base = {}
+        self.local = threading.local()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        shard = self.shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+
+class Histogram(_Metric):
+    """Per-bucket counts (not cumulative) followed by the sum and count of observations."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self.shard()
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0] * (len(self.buckets) + 3)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    @staticmethod
+    def merge(total, counts):
+        return list(counts) if total is None else [a + b for a, b in zip(total, counts)]
+
+
+def counter(name, documentation, labelnames=()):
+    return _metrics.get(name) or Counter(name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return _metrics.get(name) or Histogram(name, documentation, labelnames, buckets)
+
+
+def snapshot():
+    """{metric name: [[labels, value], ...]} of this process, JSON-safe."""
+    return {name: [[list(labels), value] for labels, value in metric.collect().items()]
+            for name, metric in list(_metrics.items())}
+
+
+# Cross-process aggregation: every process writes its snapshot to METRICS_DIR/<pid>.json every
+# METRICS_FLUSH_INTERVAL seconds from a background thread, and a scrape adds up all the files. The
+# files of exited processes stay, so counters do not go backwards; clear the directory on deploy.
+
+def _path(pid):
+    return os.path.join(settings.METRICS_DIR, f'{pid}.json')
+
+
+def write_snapshot():
+    path = _path(os.getpid())
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(snapshot(), file)
+    os.replace(tmp_path, path)
+
+
+def _flush_loop(stop):
+    while not stop.wait(settings.METRICS_FLUSH_INTERVAL):
+        write_snapshot()
+
+
+_flusher = {}
+
+
+def start_flusher():
+    if not settings.METRICS_DIR or _flusher.get('pid') == os.getpid():
+        return
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    stop = threading.Event()
+    threading.Thread(target=_flush_loop, args=(stop,), name='metrics-flush', daemon=True).start()
+    _flusher.update(pid=os.getpid(), stop=stop)
+
+
+def _after_fork():
+    # A forked child (Celery prefork, gunicorn) starts from zero: its parent reports the inherited values
+    for metric in list(_metrics.values()):
+        metric.reset()
+    _flusher.clear()
+    start_flusher()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(lambda: settings.METRICS_DIR and _flusher.get('pid') == os.getpid() and write_snapshot())
+
+
+def collect_all():
+    """{metric name: {labels: value}} over this process and, with METRICS_DIR set, every process that wrote a snapshot."""
+    totals = {name: metric.collect() for name, metric in list(_metrics.items())}
+    if not settings.METRICS_DIR or not os.path.isdir(settings.METRICS_DIR):
+        return totals
+    own_file = f'{os.getpid()}.json'
+    for file_name in os.listdir(settings.METRICS_DIR):
+        if not file_name.endswith('.json') or file_name == own_file:
+            continue
+        try:
+            with open(os.path.join(settings.METRICS_DIR, file_name)) as file:
+                other = json.load(file)
+        except (OSError, ValueError):
+            continue  # replaced or removed while reading
+        for name, values in other.items():
+            metric = _metrics.get(name)
+            if metric is None:
+                continue
+            metric_totals = totals.setdefault(name, {})
+            for labels, value in values:
+                labels = tuple(labels)
+                metric_totals[labels] = metric.merge(metric_totals.get(labels), value)
+    return totals
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def exposition():
+    """All metrics in the Prometheus text format."""
+    lines = []
+    for name, values in sorted(collect_all().items()):
+        metric = _metrics[name]
+        lines += [f'# HELP {name} {metric.documentation}', f'# TYPE {name} {metric.kind}']
+        for labels, value in sorted(values.items()):
+            if metric.kind == 'counter':
+                lines.append(f'{name}{_labels(metric.labelnames, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip((*metric.buckets, math.inf), value):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(metric.labelnames, labels, [("le", _number(bound))])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(metric.labelnames, labels)} {_number(value[-2])}')
+            lines.append(f'{name}_count{_labels(metric.labelnames, labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_DURATION = histogram('http_request_duration_seconds', 'Request latency', ('method', 'route', 'status'))
+DB_QUERY_DURATION = histogram('db_query_duration_seconds', 'Database time per request', ('route',))
+EVENTS_ACCEPTED = counter('ingest_events_accepted_total', 'Events queued for ingest', ('source',))
+EVENTS_REJECTED = counter('ingest_events_rejected_total', 'Events rejected by validation', ('source',))
+BATCH_SIZE = histogram('ingest_batch_size_events', 'Events per ingest request', ('source',), SIZE_BUCKETS)
+TASK_DURATION = histogram('celery_task_duration_seconds', 'Celery task run time', ('task', 'state'))
+EVENTS_CREATED = counter('ingest_events_created_total', 'Events stored by process_event_batch')
+EVENTS_SKIPPED = counter('ingest_events_skipped_total', 'Duplicate events skipped by process_event_batch')
+
+
+def record_ingest(source, accepted, rejected):
+    EVENTS_ACCEPTED.inc(source, amount=accepted)
+    if rejected:
+        EVENTS_REJECTED.inc(source, amount=rejected)
+    BATCH_SIZE.observe(accepted + rejected, source)
@@ -0,0 +1,101 @@
+import os
+import re
+from datetime import date, datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from events_service.models import ArchivedPart
+from events_service.utils.cold_storage import lock_archive
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r'^events_p(\d{4})(\d{2})$')
+EVENT_IDS_DELETE_BATCH = 50000
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def ensure_partitions(months_ahead=None):
+    """Create monthly partitions from the current month up to `months_ahead` months ahead."""
+    months_ahead = settings.EVENTS_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    current = timezone.now().date().replace(day=1)
+    with connection.cursor() as cursor:
+        for offset in range(months_ahead + 1):
+            cursor.execute('SELECT events_ensure_month_partition(%s)', [add_months(current, offset)])
+
+
+def month_partitions():
+    """[(month, partition name)] of the monthly events partitions, oldest first."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'events'::regclass
+        """)
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((date(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(partitions)
+
+
+def expired_partitions(retention_months, today=None):
+    cutoff = add_months((today or timezone.now().date()).replace(day=1), -retention_months)
+    return [(month, name) for month, name in month_partitions() if month < cutoff]
+
+
+def drop_partition(month, name, detach_only=False):
+    """Detach (and unless `detach_only`, drop) one monthly partition, with the month's archived parts, and release its event_ids.
+
+    The parts are unregistered in the transaction that detaches the partition, so reads never see
+    one tier of the month without the other; their Parquet files are deleted once it commits, or
+    kept next to the detached table when `detach_only`. Rollups, sketches and bitmaps of the month
+    are kept: detaching fires no delete triggers.
+    """
+    lower_bound = datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+    next_month = add_months(month, 1)
+    upper_bound = datetime(next_month.year, next_month.month, 1, tzinfo=dt_timezone.utc)
+    quoted = connection.ops.quote_name(name)
+    with transaction.atomic(), connection.cursor() as cursor:
+        lock_archive()  # no day of the month is being archived or read from its parts meanwhile
+        cursor.execute(f'ALTER TABLE events DETACH PARTITION {quoted}')
+        if not detach_only:
+            cursor.execute(f'DROP TABLE {quoted}')
+        parts = ArchivedPart.objects.filter(day__gte=month, day__lt=next_month)
+        paths = list(parts.values_list('path', flat=True))
+        parts.delete()
+    if not detach_only:
+        _remove_parts(paths)
+    released = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("""
+                DELETE FROM event_ids WHERE event_id IN (
+                    SELECT event_id FROM event_ids WHERE occurred_at >= %s AND occurred_at < %s LIMIT %s)
+            """, [lower_bound, upper_bound, EVENT_IDS_DELETE_BATCH])
+            released += cursor.rowcount
+            if cursor.rowcount < EVENT_IDS_DELETE_BATCH:
+                break
+    logger.info(f'Partition {name} {"detached" if detach_only else "dropped"} with {len(paths)} archived parts, '
+                f'{released} event ids released')
+    return released
+
+
+def _remove_parts(paths):
+    for path in paths:
+        path = os.path.join(settings.EVENTS_COLD_STORAGE_DIR, path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.rmdir(os.path.dirname(path))  # the day's directory, once its last part is gone
+        except OSError:
+            pass
@@ -0,0 +1,93 @@
+import re
+from datetime import timedelta
+from django.db import connection
+from events_service.utils.funnels import hot_steps_sql
+from events_service.utils.retention import retention_matrix
+from events_service.utils.rollups import daily_active_users, refresh_dirty_hours, rolling_active_users
+from events_service.utils.segments import Segment, daily_event_counts, segment_daily_active_users
+from events_service.utils.sketches import unique_users
+from events_service.utils.time_range import day_range
+
+
+# Tables the stats endpoints must reach through an index: events (and its partitions) and the rollups
+STATS_TABLES = re.compile(r'^(events(_p\d{6}|_default)?|rollup_hourly_users|rollup_hourly_event_counts'
+                          r'|rollup_hourly_segments|daily_user_sketches|daily_user_bitmaps)$')
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def capture_queries(func, *args, **kwargs):
+    """The SQL, with its parameters bound, of the explainable statements `func` runs on the default connection."""
+    queries = []
+
+    def capture(execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        if not many and sql.lstrip().upper().startswith(EXPLAINABLE):
+            queries.append(context['cursor'].mogrify(sql, params).decode())
+        return result
+
+    with connection.execute_wrapper(capture):
+        func(*args, **kwargs)
+    return queries
+
+
+def stats_queries(start_day, end_day, event_type='login'):
+    """The SQL the stats endpoints run for [start_day, end_day], including rollup refreshes."""
+    start, end = day_range(start_day, end_day)
+    days = (end_day - start_day).days + 1
+    queries = capture_queries(refresh_dirty_hours, start, end)
+    queries += capture_queries(daily_active_users, start, end, start.tzinfo)
+    queries += capture_queries(daily_event_counts, start, end, start.tzinfo, Segment())
+    queries += capture_queries(rolling_active_users, start_day, end_day, 7)
+    queries += capture_queries(rolling_active_users, start_day, end_day, 7, event_type)
+    queries += capture_queries(unique_users, start_day, end_day)
+    queries += capture_queries(retention_matrix, [start_day + timedelta(days=i) for i in range(days)], 1, 1)
+    queries += capture_queries(segment_daily_active_users, start, end, start.tzinfo, Segment(properties={'country': 'UA'}))
+    queries += capture_queries(segment_daily_active_users, start, end, start.tzinfo, Segment(properties={'session_id': 's1'}))
+    queries += capture_queries(daily_event_counts, start, end, start.tzinfo, Segment(properties={'item_id': 'SKU1'}))
+    with connection.cursor() as cursor:  # the funnel COPYs its rows, which the capture does not see
+        queries.append(cursor.mogrify(*hot_steps_sql([event_type, 'purchase'], start, end)).decode())
+    return queries
+
+
+def _is_full_scan(plan):
+    node_type = plan.get('Node Type')
+    if node_type == 'Seq Scan':
+        return True
+    if node_type in ('Index Scan', 'Index Only Scan'):
+        return 'Index Cond' not in plan
+    if node_type == 'Bitmap Heap Scan':
+        return 'Recheck Cond' not in plan
+    return False
+
+
+def _full_scans(plan):
+    if 'Relation Name' in plan and STATS_TABLES.match(plan['Relation Name']) and _is_full_scan(plan):
+        yield plan['Relation Name']
+    for child in plan.get('Plans', ()):
+        yield from _full_scans(child)
+
+
+def full_scans(sql, min_rows=0):
+    """Stats tables of at least `min_rows` estimated rows that `sql` can only read from end to end.
+
+    The plan is made with enable_seqscan off, so a remaining Seq Scan, or an index scan without an
+    index condition, means no index fits the predicate (e.g. a ::date cast on occurred_at),
+    whatever the table size is today.
+    """
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute('SET enable_seqscan = off')
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            plan = cursor.fetchone()[0]
+        finally:
+            cursor.execute('RESET enable_seqscan')
+        relations = sorted(set(_full_scans(plan[0]['Plan'])))
+        if min_rows and relations:
+            cursor.execute('SELECT relname FROM pg_class WHERE relname = ANY(%s) AND reltuples >= %s', [relations, min_rows])
+            relations = sorted(row[0] for row in cursor.fetchall())
+    return relations
+
+
+def check_plans(queries, min_rows=0):
+    """[(relation, sql)] for every query that falls back to scanning a whole stats table."""
+    return [(relation, sql) for sql in queries for relation in full_scans(sql, min_rows)]
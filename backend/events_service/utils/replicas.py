@@ -0,0 +1,100 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils import timezone
+from events_service.utils.metrics import counter
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+STATS_READS = counter('stats_reads_total', 'Stats requests by the database they read from and why', ('database', 'reason'))
+
+# A replica that replayed all the WAL it received is current, however long ago its last transaction was
+LAG_SQL = """
+    SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+
+# The replica the stats queries of the current request read from; None for the primary
+read_replica = ContextVar('read_replica', default=None)
+_lags = {}
+
+
+class ReplicaRouter:
+    """ORM reads inside stats_reads go to the replica it picked, everything else to the primary."""
+
+    def db_for_read(self, model, **hints):
+        return read_replica.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS  # replicas replay the primary's schema changes
+
+
+def read_connection():
+    """Connection for the raw stats queries: a replica inside stats_reads when it picked one."""
+    return connections[read_replica.get() or DEFAULT_DB_ALIAS]
+
+
+def replica_lag(alias):
+    """Seconds `alias` is behind the primary, None when it cannot be reached.
+
+    Measured at most every REPLICA_LAG_CHECK_INTERVAL seconds; a cached value is aged by the time since.
+    """
+    now = time.monotonic()
+    checked_at, lag = _lags.get(alias, (None, None))
+    if checked_at is None or now - checked_at >= settings.REPLICA_LAG_CHECK_INTERVAL:
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(LAG_SQL)
+                lag = cursor.fetchone()[0]
+            lag = None if lag is None else float(lag)
+        except DatabaseError as exc:
+            logger.warning(f'Replica {alias} is unavailable: {exc}')
+            connections[alias].close()
+            lag = None
+        checked_at = now
+        _lags[alias] = (checked_at, lag)
+    return None if lag is None else lag + now - checked_at
+
+
+def choose_database(start, end):
+    """(alias, reason) of the database to read the stats of [start, end) from.
+
+    A range that ended less than REPLICA_RECENT_SECONDS + REPLICA_MAX_LAG_SECONDS ago may still get
+    events, from ingest or from a lagging replica: the primary serves it. Rollups are rebuilt by a
+    task on the primary and replicated like any other write, so a current replica has the same ones.
+    """
+    if not settings.DATABASE_REPLICAS:
+        return DEFAULT_DB_ALIAS, 'no_replica'
+    recent = timezone.now() - timedelta(seconds=settings.REPLICA_RECENT_SECONDS + settings.REPLICA_MAX_LAG_SECONDS)
+    if end is None or end > recent:
+        return DEFAULT_DB_ALIAS, 'recent'
+    for alias in random.sample(settings.DATABASE_REPLICAS, len(settings.DATABASE_REPLICAS)):
+        lag = replica_lag(alias)
+        if lag is None or lag > settings.REPLICA_MAX_LAG_SECONDS:
+            continue
+        return alias, 'replica'
+    return DEFAULT_DB_ALIAS, 'lag'
+
+
+@contextmanager
+def stats_reads(start, end):
+    """Run the stats queries of [start, end) in the block on the database choose_database picks."""
+    alias, reason = choose_database(start, end)
+    STATS_READS.inc(alias, reason)
+    token = read_replica.set(alias if reason == 'replica' else None)
+    try:
+        yield alias
+    finally:
+        read_replica.reset(token)
@@ -0,0 +1,40 @@
+from datetime import timedelta
+from events_service.utils.roaring import RoaringBitmap
+from events_service.utils.segments import segment_day_bitmaps
+from events_service.utils.user_bitmaps import load_day_bitmaps
+
+
+PERIODS = {'day': 1, 'week': 7}
+
+
+def retention_matrix(cohort_days, windows, period_days, segment=None):
+    """Cohort x window retention from the per-day user bitmaps.
+
+    A cohort is the users active on its start day; window N covers the `period_days` days starting
+    N periods later. With a segment, only events in the segment make a user active.
+    Returns [(cohort_day, cohort_size, [active cohort users per window])].
+    """
+    first_day = min(cohort_days)
+    last_day = max(cohort_days) + timedelta(days=windows * period_days - 1)
+    if segment:
+        bitmaps = segment_day_bitmaps(first_day, last_day, segment)
+    else:
+        bitmaps = load_day_bitmaps(first_day, last_day)
+    empty = RoaringBitmap()
+    window_users = {}
+
+    def active_in_window(start_day):
+        if start_day not in window_users:
+            users = RoaringBitmap()
+            for offset in range(period_days):
+                users = users | bitmaps.get(start_day + timedelta(days=offset), empty)
+            window_users[start_day] = users
+        return window_users[start_day]
+
+    matrix = []
+    for cohort_day in cohort_days:
+        cohort = bitmaps.get(cohort_day, empty)
+        counts = [len(cohort & active_in_window(cohort_day + timedelta(days=window * period_days)))
+                  for window in range(windows)]
+        matrix.append((cohort_day, len(cohort), counts))
+    return matrix
@@ -0,0 +1,111 @@
+import struct
+from array import array
+
+
+CONTAINER_BITS = 1 << 16
+CONTAINER_BYTES = CONTAINER_BITS // 8
+ARRAY_LIMIT = 4096  # above this many values a bitmap container is smaller than a sorted uint16 array
+ARRAY_CONTAINER = 0
+BITMAP_CONTAINER = 1
+_HEADER = struct.Struct('<4sI')
+_CONTAINER = struct.Struct('<HBI')
+_MAGIC = b'RBM1'
+
+
+class RoaringBitmap:
+    """Roaring-style set of non-negative 32-bit integers.
+
+    Values are split by their high 16 bits into containers. In memory every container is a
+    65536-bit Python int, so and/or/cardinality run in C; serialized, sparse containers are
+    stored as sorted uint16 arrays and dense ones as 8 KB bitmaps.
+    """
+
+    def __init__(self, containers=None):
+        self.containers = containers or {}
+
+    @classmethod
+    def from_values(cls, values):
+        buffers = {}
+        for value in values:
+            buffer = buffers.get(value >> 16)
+            if buffer is None:
+                buffer = buffers[value >> 16] = bytearray(CONTAINER_BYTES)
+            low = value & 0xFFFF
+            buffer[low >> 3] |= 1 << (low & 7)
+        return cls({key: int.from_bytes(buffer, 'little') for key, buffer in buffers.items()})
+
+    def __and__(self, other):
+        containers = {}
+        for key in self.containers.keys() & other.containers.keys():
+            bits = self.containers[key] & other.containers[key]
+            if bits:
+                containers[key] = bits
+        return RoaringBitmap(containers)
+
+    def __or__(self, other):
+        containers = dict(self.containers)
+        for key, bits in other.containers.items():
+            containers[key] = containers.get(key, 0) | bits
+        return RoaringBitmap(containers)
+
+    def __len__(self):
+        return sum(bits.bit_count() for bits in self.containers.values())
+
+    def __bool__(self):
+        return bool(self.containers)
+
+    def __iter__(self):
+        for key in sorted(self.containers):
+            base = key << 16
+            for low in _set_bits(self.containers[key]):
+                yield base | low
+
+    def __eq__(self, other):
+        return isinstance(other, RoaringBitmap) and self.containers == other.containers
+
+    def serialize(self):
+        parts = [_HEADER.pack(_MAGIC, len(self.containers))]
+        for key in sorted(self.containers):
+            bits = self.containers[key]
+            cardinality = bits.bit_count()
+            if cardinality <= ARRAY_LIMIT:
+                payload = array('H', _set_bits(bits)).tobytes()
+                parts.append(_CONTAINER.pack(key, ARRAY_CONTAINER, cardinality))
+            else:
+                payload = bits.to_bytes(CONTAINER_BYTES, 'little')
+                parts.append(_CONTAINER.pack(key, BITMAP_CONTAINER, cardinality))
+            parts.append(payload)
+        return b''.join(parts)
+
+    @classmethod
+    def deserialize(cls, data):
+        data = bytes(data)
+        magic, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError('not a serialized RoaringBitmap')
+        offset = _HEADER.size
+        containers = {}
+        for _ in range(count):
+            key, kind, cardinality = _CONTAINER.unpack_from(data, offset)
+            offset += _CONTAINER.size
+            if kind == ARRAY_CONTAINER:
+                values = array('H')
+                values.frombytes(data[offset:offset + 2 * cardinality])
+                offset += 2 * cardinality
+                buffer = bytearray(CONTAINER_BYTES)
+                for low in values:
+                    buffer[low >> 3] |= 1 << (low & 7)
+                containers[key] = int.from_bytes(buffer, 'little')
+            else:
+                containers[key] = int.from_bytes(data[offset:offset + CONTAINER_BYTES], 'little')
+                offset += CONTAINER_BYTES
+        return cls(containers)
+
+
+def _set_bits(bits):
+    for index, byte in enumerate(bits.to_bytes(CONTAINER_BYTES, 'little')):
+        if byte:
+            base = index << 3
+            for bit in range(8):
+                if byte >> bit & 1:
+                    yield base | bit
@@ -0,0 +1,174 @@
+from collections import Counter
+from datetime import timedelta, timezone as dt_timezone
+from django.db import connection, transaction
+from events_service.utils.cold_storage import archived_days, cold_query, lock_archive
+from events_service.utils.event_layout import EVENT_TYPE_ID
+from events_service.utils.replicas import read_connection
+from events_service.utils.sketches import add_hours_to_sketches
+from events_service.utils.time_range import day_range, range_sql
+from events_service.utils.user_bitmaps import update_day_bitmaps
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+REFRESH_LOCK = 0x726F6C6C  # advisory lock held by the one refresh running at a time
+
+
+def refresh_dirty_hours(start=None, end=None):
+    """Rebuild hourly rollups, and the day bitmaps and sketches over them, for the hours in [start, end) that the events trigger marked dirty.
+
+    Runs in the beat and warm-up tasks, not in requests: the stats read the rollups as last rebuilt.
+    The stats day versions of the rebuilt days are bumped in the same transaction, so cached stats
+    are keyed by the rollups they were computed from. While another refresh runs this one returns 0
+    at once, leaving the hours to the next. Hours of archived days are rebuilt from both tiers:
+    the Postgres rows plus the Parquet parts.
+    """
+    where, params = range_sql('hour', start, end)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', [REFRESH_LOCK])
+        if not cursor.fetchone()[0]:
+            return 0
+        # Marks of transactions still in progress are not visible yet: they stay for the next refresh
+        cursor.execute(f'DELETE FROM rollup_dirty_hours WHERE {where} RETURNING hour', params)
+        hours = sorted({row[0] for row in cursor.fetchall()})
+        if not hours:
+            return 0
+        lock_archive(shared=True)  # rows must not move between the two tiers while they are read
+        cursor.execute('DELETE FROM rollup_hourly_users WHERE hour = ANY(%s) RETURNING hour, user_ids', [hours])
+        old_hour_users = dict(cursor.fetchall())
+        cursor.execute('DELETE FROM rollup_hourly_event_counts WHERE hour = ANY(%s)', [hours])
+        cursor.execute('DELETE FROM rollup_hourly_segments WHERE hour = ANY(%s)', [hours])
+        # One pass over the raw events fills the (country, event_type) segments of each hour; the
+        # per-hour users and event counts are folded from those. A country that is not a string
+        # has no typed column value and is read from the JSONB rest.
+        cursor.execute("""
+            INSERT INTO rollup_hourly_segments (hour, country, event_type, total, user_ids)
+            SELECT s.hour, s.country, t.name, s.total, s.user_ids
+            FROM (
+                SELECT h.hour, coalesce(e.country, e.properties ->> 'country', '') AS country, e.event_type_id,
+                       count(*) AS total, array_agg(DISTINCT e.user_id ORDER BY e.user_id) AS user_ids
+                FROM unnest(%s::timestamptz[]) AS h(hour)
+                JOIN events e ON e.occurred_at >= h.hour AND e.occurred_at < h.hour + interval '1 hour'
+                GROUP BY h.hour, 2, e.event_type_id
+            ) s
+            JOIN event_types t ON t.id = s.event_type_id
+        """, [hours])
+        _merge_cold_hours(cursor, hours)
+        cursor.execute("""
+            INSERT INTO rollup_hourly_users (hour, user_ids)
+            SELECT s.hour, array_agg(DISTINCT u.user_id ORDER BY u.user_id)
+            FROM rollup_hourly_segments s, unnest(s.user_ids) AS u(user_id)
+            WHERE s.hour = ANY(%s)
+            GROUP BY s.hour
+            RETURNING hour, user_ids
+        """, [hours])
+        new_hour_users = dict(cursor.fetchall())
+        cursor.execute("""
+            INSERT INTO rollup_hourly_event_counts (hour, event_type, total)
+            SELECT hour, event_type, sum(total) FROM rollup_hourly_segments
+            WHERE hour = ANY(%s)
+            GROUP BY hour, event_type
+        """, [hours])
+        update_day_bitmaps(old_hour_users, new_hour_users)
+        add_hours_to_sketches(cursor, hours)
+        cursor.execute("""
+            INSERT INTO stats_day_versions (day, version)
+            SELECT day, nextval('stats_day_versions_seq') FROM unnest(%s::date[]) AS d(day)
+            ON CONFLICT (day) DO UPDATE SET version = EXCLUDED.version
+        """, [sorted({hour.astimezone(dt_timezone.utc).date() for hour in hours})])
+    logger.info(f'Rollups rebuilt for {len(hours)} hours')
+    return len(hours)
+
+
+def _merge_cold_hours(cursor, hours):
+    days = {hour.astimezone(dt_timezone.utc).date() for hour in hours}
+    cold_days = archived_days(min(days), max(days)) & days
+    if not cold_days:
+        return
+    hours = set(hours)
+    segments = [row for row in cold_query(cold_days, """
+        SELECT date_trunc('hour', occurred_at) AS hour, coalesce(json_extract_string(properties, '$.country'), '') AS country,
+               event_type, count(*), list(DISTINCT user_id ORDER BY user_id)
+        FROM events GROUP BY hour, country, event_type
+    """) if row[0] in hours]
+    cursor.executemany("""
+        INSERT INTO rollup_hourly_segments (hour, country, event_type, total, user_ids) VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (hour, country, event_type) DO UPDATE SET
+            total = rollup_hourly_segments.total + EXCLUDED.total,
+            user_ids = ARRAY(SELECT DISTINCT u FROM unnest(rollup_hourly_segments.user_ids || EXCLUDED.user_ids) AS u ORDER BY u)
+    """, segments)
+
+
+def daily_active_users(start, end, tz):
+    """Distinct users per local day of `tz` for hours in [start, end)."""
+    where, params = range_sql('r.hour', start, end)
+    with read_connection().cursor() as cursor:
+        cursor.execute(f"""
+            SELECT (r.hour AT TIME ZONE %s)::date AS day, count(DISTINCT u.user_id) AS dau
+            FROM rollup_hourly_users r, unnest(r.user_ids) AS u(user_id)
+            WHERE {where}
+            GROUP BY day ORDER BY day
+        """, [str(tz)] + params)
+        return [{"day": day, "dau": dau} for day, dau in cursor.fetchall()]
+
+
+def rolling_active_users(start_day, end_day, window, event_type=None):
+    """Exact distinct users in the `window` UTC days ending on each day of [start_day, end_day]."""
+    first_day = start_day - timedelta(days=window - 1)
+    if event_type and archived_days(first_day, end_day):
+        return _rolling_active_users_tiered(first_day, start_day, end_day, window, event_type)
+    if event_type:
+        source = f"""JOIN events e ON e.event_type_id = {EVENT_TYPE_ID}
+                AND e.occurred_at >= (d - %s * interval '1 day') AT TIME ZONE 'UTC'
+                AND e.occurred_at < (d + interval '1 day') AT TIME ZONE 'UTC'"""
+        user_column = 'e.user_id'
+        params = [event_type, window - 1]
+    else:
+        source = """JOIN rollup_hourly_users r ON r.hour >= (d - %s * interval '1 day') AT TIME ZONE 'UTC'
+                AND r.hour < (d + interval '1 day') AT TIME ZONE 'UTC'
+            CROSS JOIN unnest(r.user_ids) AS u(user_id)"""
+        user_column = 'u.user_id'
+        params = [window - 1]
+    with read_connection().cursor() as cursor:
+        cursor.execute(f"""
+            SELECT d::date AS day, count(DISTINCT {user_column})
+            FROM generate_series(%s::timestamp, %s::timestamp, interval '1 day') AS d
+            {source}
+            GROUP BY d ORDER BY d
+        """, [start_day, end_day] + params)
+        counts = dict(cursor.fetchall())
+    days = [start_day + timedelta(days=i) for i in range((end_day - start_day).days + 1)]
+    return [{"day": day, "active_users": counts.get(day, 0)} for day in days]
+
+
+def _rolling_active_users_tiered(first_day, start_day, end_day, window, event_type):
+    # Per-day user sets from both tiers; a day can have rows in both after late events arrive
+    day_users = {}
+    with read_connection().cursor() as cursor:
+        cursor.execute(f"""
+            SELECT (occurred_at AT TIME ZONE 'UTC')::date AS day, array_agg(DISTINCT user_id)
+            FROM events WHERE event_type_id = {EVENT_TYPE_ID} AND occurred_at >= %s AND occurred_at < %s
+            GROUP BY day
+        """, [event_type, *day_range(first_day, end_day)])
+        for day, user_ids in cursor.fetchall():
+            day_users[day] = set(user_ids)
+    for day, user_ids in cold_query(archived_days(first_day, end_day), """
+        SELECT occurred_at::date AS day, list(DISTINCT user_id) FROM events WHERE event_type = ? GROUP BY day
+    """, [event_type]):
+        day_users.setdefault(day, set()).update(user_ids)
+
+    # Sliding window over the days: count how many window days each user is active on
+    active = Counter()
+    stats = []
+    days = [first_day + timedelta(days=i) for i in range((end_day - first_day).days + 1)]
+    for i, day in enumerate(days):
+        active.update(day_users.get(day, ()))
+        if i >= window:
+            for user_id in day_users.get(days[i - window], ()):
+                active[user_id] -= 1
+                if not active[user_id]:
+                    del active[user_id]
+        if day >= start_day:
+            stats.append({"day": day, "active_users": len(active)})
+    return stats
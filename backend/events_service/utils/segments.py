@@ -0,0 +1,216 @@
+import json
+from collections import Counter, defaultdict
+from datetime import timedelta, timezone as dt_timezone
+from django.db import connection
+from events_service.utils.cold_storage import archived_days, cold_query
+from events_service.utils.event_layout import EVENT_TYPE_ID, TYPED_PROPERTIES, event_type_name
+from events_service.utils.replicas import read_connection
+from events_service.utils.roaring import RoaringBitmap
+from events_service.utils.time_range import day_range, range_sql
+
+
+ROLLUP_PROPERTIES = frozenset({'country'})  # pre-segmented in rollup_hourly_segments, together with event_type
+
+
+class Segment:
+    """Equality filters on event_type and on event properties; an event must match all of them.
+
+    Segments on event_type and country are answered from rollup_hourly_segments. Other property
+    keys read raw events of both tiers: typed columns and the GIN index on Postgres, DuckDB over
+    the Parquet parts.
+    """
+
+    def __init__(self, event_type=None, properties=None):
+        self.event_type = event_type
+        self.properties = properties or {}
+
+    @classmethod
+    def from_query(cls, query):
+        """Parse `segment=<key>:<value>` (repeatable) and `properties.<key>=<value>` request parameters."""
+        filters = [value.partition(':')[::2] for value in query.getlist('segment')]
+        filters += [(key, value) for key in query if key.startswith('properties.') for value in query.getlist(key)]
+        segment = cls()
+        for key, value in filters:
+            key = key.removeprefix('properties.')
+            if not key or not value:
+                raise ValueError("segment filters must look like 'key:value' or 'properties.key=value'")
+            current = segment.event_type if key == 'event_type' else segment.properties.get(key)
+            if current is not None and current != value:
+                raise ValueError(f"conflicting segment filters on '{key}'")
+            if key == 'event_type':
+                segment.event_type = value
+            else:
+                segment.properties[key] = value
+        return segment
+
+    def __repr__(self):
+        return f'Segment(event_type={self.event_type!r}, properties={dict(sorted(self.properties.items()))!r})'
+
+    def __bool__(self):
+        return self.event_type is not None or bool(self.properties)
+
+    @property
+    def rollup_backed(self):
+        return set(self.properties) <= ROLLUP_PROPERTIES
+
+    def rollup_sql(self):
+        conditions, params = [], []
+        if self.event_type is not None:
+            conditions.append('s.event_type = %s')
+            params.append(self.event_type)
+        if 'country' in self.properties:
+            conditions.append('s.country = %s')
+            params.append(self.properties['country'])
+        return ' AND '.join(conditions) or 'TRUE', params
+
+    def events_sql(self):
+        conditions, params = [], []
+        if self.event_type is not None:
+            conditions.append(f'event_type_id = {EVENT_TYPE_ID}')
+            params.append(self.event_type)
+        for key, value in sorted(self.properties.items()):
+            # '42' matches both the number and the string. A candidate of its typed column's type
+            # compares the column, any other is in the JSONB rest: containment keeps the GIN index usable.
+            alternatives = []
+            for candidate in _json_values(value):
+                if _is_typed(key, candidate):
+                    alternatives.append(f'{connection.ops.quote_name(key)} = %s')
+                    params.append(candidate)
+                else:
+                    alternatives.append('properties @> %s::jsonb')
+                    params.append(json.dumps({key: candidate}))
+            conditions.append('(' + ' OR '.join(alternatives) + ')')
+        return ' AND '.join(conditions) or 'TRUE', params
+
+    def cold_sql(self):
+        conditions, params = [], []
+        if self.event_type is not None:
+            conditions.append('event_type = ?')
+            params.append(self.event_type)
+        for key, value in sorted(self.properties.items()):
+            conditions.append('json_extract_string(properties, ?) = ?')
+            params += ['$."' + key.replace('"', '\\"') + '"', value]
+        return ' AND '.join(conditions) or 'TRUE', params
+
+
+def _is_typed(key, value):
+    column_type = TYPED_PROPERTIES.get(key)
+    if column_type is float:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return column_type is not None and isinstance(value, column_type)
+
+
+def _json_values(value):
+    values = [value]
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        return values
+    if parsed is None or isinstance(parsed, (bool, int, float)):
+        values.append(parsed)
+    return values
+
+
+def _cold_days(start, end):
+    start_day = start.astimezone(dt_timezone.utc).date() if start is not None else None
+    end_day = (end - timedelta(microseconds=1)).astimezone(dt_timezone.utc).date() if end is not None else None
+    return archived_days(start_day, end_day)
+
+
+def _raw_day_users(start, end, tz, segment):
+    """{local day of `tz`: set of user_ids} of the segment's raw events in [start, end), from both tiers."""
+    day_users = defaultdict(set)
+    where, params = range_sql('occurred_at', start, end)
+    segment_where, segment_params = segment.events_sql()
+    with read_connection().cursor() as cursor:
+        cursor.execute(f"""
+            SELECT (occurred_at AT TIME ZONE %s)::date AS day, array_agg(DISTINCT user_id)
+            FROM events WHERE {where} AND {segment_where}
+            GROUP BY day
+        """, [str(tz)] + params + segment_params)
+        for day, user_ids in cursor.fetchall():
+            day_users[day].update(user_ids)
+    where, params = range_sql('occurred_at', start, end, placeholder='?')
+    segment_where, segment_params = segment.cold_sql()
+    for day, user_ids in cold_query(_cold_days(start, end), f"""
+        SELECT timezone(?, occurred_at)::date AS day, list(DISTINCT user_id)
+        FROM events WHERE {where} AND {segment_where}
+        GROUP BY day
+    """, [str(tz)] + params + segment_params):
+        day_users[day].update(user_ids)
+    return day_users
+
+
+def segment_daily_active_users(start, end, tz, segment):
+    """Distinct users of the segment per local day of `tz` for [start, end)."""
+    if not segment.rollup_backed:
+        day_users = _raw_day_users(start, end, tz, segment)
+        return [{"day": day, "dau": len(day_users[day])} for day in sorted(day_users)]
+    where, params = range_sql('s.hour', start, end)
+    segment_where, segment_params = segment.rollup_sql()
+    with read_connection().cursor() as cursor:
+        cursor.execute(f"""
+            SELECT (s.hour AT TIME ZONE %s)::date AS day, count(DISTINCT u.user_id) AS dau
+            FROM rollup_hourly_segments s, unnest(s.user_ids) AS u(user_id)
+            WHERE {where} AND {segment_where}
+            GROUP BY day ORDER BY day
+        """, [str(tz)] + params + segment_params)
+        return [{"day": day, "dau": dau} for day, dau in cursor.fetchall()]
+
+
+def daily_event_counts(start, end, tz, segment):
+    """{local day of `tz`: Counter of event_type} for [start, end); an empty segment counts every event."""
+    counts = defaultdict(Counter)
+    if segment.rollup_backed:
+        table = 'rollup_hourly_segments' if segment else 'rollup_hourly_event_counts'
+        where, params = range_sql('s.hour', start, end)
+        segment_where, segment_params = segment.rollup_sql()
+        with read_connection().cursor() as cursor:
+            cursor.execute(f"""
+                SELECT (s.hour AT TIME ZONE %s)::date AS day, s.event_type, sum(s.total) FROM {table} s
+                WHERE {where} AND {segment_where}
+                GROUP BY day, s.event_type
+            """, [str(tz)] + params + segment_params)
+            for day, event_type, count in cursor.fetchall():
+                counts[day][event_type] += count
+        return counts
+
+    where, params = range_sql('occurred_at', start, end)
+    segment_where, segment_params = segment.events_sql()
+    with read_connection().cursor() as cursor:
+        cursor.execute(f"""
+            SELECT (occurred_at AT TIME ZONE %s)::date AS day, event_type_id, count(*)
+            FROM events WHERE {where} AND {segment_where}
+            GROUP BY day, event_type_id
+        """, [str(tz)] + params + segment_params)
+        rows = [(day, event_type_name(type_id), count) for day, type_id, count in cursor.fetchall()]
+    where, params = range_sql('occurred_at', start, end, placeholder='?')
+    segment_where, segment_params = segment.cold_sql()
+    rows += cold_query(_cold_days(start, end), f"""
+        SELECT timezone(?, occurred_at)::date AS day, event_type, count(*)
+        FROM events WHERE {where} AND {segment_where}
+        GROUP BY day, event_type
+    """, [str(tz)] + params + segment_params)
+    for day, event_type, count in rows:
+        counts[day][event_type] += count
+    return counts
+
+
+def segment_day_bitmaps(start_day, end_day, segment):
+    """{UTC day: RoaringBitmap of the segment's active users} for [start_day, end_day], like load_day_bitmaps."""
+    start, end = day_range(start_day, end_day)
+    if segment.rollup_backed:
+        where, params = range_sql('s.hour', start, end)
+        segment_where, segment_params = segment.rollup_sql()
+        with read_connection().cursor() as cursor:
+            cursor.execute(f"""
+                SELECT (s.hour AT TIME ZONE 'UTC')::date AS day, array_agg(DISTINCT u.user_id)
+                FROM rollup_hourly_segments s, unnest(s.user_ids) AS u(user_id)
+                WHERE {where} AND {segment_where}
+                GROUP BY day
+            """, params + segment_params)
+            day_users = dict(cursor.fetchall())
+    else:
+        day_users = _raw_day_users(start, end, dt_timezone.utc, segment)
+    return {day: RoaringBitmap.from_values(user_id for user_id in user_ids if user_id >= 0)
+            for day, user_ids in day_users.items()}
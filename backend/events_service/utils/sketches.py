@@ -0,0 +1,124 @@
+from collections import defaultdict
+from itertools import chain
+from datetime import timedelta, timezone as dt_timezone
+from django.db import transaction
+from django.utils import timezone
+from events_service.models import DailyUserSketch, Event
+from events_service.utils.cold_storage import cold_query
+from events_service.utils.hyperloglog import HyperLogLog, REGISTERS, RELATIVE_ERROR
+from events_service.utils.time_range import day_range
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+ALL_EVENT_TYPES = ''
+
+
+def utc_day(occurred_at):
+    if timezone.is_naive(occurred_at):
+        return occurred_at.date()
+    return occurred_at.astimezone(dt_timezone.utc).date()
+
+
+def add_to_sketches(rows):
+    """Add user_ids of stored events to the per-day sketches (all types and per event_type)."""
+    groups = defaultdict(set)
+    for row in rows:
+        day = utc_day(row['occurred_at'])
+        groups[(day, ALL_EVENT_TYPES)].add(row['user_id'])
+        groups[(day, row['event_type'])].add(row['user_id'])
+    _merge_into_sketches(groups)
+
+
+def add_hours_to_sketches(cursor, hours):
+    """Add the users of freshly rebuilt rollup hours to the sketches of their UTC days.
+
+    Called by refresh_dirty_hours, so ingest transactions never lock or rewrite a sketch row: the
+    registers of a (day, event_type) are rewritten once per refresh. Users an hour already had are
+    no-ops for a HyperLogLog.
+    """
+    cursor.execute("""
+        SELECT (s.hour AT TIME ZONE 'UTC')::date, s.event_type, array_agg(DISTINCT u.user_id)
+        FROM rollup_hourly_segments s, unnest(s.user_ids) AS u(user_id)
+        WHERE s.hour = ANY(%s)
+        GROUP BY 1, 2
+    """, [hours])
+    groups = defaultdict(set)
+    for day, event_type, user_ids in cursor.fetchall():
+        groups[(day, ALL_EVENT_TYPES)].update(user_ids)
+        groups[(day, event_type)].update(user_ids)
+    _merge_into_sketches(groups)
+
+
+def _merge_into_sketches(groups):
+    with transaction.atomic():
+        for day, event_type in sorted(groups):  # fixed lock order between a refresh and rebuild_sketches
+            sketch, created = DailyUserSketch.objects.select_for_update().get_or_create(
+                day=day, event_type=event_type, defaults={'registers': bytes(REGISTERS)})
+            hll = HyperLogLog(sketch.registers)
+            if hll.update(groups[(day, event_type)]):
+                sketch.registers = bytes(hll)
+                sketch.save(update_fields=['registers'])
+
+
+def rebuild_sketches(start_day, end_day):
+    """Recompute sketches for [start_day, end_day] from raw events of both tiers, e.g. after a backfill."""
+    day = start_day
+    while day <= end_day:
+        with transaction.atomic():
+            DailyUserSketch.objects.filter(day=day).delete()
+            start, end = day_range(day, day)
+            rows = Event.objects.filter(occurred_at__gte=start, occurred_at__lt=end) \
+                .values('occurred_at', 'user_id', 'event_type').distinct('user_id', 'event_type').order_by()
+            cold_rows = ({'occurred_at': occurred_at, 'user_id': user_id, 'event_type': event_type}
+                         for occurred_at, user_id, event_type in cold_query([day], """
+                             SELECT min(occurred_at), user_id, event_type FROM events GROUP BY user_id, event_type
+                         """))
+            add_to_sketches(chain(rows.iterator(chunk_size=10000), cold_rows))
+        logger.info(f'Sketches rebuilt for {day}')
+        day += timedelta(days=1)
+
+
+def load_sketches(start_day, end_day, event_type=ALL_EVENT_TYPES):
+    query = DailyUserSketch.objects.filter(day__gte=start_day, day__lte=end_day, event_type=event_type)
+    return {sketch.day: HyperLogLog(sketch.registers) for sketch in query}
+
+
+def daily_unique_users(start_day, end_day, event_type=ALL_EVENT_TYPES):
+    sketches = load_sketches(start_day, end_day, event_type)
+    return [{"day": day, "dau": sketches[day].count(), "relative_error": RELATIVE_ERROR} for day in sorted(sketches)]
+
+
+def unique_users(start_day, end_day, event_type=ALL_EVENT_TYPES):
+    merged = HyperLogLog()
+    for sketch in load_sketches(start_day, end_day, event_type).values():
+        merged.merge(sketch)
+    return merged.count()
+
+
+def rolling_unique_users(start_day, end_day, window, event_type=ALL_EVENT_TYPES):
+    """Unique users in the `window` days ending on each day of [start_day, end_day].
+
+    Uses block prefix/suffix merges (van Herk/Gil-Werman), so each day costs at most three merges
+    whatever the window length.
+    """
+    first_day = start_day - timedelta(days=window - 1)
+    sketches = load_sketches(first_day, end_day, event_type)
+    days = [first_day + timedelta(days=i) for i in range((end_day - first_day).days + 1)]
+    prefix = []
+    for i, day in enumerate(days):
+        current = HyperLogLog(sketches[day].registers) if day in sketches else HyperLogLog()
+        prefix.append(current.merge(prefix[i - 1]) if i % window else current)
+    suffix = [None] * len(days)
+    for i in reversed(range(len(days))):
+        current = HyperLogLog(sketches[days[i]].registers) if days[i] in sketches else HyperLogLog()
+        block_end = i % window == window - 1 or i == len(days) - 1
+        suffix[i] = current if block_end else current.merge(suffix[i + 1])
+
+    stats = []
+    for i in range(window - 1, len(days)):
+        j = i - window + 1
+        merged = prefix[i] if j % window == 0 else HyperLogLog(suffix[j].registers).merge(prefix[i])
+        stats.append({"day": days[i], "active_users": merged.count()})
+    return stats
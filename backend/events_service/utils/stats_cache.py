@@ -0,0 +1,141 @@
+from collections import Counter
+from datetime import timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import caches
+from events_service.utils.funnels import funnel
+from events_service.utils.lru import MISSING, LRUCache
+from events_service.utils.replicas import read_connection
+from events_service.utils.retention import retention_matrix
+from events_service.utils.rollups import daily_active_users
+from events_service.utils.segments import Segment, daily_event_counts, segment_daily_active_users
+from events_service.utils.time_range import day_range
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'stats:v1'
+local_cache = LRUCache(settings.STATS_CACHE_MAX_ENTRIES, settings.STATS_CACHE_MAX_BYTES)
+
+
+def _shared_cache():
+    return caches[settings.STATS_CACHE_ALIAS] if settings.STATS_CACHE_ALIAS else None
+
+
+def day_versions(start_day, end_day):
+    """{UTC day: version} for [start_day, end_day]; the rollup refresh bumps a day when it rebuilds its hours."""
+    with read_connection().cursor() as cursor:
+        cursor.execute('SELECT day, version FROM stats_day_versions WHERE day >= %s AND day <= %s', [start_day, end_day])
+        return dict(cursor.fetchall())
+
+
+def utc_span(day, tz):
+    """First and last UTC day that the local `day` of `tz` overlaps."""
+    start, end = day_range(day, day, tz)
+    return start.astimezone(dt_timezone.utc).date(), (end - timedelta(microseconds=1)).astimezone(dt_timezone.utc).date()
+
+
+def cached_days(endpoint, filters, days, compute, span):
+    """{day: value} for `days`, computing only the days that are not cached yet.
+
+    A key holds the versions of every UTC day the entry depends on (`span(day)`), so a refresh of any
+    of them makes the old entry unreachable; it then ages out of the LRU. Versions are read before
+    computing, so a refresh that races with the computation leaves the entry under an already stale key.
+    `compute(days)` returns {day: value} for the missing days, None for days without data.
+    """
+    spans = {day: span(day) for day in days}
+    versions = day_versions(min(first for first, _ in spans.values()), max(last for _, last in spans.values()))
+    keys = {}
+    for day, (first, last) in spans.items():
+        day_versions_key = ','.join(str(versions.get(first + timedelta(days=i), 0)) for i in range((last - first).days + 1))
+        keys[day] = f'{KEY_PREFIX}:{endpoint}:{filters}:{day.isoformat()}:{day_versions_key}'
+
+    values = {}
+    for day, key in keys.items():
+        value = local_cache.get(key)
+        if value is not MISSING:
+            values[day] = value
+    shared = _shared_cache()
+    missing = [day for day in days if day not in values]
+    if shared is not None and missing:
+        found = shared.get_many([keys[day] for day in missing])
+        for day in missing:
+            if keys[day] in found:
+                values[day] = found[keys[day]]
+                local_cache.set(keys[day], values[day])
+        missing = [day for day in missing if day not in values]
+    if missing:
+        computed = compute(missing)
+        for day in missing:
+            values[day] = computed.get(day)
+            local_cache.set(keys[day], values[day])
+        if shared is not None:
+            shared.set_many({keys[day]: values[day] for day in missing}, settings.STATS_CACHE_TIMEOUT)
+        logger.debug(f'Stats cache {endpoint}: {len(days) - len(missing)} hits, {len(missing)} misses')
+    return values
+
+
+def _days(date_from, date_to):
+    return [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+
+
+def cached_daily_active_users(date_from, date_to, tz, segment=None):
+    """daily_active_users / segment_daily_active_users for the local days [date_from, date_to], per day from the cache."""
+    segment = segment or Segment()
+
+    def compute(days):
+        start, end = day_range(min(days), max(days), tz)
+        stats = segment_daily_active_users(start, end, tz, segment) if segment else daily_active_users(start, end, tz)
+        return {row['day']: row['dau'] for row in stats}
+
+    values = cached_days('dau', f'{tz}:{segment!r}', _days(date_from, date_to), compute, lambda day: utc_span(day, tz))
+    return [{"day": day, "dau": dau} for day, dau in sorted(values.items()) if dau is not None]
+
+
+def cached_top_events(date_from, date_to, tz, limit, segment=None):
+    """The `limit` most frequent event types of the local days [date_from, date_to], summed from cached per-day counts."""
+    segment = segment or Segment()
+
+    def compute(days):
+        return {day: dict(counts) for day, counts in daily_event_counts(*day_range(min(days), max(days), tz), tz, segment).items()}
+
+    values = cached_days('top-events', f'{tz}:{segment!r}', _days(date_from, date_to), compute, lambda day: utc_span(day, tz))
+    totals = Counter()
+    for counts in values.values():
+        totals.update(counts or {})
+    ranked = sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:limit]
+    return [{"event_type": event_type, "count": count} for event_type, count in ranked]
+
+
+def cached_retention(cohort_days, windows, period_days, segment=None):
+    """retention_matrix with one cache entry per cohort, keyed by the versions of every UTC day it reads."""
+    last_offset = timedelta(days=windows * period_days - 1)
+
+    def compute(days):
+        return {cohort_day: (cohort_size, counts)
+                for cohort_day, cohort_size, counts in retention_matrix(days, windows, period_days, segment)}
+
+    values = cached_days('retention', f'{windows}x{period_days}:{segment or Segment()!r}', cohort_days, compute,
+                         lambda day: (day, day + last_offset))
+    return [(cohort_day, *values[cohort_day]) for cohort_day in cohort_days]
+
+
+def cached_funnel(date_from, date_to, tz, steps, window):
+    """funnel over the local days [date_from, date_to], as one cache entry keyed by every UTC day it reads."""
+    start, end = day_range(date_from, date_to, tz)
+    span = (start.astimezone(dt_timezone.utc).date(), (end + window - timedelta(microseconds=1)).astimezone(dt_timezone.utc).date())
+
+    def compute(days):
+        return {date_from: funnel(steps, start, end, window)}
+
+    values = cached_days('funnel', f'{tz}:{",".join(steps)}:{window.total_seconds():g}:{date_to}', [date_from], compute,
+                         lambda day: span)
+    return values[date_from]
+
+
+def warm(days):
+    """Fill the cache with the unsegmented UTC DAU and top-events of `days`, the ranges dashboards ask for."""
+    if not days:
+        return
+    cached_daily_active_users(min(days), max(days), dt_timezone.utc)
+    cached_top_events(min(days), max(days), dt_timezone.utc, 1)
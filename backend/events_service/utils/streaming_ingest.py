@@ -0,0 +1,123 @@
+import gzip
+import hashlib
+import json
+from django.conf import settings
+from events_service.serializers import get_batch_validator
+from rest_framework.parsers import JSONParser
+
+
+NDJSON_CONTENT_TYPES = frozenset({'application/x-ndjson', 'application/ndjson', 'application/jsonl'})
+READ_SIZE = 64 * 1024
+
+
+class HashingReader:
+    """File-like view of the raw request body that feeds every byte read into a sha256, for Idempotency-Key fingerprints."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.digest.update(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self.stream.readline(size)
+        self.digest.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+    def drain(self):
+        while self.read(READ_SIZE):
+            pass
+        return self.hexdigest()
+
+
+class FingerprintingJSONParser(JSONParser):
+    """JSONParser that fingerprints the raw body while parsing it, into request.body_fingerprint.
+
+    Idempotency-Key checks need the sha256 of a JSON batch; hashing request.body would load the
+    body a second time and apply DATA_UPLOAD_MAX_MEMORY_SIZE, which the parsed stream does not.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        reader = HashingReader(stream)
+        try:
+            return super().parse(reader, media_type, parser_context)
+        finally:
+            parser_context['request'].body_fingerprint = reader.hexdigest()
+
+
+def is_ndjson(content_type):
+    return content_type.split(';')[0].strip().lower() in NDJSON_CONTENT_TYPES
+
+
+def decoded(reader, content_encoding):
+    """The body stream with Content-Encoding undone on the fly; ValueError for encodings other than gzip/identity."""
+    content_encoding = (content_encoding or 'identity').strip().lower()
+    if content_encoding == 'gzip':
+        return gzip.GzipFile(fileobj=reader, mode='rb')
+    if content_encoding != 'identity':
+        raise ValueError(f"unsupported Content-Encoding '{content_encoding}'")
+    return reader
+
+
+def ndjson_lines(stream, max_line_bytes):
+    """Non-blank lines of the stream, or None in place of a line longer than `max_line_bytes`, which is skipped unread."""
+    while True:
+        line = stream.readline(max_line_bytes + 1)
+        if not line:
+            return
+        if len(line) > max_line_bytes and not line.endswith(b'\n'):
+            while (rest := stream.readline(READ_SIZE)) and not rest.endswith(b'\n'):
+                pass
+            yield None
+        elif line.strip():
+            yield line
+
+
+def stream_events(stream, publish, charge):
+    """Validate NDJSON events as they are read and publish(chunk) every INGEST_STREAM_CHUNK_SIZE valid ones.
+
+    Memory holds one chunk and at most INGEST_MAX_REPORTED_ERRORS errors, whatever the body size.
+    `charge(count, first)` takes rate-limit tokens for each chunk before it is published; when it
+    refuses, reading stops. Returns (events read, queued, rejected, errors, rate limited).
+    """
+    validator = get_batch_validator()
+    chunk_size, max_errors = settings.INGEST_STREAM_CHUNK_SIZE, settings.INGEST_MAX_REPORTED_ERRORS
+    chunk, errors = [], []
+    read = queued = rejected = 0
+
+    def flush():
+        nonlocal queued
+        if not charge(len(chunk), queued == 0):
+            return False
+        publish(chunk)
+        queued += len(chunk)
+        return True
+
+    for index, line in enumerate(ndjson_lines(stream, settings.INGEST_MAX_LINE_BYTES)):
+        read += 1
+        if line is None:
+            validated, item_errors = None, {"non_field_errors": [f"Line longer than {settings.INGEST_MAX_LINE_BYTES} bytes"]}
+        else:
+            try:
+                validated, item_errors = validator.validate_item(json.loads(line))
+            except ValueError:
+                validated, item_errors = None, {"non_field_errors": ["Invalid JSON"]}
+        if item_errors:
+            rejected += 1
+            if len(errors) < max_errors:
+                errors.append({"index": index, "errors": item_errors})
+            continue
+        chunk.append(validated)
+        if len(chunk) >= chunk_size:
+            if not flush():
+                return read, queued, rejected, errors, True
+            chunk = []
+    if chunk and not flush():
+        return read, queued, rejected, errors, True
+    return read, queued, rejected, errors, False
@@ -0,0 +1,130 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone as dt_timezone
+from logging.handlers import QueueListener
+from events_service.utils.metrics import counter
+
+
+request_id = ContextVar('request_id', default=None)
+
+LOG_RECORDS_DROPPED = counter('log_records_dropped_total', 'Log records dropped because the log queue was full')
+
+# Attributes every LogRecord has: anything else on a record came in through `extra` and goes into the JSON
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the request ID of the current request or Celery task."""
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps `rate` of the records below WARNING; warnings and errors always pass.
+
+    The decision follows the request ID, so a sampled request keeps all its lines and the others
+    lose all of theirs, rather than every request losing a random subset.
+    """
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        if self.rate >= 1 or record.levelno >= logging.WARNING:
+            return True
+        current = getattr(record, 'request_id', None) or request_id.get()
+        if current:
+            return zlib.crc32(current.encode()) < self.rate * 0x100000000
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, message, request_id, `extra` fields and the traceback if any."""
+
+    def format(self, record):
+        entry = {"ts": datetime.fromtimestamp(record.created, dt_timezone.utc).isoformat(timespec='milliseconds'),
+                 "level": record.levelname, "logger": record.name, "message": record.getMessage(),
+                 "request_id": getattr(record, 'request_id', None)}
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class BackgroundHandler(logging.Handler):
+    """Hands records to a thread that formats and writes them to a stream and/or a file.
+
+    The logging thread only puts the record on a bounded queue. When the writer falls behind and
+    the queue is full, records below WARNING are dropped (and counted in log_records_dropped_total);
+    warnings and errors wait for room instead. `output` is 'json' or 'text'.
+
+    A plain Handler owning its queue, not a QueueHandler: from Python 3.12 dictConfig builds the
+    queue of QueueHandler subclasses itself and passes it as the first argument.
+    """
+
+    def __init__(self, filename=None, stream=None, max_queue=10000, output='json'):
+        super().__init__()
+        self.max_queue = max_queue
+        self.queue = queue.Queue(max_queue)
+        targets = []
+        if stream is not None:
+            targets.append(logging.StreamHandler(stream))
+        if filename:
+            targets.append(logging.FileHandler(filename))
+        target_formatter = JsonFormatter() if output == 'json' else logging.Formatter(
+            '[{asctime}] {levelname} {name} [{request_id}]: {message}', style='{')
+        for target in targets:
+            target.setFormatter(target_formatter)
+        self.targets = targets
+        self.listener = None
+        self.start()
+        atexit.register(self.close)
+        # The writer thread does not survive a fork (Celery prefork children): give the child its own
+        os.register_at_fork(after_in_child=self.start)
+
+    def start(self):
+        if self.listener is not None:
+            self.queue = queue.Queue(self.max_queue)
+        self.listener = QueueListener(self.queue, *self.targets, respect_handler_level=True)
+        self.listener.start()
+
+    def emit(self, record):
+        try:
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record):
+        # Merge args into the message here, the objects they refer to may change before the writer runs;
+        # JSON formatting and the writes happen on the writer thread
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put(record, block=record.levelno >= logging.WARNING)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()  # drains the queue
+            self.listener = None
+            for target in self.targets:
+                target.close()
+        super().close()
@@ -0,0 +1,29 @@
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+
+def day_start(day, tz=dt_timezone.utc):
+    return datetime.combine(day, time.min, tzinfo=tz)
+
+
+def day_range(date_from, date_to, tz=dt_timezone.utc):
+    """Turns inclusive local dates into an aware [start, end) range; either bound may be None.
+
+    Stats filter timestamp columns with these bounds instead of casting them to dates, so the
+    predicates stay sargable for the btree/BRIN indexes and for partition pruning.
+    """
+    start = day_start(date_from, tz) if date_from else None
+    end = day_start(date_to + timedelta(days=1), tz) if date_to else None
+    return start, end
+
+
+def range_sql(column, start, end, placeholder='%s'):
+    """(`column` >= start AND `column` < end, params) for the bounds that are set; DuckDB uses '?' placeholders."""
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append(f'{column} >= {placeholder}')
+        params.append(start)
+    if end is not None:
+        conditions.append(f'{column} < {placeholder}')
+        params.append(end)
+    return ' AND '.join(conditions) or 'TRUE', params
@@ -1,24 +1,125 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
 import time
+from collections import OrderedDict
 from threading import Lock
 
 
+def refill(tokens, timestamp, now, rate, capacity):
+    return min(capacity, tokens + (now - timestamp) * rate)
+
+
 class TokenBucket:
     def __init__(self, rate, capacity):
         self.rate = rate
         self.capacity = capacity
         self.tokens = capacity
-        self.timestamp = time.time()
+        self.timestamp = time.monotonic()
         self.lock = Lock()
 
     def consume(self, tokens=1):
         with self.lock:
-            now = time.time()
-            elapsed = now - self.timestamp
+            now = time.monotonic()
+            self.tokens = refill(self.tokens, self.timestamp, now, self.rate, self.capacity)
             self.timestamp = now
-            self.tokens += elapsed * self.rate
-            if self.tokens > self.capacity:
-                self.tokens = self.capacity
             if self.tokens >= tokens:
                 self.tokens -= tokens
                 return True
             return False
+
+    def idle(self, now):
+        """A bucket untouched for capacity / rate seconds is full again, so forgetting it changes nothing."""
+        return (now - self.timestamp) * self.rate >= self.capacity
+
+
+class LocalBucketStore:
+    """Token buckets of one process, at most `max_buckets` of them; idle buckets go first, then the least recently used."""
+
+    def __init__(self, max_buckets):
+        self.max_buckets = max_buckets
+        self.buckets = OrderedDict()
+        self.lock = Lock()
+
+    def consume(self, key, rate, capacity, tokens=1):
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None or (bucket.rate, bucket.capacity) != (rate, capacity):
+                bucket = self.buckets[key] = TokenBucket(rate, capacity)
+            self.buckets.move_to_end(key)
+            self._evict(time.monotonic())
+        return bucket.consume(tokens)
+
+    def _evict(self, now):
+        # The front is the least recently used bucket: once it is not idle, none of the others are
+        while self.buckets and (len(self.buckets) > self.max_buckets or next(iter(self.buckets.values())).idle(now)):
+            self.buckets.popitem(last=False)
+
+    def __len__(self):
+        return len(self.buckets)
+
+
+class SharedBucketStore:
+    """Token buckets shared by every process on the host, in a fixed-size memory-mapped table.
+
+    Each slot holds (key hash, tokens, timestamp); a key lives in one of PROBE slots after its hash.
+    A missing key takes an empty slot there, or else the least recently used one: an idle bucket is
+    full anyway, evicting a busy one hands that client a full bucket. The table is locked with flock
+    (plus a thread lock, flock does not exclude threads sharing the descriptor) for the few
+    microseconds an update takes; CLOCK_MONOTONIC is system-wide, so timestamps compare across processes.
+    """
+    SLOT = struct.Struct('<Qdd')
+    PROBE = 8
+
+    def __init__(self, path, max_buckets):
+        self.slots = max(max_buckets, self.PROBE)
+        size = self.slots * self.SLOT.size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self.lock = Lock()
+        with self._locked():
+            if os.fstat(self.fd).st_size < size:
+                os.ftruncate(self.fd, size)  # new slots are zeroed, i.e. empty
+        self.table = mmap.mmap(self.fd, size)
+
+    def _locked(self):
+        return _FileLock(self.fd, self.lock)
+
+    def consume(self, key, rate, capacity, tokens=1):
+        key_hash = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') | 1
+        first = key_hash % self.slots
+        with self._locked():
+            now = time.monotonic()
+            victim = victim_timestamp = None
+            for probe in range(self.PROBE):
+                offset = (first + probe) % self.slots * self.SLOT.size
+                slot_hash, slot_tokens, slot_timestamp = self.SLOT.unpack_from(self.table, offset)
+                if slot_hash == key_hash:
+                    victim, available = offset, refill(slot_tokens, slot_timestamp, now, rate, capacity)
+                    break
+                if victim is None or slot_hash == 0 or slot_timestamp < victim_timestamp:
+                    victim, victim_timestamp = offset, (float('-inf') if slot_hash == 0 else slot_timestamp)
+            else:
+                available = capacity
+            allowed = available >= tokens
+            self.SLOT.pack_into(self.table, victim, key_hash, available - tokens if allowed else available, now)
+        return allowed
+
+    def close(self):
+        self.table.close()
+        os.close(self.fd)
+
+
+class _FileLock:
+    def __init__(self, fd, lock):
+        self.fd = fd
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.lock.release()
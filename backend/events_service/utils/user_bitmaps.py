@@ -0,0 +1,52 @@
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+from events_service.models import DailyUserBitmap, HourlyActiveUsers
+from events_service.utils.roaring import RoaringBitmap
+from events_service.utils.time_range import day_range
+
+
+def rebuild_day_bitmaps(days):
+    """Rebuild the persisted bitmaps of active user_ids for the given UTC days from the hourly rollups."""
+    for day in days:
+        start, end = day_range(day, day)
+        hours = HourlyActiveUsers.objects.filter(hour__gte=start, hour__lt=end)
+        # The bitmap holds non-negative 32-bit ids; the API only accepts user_id >= 1
+        bitmap = RoaringBitmap.from_values(user_id for user_ids in hours.values_list('user_ids', flat=True)
+                                           for user_id in user_ids if user_id >= 0)
+        if bitmap:
+            DailyUserBitmap.objects.update_or_create(day=day, defaults={'bitmap': bitmap.serialize(), 'cardinality': len(bitmap)})
+        else:
+            DailyUserBitmap.objects.filter(day=day).delete()
+
+
+def update_day_bitmaps(old_hours, new_hours):
+    """Bring the day bitmaps up to date after the rollups of some hours were rebuilt.
+
+    `old_hours` and `new_hours` are {hour: user_ids} of those hours before and after. The users an
+    hour gained are OR-ed into the stored bitmap of its day, so only the changed hours are read. A
+    day is rebuilt from all its hours when one of them lost a user (a deleted or moved event: the
+    user may be gone from the whole day) or when it has no bitmap yet.
+    """
+    gained = defaultdict(set)
+    rebuild = set()
+    for hour in old_hours.keys() | new_hours.keys():
+        day = hour.astimezone(dt_timezone.utc).date()
+        before, after = set(old_hours.get(hour, ())), set(new_hours.get(hour, ()))
+        if before - after:
+            rebuild.add(day)
+        gained[day] |= after - before
+    stored = {row.day: row for row in DailyUserBitmap.objects.filter(day__in=[day for day in gained if day not in rebuild])}
+    rebuild.update(day for day, user_ids in gained.items() if user_ids and day not in stored)
+    rebuild_day_bitmaps(sorted(rebuild))
+    for day, user_ids in sorted(gained.items()):
+        if day in rebuild or not user_ids:
+            continue
+        bitmap = RoaringBitmap.deserialize(stored[day].bitmap) | RoaringBitmap.from_values(
+            user_id for user_id in user_ids if user_id >= 0)
+        stored[day].bitmap, stored[day].cardinality = bitmap.serialize(), len(bitmap)
+        stored[day].save(update_fields=['bitmap', 'cardinality'])
+
+
+def load_day_bitmaps(start_day, end_day):
+    query = DailyUserBitmap.objects.filter(day__gte=start_day, day__lte=end_day)
+    return {row.day: RoaringBitmap.deserialize(row.bitmap) for row in query}
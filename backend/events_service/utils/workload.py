@@ -0,0 +1,147 @@
+import bisect
+import csv
+import itertools
+import json
+import math
+import random
+import uuid
+from datetime import timedelta, timezone as dt_timezone
+
+
+# Relative traffic per UTC hour and per weekday (Monday first): quiet nights, evening peak, busier weekends
+HOURLY_PROFILE = (0.25, 0.15, 0.1, 0.08, 0.08, 0.12, 0.3, 0.55, 0.75, 0.85, 0.9, 0.95,
+                  1.0, 0.95, 0.9, 0.9, 0.95, 1.05, 1.25, 1.4, 1.45, 1.3, 0.9, 0.5)
+WEEKLY_PROFILE = (0.95, 0.95, 1.0, 1.0, 1.05, 1.2, 1.15)
+COUNTRIES = ('PL', 'UA', 'GB', 'DE', 'IT', 'RO', 'SE', 'NL', 'KZ', 'US')
+COUNTRY_WEIGHTS = (22, 18, 12, 11, 8, 8, 6, 6, 5, 4)
+CSV_HEADER = ('event_id', 'occurred_at', 'user_id', 'event_type', 'properties_json')
+
+
+class Workload:
+    """Deterministic stream of synthetic events: the same arguments always produce the same events, in time order.
+
+    Events come in sessions: app_open, sometimes a login, item views of which some are added to
+    the cart and then purchased, messages, sometimes a logout. With the default probabilities the
+    event types mix like data/events_sample.csv (app_open 30%, view_item 25%, message_sent 18%,
+    add_to_cart 12%, login 6%, purchase 5%, logout 4%). Session owners are Zipf-distributed over
+    `users` ids (user 1 is the most active), session starts follow HOURLY_PROFILE x WEEKLY_PROFILE.
+    Properties have the sample CSV's shapes; a session shares its session_id and its user's country.
+    """
+
+    def __init__(self, events, start, end, users=None, zipf=1.1, seed=0):
+        self.events = events
+        self.start = start.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+        self.end = end.astimezone(dt_timezone.utc)
+        self.users = users or max(events // 40, 1)
+        self.seed = seed
+        # Inverse-CDF sampling of the Zipf ranks: one bisect per session
+        self.user_weights = list(itertools.accumulate(1 / rank ** zipf for rank in range(1, self.users + 1)))
+
+    def __iter__(self):
+        rng = random.Random(self.seed)
+        hours = []
+        hour = self.start
+        while hour < self.end:
+            hours.append((hour, HOURLY_PROFILE[hour.hour] * WEEKLY_PROFILE[hour.weekday()]))
+            hour += timedelta(hours=1)
+        total_weight = sum(weight for _, weight in hours)
+        # ~3.3 events per session on average; a few percent more so that the range is rarely left short
+        sessions_left = self.events / 3.2
+        emitted = 0
+        occurred_at = self.start
+        carry = []  # sessions run past the end of the hour they started in
+        for index, (hour, weight) in enumerate(hours):
+            expected = sessions_left * weight / total_weight
+            sessions = int(expected) + (rng.random() < expected - int(expected))
+            pending = carry
+            for _ in range(sessions):
+                pending.extend(self.session(rng, hour + timedelta(seconds=rng.random() * 3600)))
+            last_hour = index == len(hours) - 1
+            pending.sort(key=lambda event: event['occurred_at'])
+            boundary = hour + timedelta(hours=1)
+            cut = len(pending) if last_hour else bisect.bisect_left([event['occurred_at'] for event in pending], boundary)
+            for event in pending[:cut]:
+                if emitted == self.events:
+                    return
+                yield event
+                emitted += 1
+                occurred_at = event['occurred_at']
+            carry = pending[cut:]
+        # Fewer sessions than expected by chance: top up with back-to-back sessions after the last event
+        while emitted < self.events:
+            for event in self.session(rng, occurred_at + timedelta(seconds=rng.expovariate(1 / 60))):
+                if emitted == self.events:
+                    return
+                yield event
+                emitted += 1
+                occurred_at = event['occurred_at']
+
+    def session(self, rng, started_at):
+        user_id = bisect.bisect_left(self.user_weights, rng.random() * self.user_weights[-1]) + 1
+        country = COUNTRIES[_user_country(self.seed, user_id)]
+        session_id = f'{rng.getrandbits(32):08x}'
+        occurred_at = started_at
+        events = []
+
+        def add(event_type, **properties):
+            nonlocal occurred_at
+            events.append({"event_id": uuid.UUID(int=rng.getrandbits(128), version=4), "occurred_at": occurred_at,
+                           "user_id": user_id, "event_type": event_type,
+                           "properties": {"country": country, "session_id": session_id, **properties}})
+            occurred_at += timedelta(seconds=rng.expovariate(1 / 40))
+
+        add('app_open', app_version=f'1.{rng.randint(0, 9)}.{rng.randint(0, 9)}', os=rng.choice(('iOS', 'Android')))
+        if rng.random() < 0.2:
+            add('login', method=rng.choice(('password', 'google', 'apple')))
+        cart = []
+        for _ in range(_geometric(rng, 0.83)):
+            item_id, price = f'SKU{rng.randint(1000, 9999)}', round(rng.lognormvariate(4, 0.6), 2)
+            add('view_item', item_id=item_id, price=price, currency='USD')
+            if rng.random() < 0.48:
+                qty = rng.choices((1, 2, 3), (70, 20, 10))[0]
+                add('add_to_cart', item_id=item_id, qty=qty)
+                cart.append(price * qty)
+        if cart and rng.random() < 0.55:
+            add('purchase', order_id=f'O{rng.getrandbits(32):08x}', amount=round(sum(cart), 2), currency='USD',
+                items=len(cart), payment_method=rng.choice(('card', 'paypal', 'apple_pay')))
+        for _ in range(_geometric(rng, 0.6)):
+            add('message_sent', channel=rng.choice(('chat', 'email', 'push')), length=int(rng.lognormvariate(3.5, 1)) + 1)
+        if rng.random() < 0.13:
+            add('logout', method=rng.choice(('password', 'google', 'apple')))
+        return events
+
+
+def _geometric(rng, mean):
+    """Count with the given mean, 0 included (geometric distribution)."""
+    return int(math.log(1 - rng.random()) / math.log(mean / (1 + mean))) if mean else 0
+
+
+def _user_country(seed, user_id):
+    # Stable per user, independent of the order users are drawn in
+    return random.Random(seed * 1_000_003 + user_id).choices(range(len(COUNTRIES)), COUNTRY_WEIGHTS)[0]
+
+
+def serialize(event):
+    """The POST /api/events JSON shape of a generated event."""
+    return dict(event, event_id=str(event['event_id']), occurred_at=event['occurred_at'].isoformat())
+
+
+def write_csv(file, events):
+    """The import_events CSV layout; returns the number of rows."""
+    writer = csv.writer(file)
+    writer.writerow(CSV_HEADER)
+    count = 0
+    for event in events:
+        writer.writerow([event['event_id'], event['occurred_at'].isoformat(), event['user_id'], event['event_type'],
+                         json.dumps(event['properties'], separators=(',', ':'))])
+        count += 1
+    return count
+
+
+def write_ndjson(file, events):
+    count = 0
+    for event in events:
+        file.write(json.dumps(serialize(event), separators=(',', ':')) + '\n')
+        count += 1
+    return count
+
@@ -0,0 +1,83 @@
+import threading
+import time
+
+
+class _Batch:
+    def __init__(self):
+        self.parts = []  # the items of each submission
+        self.size = 0
+        self.closed = False
+        self.done = threading.Event()
+        self.outcomes = []  # (result, error) of each submission
+
+
+class WriteBehindBuffer:
+    """Coalesces the items submitted by concurrent threads into one flush(items) call.
+
+    The first submitter of a batch leads it: it waits until the batch holds `max_items` items or
+    `max_delay` seconds have passed, then flushes it. Every submitter blocks until that flush
+    returns and gets its result (or exception), so a Celery task built on submit() returns, and with
+    acks_late is acknowledged, only once its items are committed. A max_delay of 0 flushes each
+    submission on its own.
+
+    When the coalesced flush fails with an error that is not one of `transient_errors`, each
+    submission is flushed again on its own: only the ones that fail alone get the exception, the
+    others their own result. Transient errors (the database is away) go to every submitter at once.
+    """
+
+    def __init__(self, flush, max_items, max_delay, transient_errors=()):
+        self.flush = flush
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self.transient_errors = transient_errors
+        self.lock = threading.Lock()
+        self.full = threading.Condition(self.lock)
+        self.batch = None
+
+    def submit(self, items):
+        with self.lock:
+            leader = self.batch is None
+            if leader:
+                self.batch = _Batch()
+            batch = self.batch
+            part = len(batch.parts)
+            batch.parts.append(list(items))
+            batch.size += len(items)
+            if batch.size >= self.max_items:
+                self._close(batch)
+        if leader:
+            self._lead(batch)
+        else:
+            batch.done.wait()
+        result, error = batch.outcomes[part]
+        if error is not None:
+            raise error
+        return result
+
+    def _close(self, batch):
+        if self.batch is batch:
+            self.batch = None
+        batch.closed = True
+        self.full.notify_all()
+
+    def _lead(self, batch):
+        deadline = time.monotonic() + self.max_delay
+        with self.lock:
+            while not batch.closed and (remaining := deadline - time.monotonic()) > 0:
+                self.full.wait(remaining)
+            self._close(batch)
+        try:
+            batch.outcomes = self._flush(batch.parts)
+        finally:
+            batch.done.set()
+
+    def _flush(self, parts):
+        try:
+            result = self.flush([item for part in parts for item in part])
+        except self.transient_errors as exc:
+            return [(None, exc)] * len(parts)
+        except Exception as exc:
+            if len(parts) == 1:
+                return [(None, exc)]
+            return [outcome for part in parts for outcome in self._flush([part])]
+        return [(result, None)] * len(parts)
@@ -1,15 +1,30 @@
-from .models import Event
-from .serializers import EventSerializer
-from datetime import timedelta
-from django.db import transaction
-from django.db.models import Count
-from django.db.models.functions import TruncDate
+from .serializers import EventSerializer, get_batch_validator
+from backend.middleware.rate_limiter import charge_events
+import re
+import zlib
+from datetime import date, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils import timezone
 from django.utils.dateparse import parse_date
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
-from events_service.tasks import process_event_batch
-from rest_framework.decorators import api_view
+from events_service.tasks import enqueue_events
+from events_service.utils.export import CSVExportRenderer, ExportNegotiation, NDJSONExportRenderer, ParquetExportRenderer, \
+    WRITERS, event_batches, gzipped, streamed
+from events_service.utils.hyperloglog import RELATIVE_ERROR
+from events_service.utils.idempotency import claim, complete, fingerprint, release
+from events_service.utils.metrics import CONTENT_TYPE, exposition, record_ingest
+from events_service.utils.replicas import STATS_READS, choose_database, stats_reads
+from events_service.utils.retention import PERIODS
+from events_service.utils.rollups import daily_active_users, rolling_active_users
+from events_service.utils.segments import Segment, segment_daily_active_users
+from events_service.utils.sketches import ALL_EVENT_TYPES, daily_unique_users, rolling_unique_users, unique_users
+from events_service.utils.stats_cache import cached_daily_active_users, cached_funnel, cached_retention, cached_top_events
+from events_service.utils.streaming_ingest import FingerprintingJSONParser, HashingReader, decoded, is_ndjson, stream_events
+from events_service.utils.time_range import day_range
+from rest_framework.decorators import api_view, parser_classes, renderer_classes
 from rest_framework.response import Response
 from rest_framework import status
 import logging
@@ -18,47 +33,261 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+partial_param = openapi.Parameter('partial', openapi.IN_QUERY, description="Queue valid events and return indexed errors for the rejected ones",
+                                  type=openapi.TYPE_BOOLEAN, required=False, default=False)
+content_encoding_param = openapi.Parameter('Content-Encoding', openapi.IN_HEADER,
+                                           description="gzip for compressed application/x-ndjson bodies",
+                                           type=openapi.TYPE_STRING, required=False)
+idempotency_key_param = openapi.Parameter('Idempotency-Key', openapi.IN_HEADER,
+                                          description="Retries of a batch with the same key get the first response back without being processed again",
+                                          type=openapi.TYPE_STRING, required=False)
+
+
 @swagger_auto_schema(method='post',
                      request_body=EventSerializer(many=True),
-                     responses={201: "Events ingested successfully", 400: "Validation errors"},
+                     manual_parameters=[partial_param, content_encoding_param, idempotency_key_param],
+                     responses={202: "Events queued", 400: "Validation errors", 409: "The first request with this key is in flight",
+                                415: "Unsupported Content-Encoding", 422: "Idempotency-Key reused for a different batch"},
                      operation_id='Ingest events')
 @api_view(['POST'])
+@parser_classes([FingerprintingJSONParser])
 def ingest_events(request):
+    """A JSON array of events, or application/x-ndjson (one event per line, optionally gzip-compressed).
+
+    NDJSON bodies are validated while they are read and queued in chunks, so valid lines are always
+    accepted partially and memory does not grow with the body.
+    """
     logger.info('Ingest events')
+    streamed = is_ndjson(request.content_type)
+    if not streamed and request.headers.get('Content-Encoding', 'identity').lower() != 'identity':
+        return Response({"error": "Content-Encoding is only supported for application/x-ndjson bodies"},
+                        status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    reader = HashingReader(request) if streamed else None
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if not idempotency_key:
+        return stream_ndjson(request, reader) if streamed else queue_events(request)
+    if len(idempotency_key) > 200:
+        return Response({"error": "Idempotency-Key must be at most 200 characters"}, status=status.HTTP_400_BAD_REQUEST)
+
+    key = 'request:' + idempotency_key
+    request_fingerprint = None if streamed else json_fingerprint(request)
+    record = claim(key, request_fingerprint or '')
+    if record is not None:
+        if record.status_code is None:
+            return Response({"error": "A request with this Idempotency-Key is still being processed"}, status=status.HTTP_409_CONFLICT)
+        if (reader.drain() if streamed else request_fingerprint) != record.fingerprint:
+            return Response({"error": "Idempotency-Key was already used for a different batch"},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        logger.info(f'Replayed ingest response for Idempotency-Key {idempotency_key}')
+        return Response(record.response, status=record.status_code, headers={"Idempotent-Replayed": "true"})
+    try:
+        response = stream_ndjson(request, reader) if streamed else queue_events(request)
+    except Exception:
+        release(key)
+        raise
+    if response.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+        release(key)  # not a result: the retry must be processed
+    else:
+        complete(key, response.status_code, response.data, reader.drain() if streamed else None)
+    return response
+
+
+def json_fingerprint(request):
+    """sha256 of a JSON body, taken while DRF parses it from the stream (an empty body is not parsed)."""
+    request.data
+    return getattr(request, 'body_fingerprint', None) or fingerprint(b'')
+
+
+def stream_ndjson(request, reader):
+    try:
+        read, queued, rejected, errors, limited = stream_events(
+            decoded(reader, request.headers.get('Content-Encoding')), enqueue_events,
+            lambda count, first: charge_events(request, count, paid=1 if first else 0))
+    except ValueError as exc:
+        return Response({"error": str(exc)}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    except (OSError, EOFError, zlib.error):
+        logger.error('Corrupted gzip body')
+        return Response({"error": "Body is not valid gzip"}, status=status.HTTP_400_BAD_REQUEST)
+    record_ingest('ndjson', queued, rejected)
+    response = {"queued": queued}
+    if rejected:
+        response.update({"rejected": rejected, "errors": errors})
+    if limited:
+        response.update({"detail": "Request limit exceeded", "read": read})
+        return Response(response, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    return Response(response, status=status.HTTP_202_ACCEPTED if queued else status.HTTP_400_BAD_REQUEST)
+
+
+def queue_events(request):
     if not isinstance(request.data, list):
         return Response({"error": "Expected a list of events"}, status=status.HTTP_400_BAD_REQUEST)
-    valid_events = []
-    for event_data in request.data:
-        serializer = EventSerializer(data=event_data)
-        if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        valid_events.append(serializer.validated_data)
-    process_event_batch.delay(valid_events)
-    return Response({"queued": len(valid_events)}, status=status.HTTP_202_ACCEPTED)
+    if not charge_events(request, len(request.data)):
+        return Response({"detail": "Request limit exceeded"}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    partial = request.GET.get('partial', '').lower() in ('1', 'true', 'yes')
+    valid_events, errors = get_batch_validator().validate(request.data)
+    if errors and (not partial or not valid_events):
+        record_ingest('json', 0, len(request.data))
+        return Response({"errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+    enqueue_events(valid_events)
+    record_ingest('json', len(valid_events), len(errors))
+    response = {"queued": len(valid_events)}
+    if errors:
+        response.update({"rejected": len(errors), "errors": errors})
+    return Response(response, status=status.HTTP_202_ACCEPTED)
+
+
+def metrics(request):
+    """GET /metrics: Prometheus scrape endpoint, summed over all web and worker processes sharing METRICS_DIR."""
+    return HttpResponse(exposition(), content_type=CONTENT_TYPE)
+
+
+def parse_tz(request):
+    try:
+        return ZoneInfo(request.GET.get('tz') or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def parse_optional_date(value):
+    if not value:
+        return None
+    parsed = parse_date(value)
+    if parsed is None: raise ValueError
+    return parsed
+
+
+def parse_segment(request):
+    """Returns (segment, error response); an empty segment means no filtering."""
+    try:
+        return Segment.from_query(request.GET), None
+    except ValueError as exc:
+        logger.error(f'Invalid segment {request.GET.getlist("segment")}')
+        return None, Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
 
 
 from_param = openapi.Parameter('from', openapi.IN_QUERY, description="Start date (YYYY-MM-DD)",
                                type=openapi.TYPE_STRING, format='date')
 to_param = openapi.Parameter('to', openapi.IN_QUERY, description="End date (YYYY-MM-DD)",
                              type=openapi.TYPE_STRING, format='date')
+tz_param = openapi.Parameter('tz', openapi.IN_QUERY, description="Time zone for day boundaries, e.g. Europe/Kyiv (UTC by default)",
+                             type=openapi.TYPE_STRING, required=False)
+segment_param = openapi.Parameter('segment', openapi.IN_QUERY,
+                                  description="Repeatable filter <key>:<value> on event_type or a property, e.g. event_type:purchase, "
+                                              "country:UA; properties.<key>=<value> parameters filter the same way",
+                                  type=openapi.TYPE_STRING, required=False)
+mode_param = openapi.Parameter('mode', openapi.IN_QUERY, description="exact (default) or approx (HyperLogLog sketches, UTC days)",
+                               type=openapi.TYPE_STRING, enum=['exact', 'approx'], required=False)
 
 @swagger_auto_schema(method='get',
-                     manual_parameters=[from_param, to_param],
+                     manual_parameters=[from_param, to_param, tz_param, mode_param, segment_param],
                      operation_id="Get DAU (Daily Active Users)")
 @api_view(['GET'])
 def dau_stats(request):
     logger.info('GET DAU stats')
-    date_from = request.GET.get('from')
-    date_to = request.GET.get('to')
-    query = Event.objects.all()
+    tz = parse_tz(request)
+    if tz is None:
+        return Response({"error": "tz must be a valid time zone name"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        date_from = parse_optional_date(request.GET.get('from'))
+        date_to = parse_optional_date(request.GET.get('to'))
+    except ValueError:
+        logger.error(f'Invalid date range {request.GET.get("from")} - {request.GET.get("to")}')
+        return Response({"error": "from and to must be in YYYY-MM-DD format"}, status=status.HTTP_400_BAD_REQUEST)
+    mode = request.GET.get('mode', 'exact')
+    if mode not in ('exact', 'approx'):
+        return Response({"error": "mode must be 'exact' or 'approx'"}, status=status.HTTP_400_BAD_REQUEST)
+    segment, error = parse_segment(request)
+    if error: return error
+
+    if mode == 'approx':
+        if str(tz) != 'UTC':
+            return Response({"error": "approx mode uses UTC days"}, status=status.HTTP_400_BAD_REQUEST)
+        if segment.properties:
+            return Response({"error": "approx mode only segments by event_type"}, status=status.HTTP_400_BAD_REQUEST)
+
+    with stats_reads(*day_range(date_from, date_to, tz)):
+        if mode == 'approx':
+            stats = daily_unique_users(date_from or date.min, date_to or date.max, segment.event_type or ALL_EVENT_TYPES)
+        elif date_from and date_to:
+            stats = cached_daily_active_users(date_from, date_to, tz, segment) if date_from <= date_to else []
+        elif segment:
+            stats = segment_daily_active_users(*day_range(date_from, date_to, tz), tz, segment)
+        else:
+            stats = daily_active_users(*day_range(date_from, date_to, tz), tz)
+    return Response(stats, status=status.HTTP_200_OK)
+
+
+required_from_param = openapi.Parameter('from', openapi.IN_QUERY, description="Start date (YYYY-MM-DD)",
+                                        type=openapi.TYPE_STRING, format='date', required=True)
+required_to_param = openapi.Parameter('to', openapi.IN_QUERY, description="End date (YYYY-MM-DD)",
+                                      type=openapi.TYPE_STRING, format='date', required=True)
+event_type_param = openapi.Parameter('event_type', openapi.IN_QUERY, description="Count only users with this event type",
+                                     type=openapi.TYPE_STRING, required=False)
+window_param = openapi.Parameter('window', openapi.IN_QUERY, description="Window length in days: 1 = DAU, 7 = WAU, 30 = MAU",
+                                 type=openapi.TYPE_INTEGER, required=False, default=7)
+
 
-    if date_from: query = query.filter(occurred_at__date__gte=date_from)
-    if date_to: query = query.filter(occurred_at__date__lte=date_to)
+def parse_unique_users_params(request):
+    """Returns (params, error response) for the unique/active users endpoints."""
+    try:
+        date_from = parse_optional_date(request.GET.get('from'))
+        date_to = parse_optional_date(request.GET.get('to'))
+        if not date_from or not date_to or date_from > date_to: raise ValueError
+    except ValueError:
+        logger.error(f'Invalid date range {request.GET.get("from")} - {request.GET.get("to")}')
+        return None, Response({"error": "from and to are required, in YYYY-MM-DD format, from <= to"},
+                              status=status.HTTP_400_BAD_REQUEST)
+    mode = request.GET.get('mode', 'exact')
+    if mode not in ('exact', 'approx'):
+        return None, Response({"error": "mode must be 'exact' or 'approx'"}, status=status.HTTP_400_BAD_REQUEST)
+    event_type = request.GET.get('event_type') or ''
+    return (date_from, date_to, mode, event_type), None
+
+
+@swagger_auto_schema(method='get',
+                     manual_parameters=[required_from_param, required_to_param, event_type_param, mode_param],
+                     operation_id="Unique users between two dates")
+@api_view(['GET'])
+def unique_users_stats(request):
+    logger.info('GET Unique users')
+    params, error = parse_unique_users_params(request)
+    if error: return error
+    date_from, date_to, mode, event_type = params
 
-    stats = (
-        query.annotate(day=TruncDate('occurred_at')).values('day').annotate(dau=Count('user_id', distinct=True)).order_by('day')
-    )
-    return Response(list(stats), status=status.HTTP_200_OK)
+    result = {"from": str(date_from), "to": str(date_to), "mode": mode}
+    with stats_reads(*day_range(date_from, date_to)):
+        if mode == 'approx':
+            result.update(unique_users=unique_users(date_from, date_to, event_type), relative_error=RELATIVE_ERROR)
+        else:
+            days = (date_to - date_from).days + 1
+            result.update(unique_users=rolling_active_users(date_to, date_to, days, event_type)[0]['active_users'])
+    return Response(result, status=status.HTTP_200_OK)
+
+
+@swagger_auto_schema(method='get',
+                     manual_parameters=[required_from_param, required_to_param, window_param, event_type_param, mode_param],
+                     operation_id="Rolling active users (DAU/WAU/MAU)")
+@api_view(['GET'])
+def active_users_stats(request):
+    logger.info('GET Active users')
+    params, error = parse_unique_users_params(request)
+    if error: return error
+    date_from, date_to, mode, event_type = params
+    window = request.GET.get('window', 7)
+    try:
+        window = int(window)
+        if window < 1: raise ValueError
+    except ValueError:
+        logger.error(f'Invalid window {window}')
+        return Response({"error": "window must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+    result = {"window": window, "mode": mode}
+    with stats_reads(*day_range(date_from - timedelta(days=window - 1), date_to)):
+        if mode == 'approx':
+            result.update(relative_error=RELATIVE_ERROR, stats=rolling_unique_users(date_from, date_to, window, event_type))
+        else:
+            result.update(stats=rolling_active_users(date_from, date_to, window, event_type))
+    return Response(result, status=status.HTTP_200_OK)
 
 
 optional_from_param = openapi.Parameter('from', openapi.IN_QUERY, description="Start date (YYYY-MM-DD)",
@@ -70,13 +299,20 @@ optional_limit_param = openapi.Parameter('limit', openapi.IN_QUERY, description=
 
 
 @swagger_auto_schema(method='get',
-                     manual_parameters=[optional_from_param, optional_to_param, optional_limit_param],
+                     manual_parameters=[optional_from_param, optional_to_param, optional_limit_param, tz_param, segment_param],
                      operation_id="Top events for the selected period of time")
 @api_view(['GET'])
 def top_events(request):
     logger.info('GET Top events')
-    date_to = request.GET.get('to', timezone.now().date())
-    date_from = request.GET.get('from', date_to - timedelta(days=30))
+    tz = parse_tz(request)
+    if tz is None:
+        return Response({"error": "tz must be a valid time zone name"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        date_to = parse_optional_date(request.GET.get('to')) or timezone.now().astimezone(tz).date()
+        date_from = parse_optional_date(request.GET.get('from')) or date_to - timedelta(days=30)
+    except ValueError:
+        logger.error(f'Invalid date range {request.GET.get("from")} - {request.GET.get("to")}')
+        return Response({"error": "from and to must be in YYYY-MM-DD format"}, status=status.HTTP_400_BAD_REQUEST)
     limit = request.GET.get('limit', 10)
 
     try:
@@ -85,25 +321,51 @@ def top_events(request):
     except (ValueError, TypeError):
         logger.error(f'Invalid limit value: {limit}')
         return Response({"error": "limit must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+    segment, error = parse_segment(request)
+    if error: return error
 
-    query = Event.objects.filter(occurred_at__date__gte=date_from, occurred_at__date__lte=date_to)
-    stats = (query.values('event_type').annotate(count=Count('event_type')).order_by('-count')[:limit])
-    return Response(list(stats), status=status.HTTP_200_OK)
+    with stats_reads(*day_range(date_from, date_to, tz)):
+        stats = cached_top_events(date_from, date_to, tz, limit, segment) if date_from <= date_to else []
+    return Response(stats, status=status.HTTP_200_OK)
 
 
 start_date_param = openapi.Parameter('start_date', openapi.IN_QUERY, description="Start date for cohort in YYYY-MM-DD format (required)",
                                      type=openapi.TYPE_STRING, format='date', required=True)
-windows_param = openapi.Parameter('windows', openapi.IN_QUERY, description="Number of weekly windows to analyze retention",
+windows_param = openapi.Parameter('windows', openapi.IN_QUERY, description="Number of windows to analyze retention",
                                   type=openapi.TYPE_INTEGER, required=False, default=3)
+period_param = openapi.Parameter('period', openapi.IN_QUERY, description="Window length: week (default) or day",
+                                 type=openapi.TYPE_STRING, enum=list(PERIODS), required=False, default='week')
+
+
+def parse_retention_params(request):
+    """Returns ((windows, period), error response) for the retention endpoints."""
+    windows = request.GET.get('windows', 3)
+    try:
+        windows = int(windows)
+        if windows < 1: raise ValueError
+    except ValueError:
+        logger.error(f'Invalid windows {windows}')
+        return None, Response({"error": "windows must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+    period = request.GET.get('period', 'week')
+    if period not in PERIODS:
+        logger.error(f'Invalid period {period}')
+        return None, Response({"error": f"period must be one of {list(PERIODS)}"}, status=status.HTTP_400_BAD_REQUEST)
+    return (windows, period), None
+
+
+def window_label(cohort_day, window, period_days):
+    check_start = cohort_day + timedelta(days=window * period_days)
+    check_end = check_start + timedelta(days=period_days - 1)
+    return str(check_start) + " to " + str(check_end)
+
 
 @swagger_auto_schema(method='get',
-                     manual_parameters=[start_date_param, windows_param],
+                     manual_parameters=[start_date_param, windows_param, period_param, segment_param],
                      operation_id="Simple weekly cohort retention analysis")
 @api_view(['GET'])
 def retention_stats(request):
     logger.info('GET Retention stats')
     start_date_str = request.GET.get('start_date')
-    windows = request.GET.get('windows', 3)
 
     if not start_date_str:
         logger.error(f'Missing start date')
@@ -116,20 +378,174 @@ def retention_stats(request):
         logger.error(f'Invalid start date {start_date_str}')
         return Response({"error": "start_date must be in YYYY-MM-DD format"}, status=status.HTTP_400_BAD_REQUEST)
 
+    params, error = parse_retention_params(request)
+    if error: return error
+    windows, period = params
+    segment, error = parse_segment(request)
+    if error: return error
+
+    period_days = PERIODS[period]
+    with stats_reads(*day_range(start_date, start_date + timedelta(days=windows * period_days - 1))):
+        [(_, cohort_size, counts)] = cached_retention([start_date], windows, period_days, segment)
+    retention = {window_label(start_date, window, period_days): count for window, count in enumerate(counts)}
+
+    return Response({"start_date": str(start_date), "windows": windows, "period": period, "cohort_size": cohort_size,
+                     "retention": retention}, status=status.HTTP_200_OK)
+
+
+MAX_COHORTS = 366
+
+
+@swagger_auto_schema(method='get',
+                     manual_parameters=[required_from_param, required_to_param, windows_param, period_param, segment_param],
+                     operation_id="Cohort x window retention matrix")
+@api_view(['GET'])
+def retention_matrix_stats(request):
+    logger.info('GET Retention matrix')
     try:
-        windows = int(windows)
-        if windows < 1: raise ValueError
+        date_from = parse_optional_date(request.GET.get('from'))
+        date_to = parse_optional_date(request.GET.get('to'))
+        if not date_from or not date_to or date_from > date_to: raise ValueError
     except ValueError:
-        logger.error(f'Invalid windows {windows}')
-        return Response({"error": "windows must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+        logger.error(f'Invalid date range {request.GET.get("from")} - {request.GET.get("to")}')
+        return Response({"error": "from and to are required, in YYYY-MM-DD format, from <= to"},
+                        status=status.HTTP_400_BAD_REQUEST)
+    params, error = parse_retention_params(request)
+    if error: return error
+    windows, period = params
+    segment, error = parse_segment(request)
+    if error: return error
+
+    period_days = PERIODS[period]
+    cohort_days = [date_from + timedelta(days=i) for i in range(0, (date_to - date_from).days + 1, period_days)]
+    if len(cohort_days) > MAX_COHORTS:
+        return Response({"error": f"at most {MAX_COHORTS} cohorts per request"}, status=status.HTTP_400_BAD_REQUEST)
+
+    with stats_reads(*day_range(date_from, cohort_days[-1] + timedelta(days=windows * period_days - 1))):
+        cohorts = [{"start_date": str(cohort_day), "cohort_size": cohort_size, "retention": counts}
+                   for cohort_day, cohort_size, counts in cached_retention(cohort_days, windows, period_days, segment)]
+    return Response({"period": period, "windows": windows, "cohorts": cohorts}, status=status.HTTP_200_OK)
+
+
+MAX_FUNNEL_STEPS = 10
+MAX_FUNNEL_WINDOW = timedelta(days=90)
+WINDOW_UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}
+WINDOW_PATTERN = re.compile(r'^(\d+)([smhd])$')
+
+steps_param = openapi.Parameter('steps', openapi.IN_QUERY, description="Comma-separated event types in funnel order, e.g. view_item,add_to_cart,purchase",
+                                type=openapi.TYPE_STRING, required=True)
+funnel_window_param = openapi.Parameter('window', openapi.IN_QUERY,
+                                        description="Time from the first step to the last one: <n>s, <n>m, <n>h or <n>d (24h by default)",
+                                        type=openapi.TYPE_STRING, required=False, default='24h')
+
+
+def parse_window(value):
+    """timedelta of '30m', '24h', '7d'...; None when malformed or out of range."""
+    match = WINDOW_PATTERN.match(value)
+    if not match:
+        return None
+    window = timedelta(**{WINDOW_UNITS[match[2]]: int(match[1])})
+    return window if timedelta(0) < window <= MAX_FUNNEL_WINDOW else None
+
+
+@swagger_auto_schema(method='get',
+                     manual_parameters=[steps_param, funnel_window_param, required_from_param, required_to_param, tz_param],
+                     operation_id="Conversion funnel")
+@api_view(['GET'])
+def funnel_stats(request):
+    logger.info('GET Funnel')
+    tz = parse_tz(request)
+    if tz is None:
+        return Response({"error": "tz must be a valid time zone name"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        date_from = parse_optional_date(request.GET.get('from'))
+        date_to = parse_optional_date(request.GET.get('to'))
+        if not date_from or not date_to or date_from > date_to: raise ValueError
+    except ValueError:
+        logger.error(f'Invalid date range {request.GET.get("from")} - {request.GET.get("to")}')
+        return Response({"error": "from and to are required, in YYYY-MM-DD format, from <= to"},
+                        status=status.HTTP_400_BAD_REQUEST)
+    steps = [step.strip() for step in request.GET.get('steps', '').split(',') if step.strip()]
+    if not 2 <= len(steps) <= MAX_FUNNEL_STEPS or len(set(steps)) != len(steps):
+        logger.error(f'Invalid funnel steps {request.GET.get("steps")}')
+        return Response({"error": f"steps must list 2 to {MAX_FUNNEL_STEPS} distinct event types"},
+                        status=status.HTTP_400_BAD_REQUEST)
+    window_value = request.GET.get('window', '24h')
+    window = parse_window(window_value)
+    if window is None:
+        logger.error(f'Invalid funnel window {window_value}')
+        return Response({"error": f"window must look like 30m, 24h or 7d, at most {MAX_FUNNEL_WINDOW.days}d"},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    start, end = day_range(date_from, date_to, tz)
+    with stats_reads(start, end + window):
+        stats = cached_funnel(date_from, date_to, tz, steps, window)
+    entered = stats[0]["users"]
+    steps = [dict(step, conversion=round(step["users"] / entered, 4) if entered else None) for step in stats]
+    return Response({"from": str(date_from), "to": str(date_to), "window": window_value, "steps": steps},
+                    status=status.HTTP_200_OK)
+
+
+export_format_param = openapi.Parameter('format', openapi.IN_QUERY,
+                                        description="csv (default, the import_events layout), ndjson (the POST /api/events shape) or parquet",
+                                        type=openapi.TYPE_STRING, enum=list(WRITERS), required=False, default='csv')
+gzip_param = openapi.Parameter('gzip', openapi.IN_QUERY, description="Compress csv and ndjson on the fly",
+                               type=openapi.TYPE_BOOLEAN, required=False, default=False)
+
+
+def export_error(message):
+    # The export renderers are picked for the rows; an error is JSON whichever format was asked for
+    return Response({"error": message}, status=status.HTTP_400_BAD_REQUEST, content_type='application/json')
+
+
+@swagger_auto_schema(method='get',
+                     manual_parameters=[required_from_param, required_to_param, tz_param, event_type_param, segment_param,
+                                        export_format_param, gzip_param],
+                     operation_id="Export raw events")
+@api_view(['GET'])
+@renderer_classes([CSVExportRenderer, NDJSONExportRenderer, ParquetExportRenderer])
+def export_events(request):
+    """Streams the events of a date range, archived days included, without holding them in memory:
+    a server-side cursor is read EXPORT_FETCH_ROWS rows at a time and each batch is written out."""
+    logger.info('GET Export events')
+    tz = parse_tz(request)
+    if tz is None:
+        return export_error("tz must be a valid time zone name")
+    try:
+        date_from = parse_optional_date(request.GET.get('from'))
+        date_to = parse_optional_date(request.GET.get('to'))
+        if not date_from or not date_to or date_from > date_to: raise ValueError
+    except ValueError:
+        logger.error(f'Invalid date range {request.GET.get("from")} - {request.GET.get("to")}')
+        return export_error("from and to are required, in YYYY-MM-DD format, from <= to")
+    export_format = request.accepted_renderer.format
+    if request.GET.get('format', export_format) != export_format:
+        return export_error(f"format must be one of {', '.join(WRITERS)}")
+    compress = request.GET.get('gzip', '').lower() in ('1', 'true', 'yes')
+    if compress and export_format == 'parquet':
+        return export_error("parquet is compressed already, gzip applies to csv and ndjson")
+    segment, error = parse_segment(request)
+    if error:
+        return export_error(error.data['error'])
+    event_type = request.GET.get('event_type')
+    if event_type:
+        if segment.event_type not in (None, event_type):
+            return export_error("conflicting segment filters on 'event_type'")
+        segment.event_type = event_type
 
-    cohort_users = Event.objects.filter(occurred_at__date=start_date).values_list('user_id', flat=True).distinct()
+    # The rows are read after the view returns: the database is picked here, not with stats_reads
+    start, end = day_range(date_from, date_to, tz)
+    alias, reason = choose_database(start, end)
+    STATS_READS.inc(alias, reason)
+    chunks = WRITERS[export_format](event_batches(alias, start, end, segment, settings.EXPORT_FETCH_ROWS))
+    filename = f'events_{date_from}_{date_to}.{export_format}'
+    if compress:
+        chunks = gzipped(chunks)
+        filename += '.gz'
+    response = StreamingHttpResponse(streamed(request._request, chunks),
+                                     content_type='application/gzip' if compress else request.accepted_media_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
-    retention = {}
-    for week in range(windows):
-        check_start = start_date + timedelta(weeks=week)
-        check_end = check_start + timedelta(days=6)  # тиждень = 7 днів
-        active_users = Event.objects.filter(occurred_at__date__gte=check_start, occurred_at__date__lte=check_end, user_id__in=cohort_users).values('user_id').distinct().count()
-        retention[str(check_start) + " to " + str(check_end)] = active_users
 
-    return Response({"start_date": str(start_date), "windows": windows, "retention": retention}, status=status.HTTP_200_OK)
+export_events.cls.content_negotiation_class = ExportNegotiation  # @api_view has no decorator for it